@@ -0,0 +1,23 @@
+from mailing.models import PRIORITY_NOTIFICATION
+from mailing.tasks import send_email, task
+from service.utils import get_view_counter_notification
+
+
+@task(priority=PRIORITY_NOTIFICATION)
+def notify_views_count(views_count, title):
+    """
+    Send the view count notification of a post in the background.
+
+    Args:
+        views_count (int): The view count of the post.
+        title (str): The title of the post.
+
+    Returns:
+        None
+    """
+    notification = get_view_counter_notification(views_count, title)
+    if notification is not None:
+        subject, message, recipient_list = notification
+        send_email(
+            subject, message, recipient_list, priority=PRIORITY_NOTIFICATION
+        )
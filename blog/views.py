@@ -9,6 +9,7 @@ from pytils.translit import slugify
 
 from blog.forms import PostForm
 from blog.models import Posts
+from blog.tasks import notify_views_count
 
 
 class PostSlugifyMixin:
@@ -158,6 +159,9 @@ class PostDetailView(DetailView):
         """
         Override to increment the views count of the post.
 
+        When the post reaches 100 views, the author is notified in the
+        background.
+
         Args:
             queryset: The queryset of posts.
 
@@ -166,11 +170,13 @@ class PostDetailView(DetailView):
         """
         self.object = super().get_object(queryset)
         self.object.views_count += 1
-
-        # TODO: Implement email notification
-        #       service.utils.view_counter_email_notification
         self.object.save()
 
+        if self.object.views_count == 100:
+            notify_views_count.delay(
+                self.object.views_count, self.object.title
+            )
+
         return self.object
 
 
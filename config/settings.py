@@ -38,6 +38,135 @@ EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD')
 EMAIL_PORT = 587
 EMAIL_USE_TLS = True
 
+# MAILING SETTINGS
+# Number of messages sent over one SMTP connection per send_messages call
+MAILING_CHUNK_SIZE = int(os.getenv('MAILING_CHUNK_SIZE', 100))
+# Number of recipient rows fetched from the database cursor at a time
+MAILING_ITERATOR_CHUNK_SIZE = int(
+    os.getenv('MAILING_ITERATOR_CHUNK_SIZE', 2000)
+)
+# Send every normalised address of a contact list once, de-duplicated in
+# the database, or with an in-memory hash set in the sending process
+MAILING_DEDUPLICATE_IN_DB = (
+    os.getenv('MAILING_DEDUPLICATE_IN_DB', 'True') == 'True'
+)
+# Send the recipients of a run partitioned by email domain, draining up
+# to MAILING_DOMAIN_WORKERS domains at the same time
+MAILING_GROUP_BY_DOMAIN = os.getenv('MAILING_GROUP_BY_DOMAIN') == 'True'
+MAILING_DOMAIN_WORKERS = int(os.getenv('MAILING_DOMAIN_WORKERS', 4))
+# Delivery engine of in-process runs: 'smtp' sends every message with a
+# blocking call, 'async' keeps MAILING_ASYNC_SESSIONS concurrent SMTP
+# sessions fed from a queue of at most MAILING_ASYNC_QUEUE_SIZE messages
+MAILING_ENGINE = os.getenv('MAILING_ENGINE', 'smtp')
+MAILING_ASYNC_SESSIONS = int(os.getenv('MAILING_ASYNC_SESSIONS', 8))
+MAILING_ASYNC_QUEUE_SIZE = int(os.getenv('MAILING_ASYNC_QUEUE_SIZE', 200))
+# Mailings are sent by `manage.py run_scheduler` unless crontab is enabled
+MAILING_USE_CRONTAB = os.getenv('MAILING_USE_CRONTAB') == 'True'
+# Seconds between two reloads of the mailing settings by the scheduler
+MAILING_SCHEDULER_RELOAD_INTERVAL = int(
+    os.getenv('MAILING_SCHEDULER_RELOAD_INTERVAL', 30)
+)
+# Enqueue runs into the outbox for `manage.py send_worker` instead of
+# sending them in the process that runs the mailing
+MAILING_USE_OUTBOX = os.getenv('MAILING_USE_OUTBOX') == 'True'
+# Render runs into a maildir spool per run under MAILING_SPOOL_DIR that
+# `manage.py ship_spool` sends, instead of sending while rendering
+MAILING_USE_SPOOL = os.getenv('MAILING_USE_SPOOL') == 'True'
+MAILING_SPOOL_DIR = os.getenv('MAILING_SPOOL_DIR', BASE_DIR / 'spool')
+# Freeze the recipients of runs into a snapshot split into ranges of
+# MAILING_SNAPSHOT_RANGE_SIZE recipients sent by `manage.py send_ranges`
+MAILING_USE_SNAPSHOT = os.getenv('MAILING_USE_SNAPSHOT') == 'True'
+MAILING_SNAPSHOT_RANGE_SIZE = int(
+    os.getenv('MAILING_SNAPSHOT_RANGE_SIZE', 1000)
+)
+# Number of outbox messages claimed by a worker at a time
+MAILING_OUTBOX_BATCH_SIZE = int(os.getenv('MAILING_OUTBOX_BATCH_SIZE', 100))
+# Seconds a claimed outbox message stays locked by its worker
+MAILING_OUTBOX_LEASE = int(os.getenv('MAILING_OUTBOX_LEASE', 300))
+# Number of claimed outbox messages sent between two renewals of their
+# lease, so a slow batch is not reclaimed by another worker
+MAILING_OUTBOX_LEASE_BATCH = int(os.getenv('MAILING_OUTBOX_LEASE_BATCH', 10))
+# Seconds a worker waits before polling an empty outbox again
+MAILING_OUTBOX_IDLE_SLEEP = float(os.getenv('MAILING_OUTBOX_IDLE_SLEEP', 5))
+# Call `@task` functions in the request instead of enqueueing them for
+# `manage.py run_tasks`
+TASKS_EAGER = os.getenv('TASKS_EAGER') == 'True'
+# Number of background tasks claimed by a worker at a time
+TASKS_BATCH_SIZE = int(os.getenv('TASKS_BATCH_SIZE', 10))
+# Attempts of a failed background task before it is marked as failed
+TASKS_MAX_ATTEMPTS = int(os.getenv('TASKS_MAX_ATTEMPTS', 5))
+# Days finished background tasks are kept before `manage.py purge_tasks`
+# deletes them
+TASKS_RETENTION_DAYS = int(os.getenv('TASKS_RETENTION_DAYS', 7))
+# Outbox workers share batches between users in deficit round-robin,
+# a user gets MAILING_FAIR_SHARE_QUANTUM messages per turn times the
+# weight of their sending limits
+MAILING_FAIR_SHARE_QUANTUM = int(os.getenv('MAILING_FAIR_SHARE_QUANTUM', 100))
+# Seconds a worker reuses the list of users with claimable messages
+MAILING_FAIR_SHARE_USERS_TTL = float(
+    os.getenv('MAILING_FAIR_SHARE_USERS_TTL', 5)
+)
+# Default number of batches of a user sent at a time and of messages of
+# a user sent per day (0 is unlimited), shared by workers with Redis
+MAILING_USER_CONCURRENCY = int(os.getenv('MAILING_USER_CONCURRENCY', 4))
+MAILING_USER_DAILY_QUOTA = int(os.getenv('MAILING_USER_DAILY_QUOTA', 0))
+# Seconds of the lease of the lock a mailing is run under, the lease is
+# renewed every third of it while the mailing is sent
+MAILING_LOCK_LEASE = int(os.getenv('MAILING_LOCK_LEASE', 60))
+# Failed deliveries are retried after MAILING_RETRY_BASE_DELAY seconds,
+# doubling the delay up to MAILING_RETRY_MAX_DELAY seconds per attempt
+MAILING_RETRY_BASE_DELAY = int(os.getenv('MAILING_RETRY_BASE_DELAY', 60))
+MAILING_RETRY_MAX_DELAY = int(os.getenv('MAILING_RETRY_MAX_DELAY', 3600))
+MAILING_RETRY_MAX_ATTEMPTS = int(os.getenv('MAILING_RETRY_MAX_ATTEMPTS', 5))
+# Token bucket limits of outgoing mail as (messages per second, burst)
+# pairs for the SMTP account and for every recipient domain. The buckets
+# are kept in the default cache, so workers share one budget with Redis.
+MAILING_RATE_LIMIT_ENABLED = (
+    os.getenv('MAILING_RATE_LIMIT_ENABLED', 'True') == 'True'
+)
+MAILING_RATE_LIMITS = {
+    'account': (5, 20),
+    'domain': (2, 10),
+    'domains': {
+        'gmail.com': (1, 5),
+        'yandex.ru': (1, 5),
+        'mail.ru': (1, 5),
+    },
+}
+# Shares of the burst of every bucket of MAILING_RATE_LIMITS reserved
+# per priority class of outgoing mail. A class may use the whole budget,
+# except for the shares of the higher classes. Every share must be above
+# 0 and the shares must not exceed 1 in total.
+MAILING_PRIORITY_SHARES = {
+    'transactional': 0.2,
+    'notification': 0.1,
+    'campaign': 0.7,
+}
+# Personal unsubscribe link sent in the List-Unsubscribe header, the
+# `{token}` placeholder is replaced by the signed recipient address
+MAILING_UNSUBSCRIBE_URL = os.getenv('MAILING_UNSUBSCRIBE_URL', '')
+# Number of envelope recipients a mailing without merge fields is sent
+# to in one SMTP transaction, 1 sends a separate message per recipient
+MAILING_ENVELOPE_BATCH_SIZE = int(
+    os.getenv('MAILING_ENVELOPE_BATCH_SIZE', 1)
+)
+# Suppression lists with more addresses than the threshold are loaded
+# into a Bloom filter with the given false positive rate instead of a set
+MAILING_SUPPRESSION_BLOOM_THRESHOLD = int(
+    os.getenv('MAILING_SUPPRESSION_BLOOM_THRESHOLD', 1000000)
+)
+MAILING_SUPPRESSION_ERROR_RATE = float(
+    os.getenv('MAILING_SUPPRESSION_ERROR_RATE', 1e-6)
+)
+# DKIM signing of outgoing mail, enabled when a private key is set.
+# Messages are signed by DKIM_WORKERS processes, one per core if 0.
+DKIM_DOMAIN = os.getenv('DKIM_DOMAIN')
+DKIM_SELECTOR = os.getenv('DKIM_SELECTOR', 'default')
+DKIM_PRIVATE_KEY_PATH = os.getenv('DKIM_PRIVATE_KEY_PATH')
+DKIM_WORKERS = int(os.getenv('DKIM_WORKERS', 0))
+# Number of per-recipient delivery logs written in one bulk insert
+DELIVERY_LOG_BUFFER_SIZE = int(os.getenv('DELIVERY_LOG_BUFFER_SIZE', 500))
+
 ALLOWED_HOSTS = []
 
 # Application definition
@@ -2,7 +2,7 @@ from typing import Tuple
 
 from django.contrib import admin
 
-from contacts.models import ContactsList, Lists, Contacts
+from contacts.models import ContactsList, Lists, Contacts, Suppression
 
 
 @admin.register(Contacts)
@@ -59,3 +59,23 @@ class ContactsListAdmin(admin.ModelAdmin):
     )
 
     search_fields: Tuple[str] = ('contact', 'list',)
+
+
+@admin.register(Suppression)
+class SuppressionAdmin(admin.ModelAdmin):
+    list_display: Tuple[str] = (
+        'id',
+        'email',
+        'reason',
+        'user',
+        'date_added',
+    )
+
+    list_display_links: Tuple[str] = ('email',)
+
+    list_filter: Tuple[str] = (
+        'reason',
+        'date_added',
+    )
+
+    search_fields: Tuple[str] = ('email',)
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.4 on 2026-10-17 17:18
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('contacts', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Suppression',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('email', models.EmailField(max_length=255, verbose_name='почта')),
+                ('reason', models.CharField(choices=[('unsubscribed', 'Отписка'), ('bounced', 'Недоставка'), ('complained', 'Жалоба')], default='unsubscribed', max_length=50, verbose_name='причина')),
+                ('date_added', models.DateTimeField(auto_now_add=True, verbose_name='дата добавления')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='suppressions', to=settings.AUTH_USER_MODEL, verbose_name='пользователь')),
+            ],
+            options={
+                'verbose_name': 'исключённый адрес',
+                'verbose_name_plural': 'исключённые адреса',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='suppression',
+            constraint=models.UniqueConstraint(fields=('user', 'email'), name='suppression_user_email_uniq'),
+        ),
+    ]
@@ -156,3 +156,67 @@ class ContactsList(models.Model):
         verbose_name = 'список контакта'
         verbose_name_plural = 'списки контактов'
         ordering = ('list',)
+
+
+class Suppression(models.Model):
+    """
+    Represents an email address that must not receive mailings of a user.
+
+    Suppressed addresses are skipped by every mailing of the user,
+    regardless of the lists they are in. The email is stored lowercased.
+
+    Attributes:
+        user (ForeignKey): The user the suppression applies to.
+        email (str): The normalised suppressed email address.
+        reason (str): Why the address is suppressed (unsubscribed,
+            bounced, complained).
+        date_added (datetime): The date and time when the address was
+            suppressed.
+
+    Meta:
+        verbose_name (str): The singular name for this model in the
+        admin interface.
+        verbose_name_plural (str): The plural name for this model in
+        the admin interface.
+        constraints (list): One suppression per email of a user.
+    """
+    REASON_UNSUBSCRIBED = 'unsubscribed'
+    REASON_BOUNCED = 'bounced'
+    REASON_COMPLAINED = 'complained'
+
+    REASONS = (
+        (REASON_UNSUBSCRIBED, 'Отписка'),
+        (REASON_BOUNCED, 'Недоставка'),
+        (REASON_COMPLAINED, 'Жалоба'),
+    )
+
+    user = models.ForeignKey(
+        'users.User',
+        on_delete=models.CASCADE,
+        related_name='suppressions',
+        verbose_name='пользователь'
+    )
+    email = models.EmailField(max_length=255, verbose_name='почта')
+    reason = models.CharField(
+        max_length=50,
+        choices=REASONS,
+        default=REASON_UNSUBSCRIBED,
+        verbose_name='причина'
+    )
+    date_added = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='дата добавления'
+    )
+
+    def __str__(self):
+        return f'{self.email} ({self.reason})'
+
+    class Meta:
+        verbose_name = 'исключённый адрес'
+        verbose_name_plural = 'исключённые адреса'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('user', 'email'),
+                name='suppression_user_email_uniq'
+            ),
+        ]
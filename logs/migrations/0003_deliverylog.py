@@ -0,0 +1,34 @@
+# Generated by Django 4.2.4 on 2026-10-17 16:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0005_mailingrun_checkpoint'),
+        ('contacts', '0002_initial'),
+        ('logs', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeliveryLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('email', models.EmailField(max_length=255, verbose_name='почта')),
+                ('smtp_code', models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='код SMTP')),
+                ('latency', models.FloatField(verbose_name='задержка, мс')),
+                ('error', models.TextField(blank=True, null=True, verbose_name='ошибка')),
+                ('date_created', models.DateTimeField(default=django.utils.timezone.now, verbose_name='дата отправки')),
+                ('contact', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='contacts.contacts', verbose_name='контакт')),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deliveries', to='mailing.mailingrun', verbose_name='запуск рассылки')),
+            ],
+            options={
+                'verbose_name': 'доставка',
+                'verbose_name_plural': 'доставки',
+            },
+        ),
+    ]
@@ -1,6 +1,8 @@
 from django.db import models
+from django.utils import timezone
 
-from mailing.models import Mailing
+from contacts.models import Contacts
+from mailing.models import Mailing, MailingRun
 
 # Define a dictionary for fields that can be nullable
 NULLABLE = {'blank': True, 'null': True}
@@ -65,3 +67,63 @@ class Logging(models.Model):
     class Meta:
         verbose_name = 'Настройки рассылки'
         verbose_name_plural = 'настройки рассылок'
+
+
+class DeliveryLog(models.Model):
+    """
+    Model for logging the delivery of a mailing to a single recipient.
+
+    Delivery logs are written in bulk by `logs.service.DeliveryLogBuffer`
+    while a mailing is being sent.
+
+    Attributes:
+        run (ForeignKey): The mailing run the delivery belongs to.
+        contact (ForeignKey): The recipient contact.
+        email (EmailField): The recipient email address.
+        smtp_code (PositiveSmallIntegerField): The SMTP reply code, empty
+            if the server could not be reached.
+        latency (FloatField): The time spent delivering the message in
+            milliseconds.
+        error (TextField): The error message of a failed delivery.
+        date_created (DateTimeField): The timestamp of the delivery.
+
+    Methods:
+        __str__: String representation of the delivery log entry.
+
+    Meta:
+        verbose_name (str): The singular name of the model.
+        verbose_name_plural (str): The plural name of the model.
+    """
+    run = models.ForeignKey(
+        MailingRun,
+        on_delete=models.CASCADE,
+        related_name='deliveries',
+        verbose_name='запуск рассылки'
+    )
+    contact = models.ForeignKey(
+        Contacts,
+        on_delete=models.SET_NULL,
+        verbose_name='контакт',
+        **NULLABLE
+    )
+    email = models.EmailField(max_length=255, verbose_name='почта')
+    smtp_code = models.PositiveSmallIntegerField(
+        verbose_name='код SMTP',
+        **NULLABLE
+    )
+    latency = models.FloatField(verbose_name='задержка, мс')
+    error = models.TextField(
+        verbose_name='ошибка',
+        **NULLABLE
+    )
+    date_created = models.DateTimeField(
+        default=timezone.now,
+        verbose_name='дата отправки'
+    )
+
+    def __str__(self):
+        return f'{self.email} ({self.smtp_code})'
+
+    class Meta:
+        verbose_name = 'доставка'
+        verbose_name_plural = 'доставки'
@@ -0,0 +1,70 @@
+from django.conf import settings
+
+from logs.models import DeliveryLog
+
+
+class DeliveryLogBuffer:
+    """
+    Buffer of per-recipient delivery logs written with bulk inserts.
+
+    Logs are kept in memory and written with a single `bulk_create` every
+    `size` rows, so logging does not add a database round trip per
+    delivered message. The buffer can be used as a context manager that
+    flushes the remaining rows on exit.
+
+    Attributes:
+        size (int): The number of rows that triggers a flush.
+
+    Methods:
+        add: Add the result of one delivery to the buffer.
+        flush: Write the buffered rows to the database.
+    """
+
+    def __init__(self, size=None):
+        if size is None:
+            size = settings.DELIVERY_LOG_BUFFER_SIZE
+        self.size = size
+        self._rows = []
+
+    def add(self, run_id, contact_id, email, result):
+        """
+        Add the result of one delivery to the buffer.
+
+        Args:
+            run_id (int): The primary key of the mailing run.
+            contact_id (int): The primary key of the recipient contact.
+            email (str): The recipient email address.
+            result (DeliveryResult): The result of the delivery.
+
+        Returns:
+            None
+        """
+        self._rows.append(
+            DeliveryLog(
+                run_id=run_id,
+                contact_id=contact_id,
+                email=email,
+                smtp_code=result.smtp_code,
+                latency=result.latency,
+                error=result.error,
+            )
+        )
+        if len(self._rows) >= self.size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered rows to the database.
+
+        Returns:
+            None
+        """
+        if self._rows:
+            DeliveryLog.objects.bulk_create(self._rows)
+            self._rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
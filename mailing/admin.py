@@ -1,3 +1,20 @@
+from typing import Tuple
+
 from django.contrib import admin
 
-# Register your models here.
+from mailing.models import SendingLimits
+
+
+@admin.register(SendingLimits)
+class SendingLimitsAdmin(admin.ModelAdmin):
+    list_display: Tuple[str] = (
+        'id',
+        'user',
+        'weight',
+        'max_concurrency',
+        'daily_quota',
+    )
+
+    list_display_links: Tuple[str] = ('user',)
+
+    search_fields: Tuple[str] = ('user__email',)
@@ -0,0 +1,458 @@
+import io
+import os
+import subprocess
+import tempfile
+import time
+from contextlib import redirect_stdout
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import connection as db_connection
+from django.test.utils import override_settings
+
+from contacts.models import Contacts, ContactsList, Lists
+from logs.models import DeliveryLog
+from mailing.cron import run_mailing
+from mailing.models import Mailing, MailingRun
+from mailing.recipients import Recipient
+from mailing.rendering import CompiledMailing
+from mailing.sender import build_message, chunked, send_in_chunks
+from mailing.signing import DkimSigner
+from mailing.smtp_async import AsyncEngine, send_in_chunks_async
+from mailing.smtp_sink import SMTPSink
+from service.utils import get_memory_usage
+from users.models import User
+
+# Content of the mailings used by the benchmarks
+BENCHMARK_TEXT = 'Текст рассылки. ' * 100
+BENCHMARK_TITLE = 'Новости для {{ email }}'
+BENCHMARK_CONTENT = (
+    'Здравствуйте, {{ email }}!\n\n'
+    'Вы получили это письмо как участник списка "{{ list_name }}".\n'
+    'Ваш номер телефона: {{ telephone }}.\n\n'
+    + BENCHMARK_TEXT
+)
+
+
+# Email domains of the seeded contacts
+BENCHMARK_DOMAINS = ('example.com', 'example.org', 'example.net')
+# Numbers of recipients of the end-to-end send benchmark
+BENCHMARK_SIZES = (1000, 10000, 100000)
+
+
+def make_mailing(title=BENCHMARK_TITLE, content=BENCHMARK_CONTENT):
+    """
+    Build an unsaved mailing for a benchmark.
+
+    Args:
+        title (str, optional): The message title.
+        content (str, optional): The message content.
+
+    Returns:
+        Mailing: The mailing with an unsaved contact list.
+    """
+    mailing = Mailing(
+        title='benchmark',
+        message_title=title,
+        message_content=content,
+    )
+    # A truthy primary key, so the name of the list is rendered
+    mailing.contact_list = Lists(pk=1, name='benchmark')
+    return mailing
+
+
+def make_recipients(count):
+    """
+    Generate synthetic recipients.
+
+    Args:
+        count (int): The number of recipients.
+
+    Yields:
+        Recipient: The next synthetic recipient.
+    """
+    for number in range(count):
+        yield Recipient(number, f'contact{number}@example.com', '+70000000000')
+
+
+def measure(function, count):
+    """
+    Call a function for `count` synthetic recipients and time it.
+
+    Args:
+        function (callable): Called with every recipient.
+        count (int): The number of recipients.
+
+    Returns:
+        dict: The number of seconds spent.
+    """
+    started = time.perf_counter()
+    for recipient in make_recipients(count):
+        function(recipient)
+    return {'seconds': time.perf_counter() - started}
+
+
+def measure_bytes(function, count):
+    """
+    Time a function returning bytes for `count` synthetic recipients.
+
+    Args:
+        function (callable): Called with every recipient, returns bytes.
+        count (int): The number of recipients.
+
+    Returns:
+        dict: The number of seconds spent and of bytes generated.
+    """
+    generated = 0
+    started = time.perf_counter()
+    for recipient in make_recipients(count):
+        generated += len(function(recipient))
+    return {'seconds': time.perf_counter() - started, 'bytes': generated}
+
+
+def bench_render(count=100000):
+    """
+    Compare the cost of rendering personalised messages.
+
+    Measures sending the content verbatim, rendering plain merge fields
+    compiled once per run, rendering a Django template compiled once per
+    run and parsing the Django template again for every recipient.
+
+    Args:
+        count (int, optional): The number of recipients.
+
+    Returns:
+        dict: The measurements of every strategy.
+    """
+    verbatim = CompiledMailing(make_mailing('Новости', 'Текст рассылки.'))
+    compiled = CompiledMailing(make_mailing())
+    # A filter forces the Django template engine
+    template_content = BENCHMARK_CONTENT.replace(
+        '{{ email }}', '{{ email|lower }}'
+    )
+    template = CompiledMailing(make_mailing(content=template_content))
+
+    def reparse(recipient):
+        CompiledMailing(template.mailing).render(recipient)
+
+    return {
+        'verbatim': measure(verbatim.render, count),
+        'merge fields': measure(compiled.render, count),
+        'django template': measure(template.render, count),
+        'parsed per recipient': measure(reparse, count),
+    }
+
+
+def bench_mime(count=100000):
+    """
+    Compare the cost of serialising the messages of a mailing.
+
+    Measures encoding a new EmailMessage for every recipient against
+    splicing the recipient headers into the MIME message encoded once
+    per run.
+
+    Args:
+        count (int, optional): The number of recipients.
+
+    Returns:
+        dict: The measurements of every strategy.
+    """
+    compiled = CompiledMailing(make_mailing('Новости', BENCHMARK_TEXT))
+
+    def encode(recipient):
+        message = EmailMessage(
+            compiled.mailing.message_title,
+            compiled.mailing.message_content,
+            to=[recipient.email],
+        )
+        return message.message().as_bytes(linesep='\r\n')
+
+    def splice(recipient):
+        message = build_message(compiled, recipient)
+        return message.message().as_bytes(linesep='\r\n')
+
+    return {
+        'encoded per recipient': measure_bytes(encode, count),
+        'encoded once per run': measure_bytes(splice, count),
+    }
+
+
+def get_private_key():
+    """
+    Get a private key for the DKIM benchmark.
+
+    Returns:
+        bytes: The configured DKIM private key, or a new 2048-bit RSA key
+            generated with openssl if none is configured.
+    """
+    if settings.DKIM_PRIVATE_KEY_PATH:
+        with open(settings.DKIM_PRIVATE_KEY_PATH, 'rb') as key_file:
+            return key_file.read()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'dkim.pem')
+        subprocess.run(
+            ('openssl', 'genrsa', '-out', path, '2048'),
+            check=True,
+            capture_output=True,
+        )
+        with open(path, 'rb') as key_file:
+            return key_file.read()
+
+
+def bench_dkim(count=100000):
+    """
+    Measure DKIM signing throughput with a growing number of processes.
+
+    Every signer is warmed up before it is timed, so the measurements do
+    not include starting the worker processes.
+
+    Args:
+        count (int, optional): The number of recipients.
+
+    Returns:
+        dict: The measurements for 1, 2, 4... processes up to the number
+            of cores.
+    """
+    private_key = get_private_key()
+    compiled = CompiledMailing(make_mailing('Новости', BENCHMARK_TEXT))
+    messages = [
+        build_message(compiled, recipient)
+        for recipient in make_recipients(count)
+    ]
+
+    results = {}
+    workers = 1
+    while True:
+        signer = DkimSigner(
+            private_key, 'benchmark', 'example.com', workers=workers
+        )
+        try:
+            list(signer.sign_messages(messages[:workers]))
+            started = time.perf_counter()
+            for message in signer.sign_messages(messages):
+                pass
+            results[f'{workers} processes'] = {
+                'seconds': time.perf_counter() - started,
+                'workers': workers,
+            }
+        finally:
+            signer.close()
+
+        if workers >= os.cpu_count():
+            return results
+        workers = min(workers * 2, os.cpu_count())
+
+
+def measure_reports(reports):
+    """
+    Consume the chunk reports of a send and time it.
+
+    Args:
+        reports (iterable): The ChunkReport instances of the send.
+
+    Returns:
+        dict: The number of seconds spent and of delivered messages.
+    """
+    sent = 0
+    started = time.perf_counter()
+    for report in reports:
+        sent += report.sent
+    return {'seconds': time.perf_counter() - started, 'sent': sent}
+
+
+@override_settings(MAILING_RATE_LIMIT_ENABLED=False)
+def bench_engines(count=100000, latency=0.005):
+    """
+    Compare the delivery engines against a local SMTP sink.
+
+    The sink waits `latency` seconds before accepting every message to
+    simulate a remote relay. Rate limiting is disabled, so only the
+    delivery itself is measured.
+
+    Args:
+        count (int, optional): The number of recipients.
+        latency (float, optional): The reply latency of the sink.
+
+    Returns:
+        dict: The measurements of every engine.
+    """
+    mailing = make_mailing()
+    with SMTPSink(latency=latency) as sink:
+        connection = get_connection(
+            host=sink.host,
+            port=sink.port,
+            username='',
+            password='',
+            use_tls=False,
+            use_ssl=False,
+        )
+        engine = AsyncEngine(
+            host=sink.host,
+            port=sink.port,
+            username='',
+            password='',
+            use_tls=False,
+            use_ssl=False,
+        )
+        results = {
+            'smtp': measure_reports(send_in_chunks(
+                mailing, make_recipients(count), connection=connection
+            )),
+        }
+        with engine:
+            results[f'async, {engine.sessions} sessions'] = measure_reports(
+                send_in_chunks_async(
+                    mailing, make_recipients(count), engine=engine
+                )
+            )
+    return results
+
+
+def seed_mailing(user, count, batch_size=2000):
+    """
+    Seed a mailing with a contact list of synthetic contacts.
+
+    Contacts are inserted in batches, so seeding does not raise the
+    peak RSS of the benchmark.
+
+    Args:
+        user (User): The owner of the seeded objects.
+        count (int): The number of contacts.
+        batch_size (int, optional): The number of contacts per insert.
+
+    Returns:
+        Mailing: The saved mailing sent to the seeded list.
+    """
+    contact_list = Lists.objects.create(name=f'benchmark {count}', user=user)
+    for batch in chunked(range(count), batch_size):
+        contacts = Contacts.objects.bulk_create(
+            Contacts(
+                email=f'contact{number}@'
+                      f'{BENCHMARK_DOMAINS[number % len(BENCHMARK_DOMAINS)]}',
+                telephone='+70000000000',
+                user=user,
+                list=contact_list,
+            )
+            for number in batch
+        )
+        ContactsList.objects.bulk_create(
+            ContactsList(contact=contact, list=contact_list)
+            for contact in contacts
+        )
+    return Mailing.objects.create(
+        title=f'benchmark {count}',
+        user=user,
+        message_title=BENCHMARK_TITLE,
+        message_content=BENCHMARK_CONTENT,
+        contact_list=contact_list,
+    )
+
+
+def percentile(values, percent):
+    """
+    Get a percentile of sorted values by the nearest rank.
+
+    Args:
+        values (list): The sorted values.
+        percent (float): The percentile between 0 and 100.
+
+    Returns:
+        float: The value at the percentile, 0 if there are no values.
+    """
+    if not values:
+        return 0
+    rank = max(round(percent / 100 * len(values)), 1)
+    return values[min(rank, len(values)) - 1]
+
+
+def measure_run(mailing, count):
+    """
+    Run a mailing end to end and measure it.
+
+    Args:
+        mailing (Mailing): The mailing to run.
+        count (int): The number of its recipients.
+
+    Returns:
+        dict: The seconds spent, the delivered messages, the p50 and p99
+            delivery latency in milliseconds, the database queries per
+            message and the peak RSS of the process in kilobytes.
+    """
+    queries = 0
+
+    def count_query(execute, sql, params, many, context):
+        nonlocal queries
+        queries += 1
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    with db_connection.execute_wrapper(count_query):
+        with redirect_stdout(io.StringIO()):
+            run_mailing(mailing.pk, by_domain=False)
+    seconds = time.perf_counter() - started
+
+    current_rss, peak_rss = get_memory_usage()
+    run = MailingRun.objects.filter(mailing=mailing).latest('pk')
+    latencies = sorted(
+        DeliveryLog.objects.filter(run=run).values_list('latency', flat=True)
+    )
+    return {
+        'seconds': seconds,
+        'count': count,
+        'sent': run.sent,
+        'p50': percentile(latencies, 50),
+        'p99': percentile(latencies, 99),
+        'queries': queries / count,
+        'peak_rss': peak_rss,
+    }
+
+
+def bench_send(count=100000, latency=0):
+    """
+    Measure sending mailings end to end to a local SMTP sink.
+
+    For 1k, 10k and 100k recipients, up to `count`, a mailing with a
+    list of synthetic contacts is seeded and sent with `run_mailing`
+    using the configured delivery engine. Sizes are measured in
+    ascending order, so the peak RSS of every size is not raised by a
+    larger one. Contacts are seeded into a test database created for
+    the benchmark and destroyed afterwards, so the configured database
+    is never written to. The outbox, spool and snapshot paths are
+    disabled, so every mailing is sent by the measured process.
+
+    Args:
+        count (int, optional): The largest number of recipients.
+        latency (float, optional): The reply latency of the sink.
+
+    Returns:
+        dict: The measurements of every number of recipients.
+    """
+    sizes = [size for size in BENCHMARK_SIZES if size <= count] or [count]
+    database_name = db_connection.settings_dict['NAME']
+    db_connection.creation.create_test_db(
+        verbosity=0, autoclobber=True, serialize=False
+    )
+    results = {}
+    try:
+        user, _ = User.objects.get_or_create(
+            email='benchmark@example.com'
+        )
+        with SMTPSink(latency=latency) as sink, override_settings(
+            EMAIL_HOST=sink.host,
+            EMAIL_PORT=sink.port,
+            EMAIL_HOST_USER='',
+            EMAIL_HOST_PASSWORD='',
+            EMAIL_USE_TLS=False,
+            EMAIL_USE_SSL=False,
+            MAILING_RATE_LIMIT_ENABLED=False,
+            MAILING_USE_OUTBOX=False,
+            MAILING_USE_SPOOL=False,
+            MAILING_USE_SNAPSHOT=False,
+        ):
+            for size in sizes:
+                mailing = seed_mailing(user, size)
+                results[f'{size} recipients'] = measure_run(mailing, size)
+    finally:
+        db_connection.creation.destroy_test_db(database_name, verbosity=0)
+    return results
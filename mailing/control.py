@@ -0,0 +1,107 @@
+from django.db import transaction
+from django.utils import timezone
+
+from mailing.models import MailingRun, OutboxMessage, SnapshotRange
+
+# Statuses of runs that can still be paused or cancelled
+ACTIVE_STATUSES = (
+    MailingRun.RUN_QUEUED,
+    MailingRun.RUN_SENDING,
+    MailingRun.RUN_SPOOLED,
+)
+
+
+def is_stopped(run_pk):
+    """
+    Check whether a run has been paused or cancelled.
+
+    Workers call it between batches, it costs a single primary key
+    lookup.
+
+    Args:
+        run_pk (int): The primary key of the run.
+
+    Returns:
+        bool: True if the run must not be sent any further.
+    """
+    return MailingRun.objects.filter(pk=run_pk).exclude(
+        paused=False,
+        status__in=ACTIVE_STATUSES,
+    ).exists()
+
+
+def pause_run(run_pk):
+    """
+    Pause a run.
+
+    Workers stop sending the run after their current batch and keep its
+    checkpoint.
+
+    Args:
+        run_pk (int): The primary key of the run.
+
+    Returns:
+        bool: True if the run was paused.
+    """
+    return bool(MailingRun.objects.filter(
+        pk=run_pk,
+        status__in=ACTIVE_STATUSES,
+    ).update(paused=True))
+
+
+def resume_run(run_pk):
+    """
+    Resume a paused run.
+
+    Outbox, range and spool workers pick the run up again. A run sent
+    in-process is resumed from its checkpoint by the scheduler on its
+    next reload.
+
+    Args:
+        run_pk (int): The primary key of the run.
+
+    Returns:
+        bool: True if the run was resumed.
+    """
+    return bool(MailingRun.objects.filter(
+        pk=run_pk,
+        status__in=ACTIVE_STATUSES,
+    ).update(paused=False))
+
+
+def cancel_run(run_pk):
+    """
+    Cancel a run and drop its remaining recipients.
+
+    The pending outbox messages and snapshot ranges of the run are
+    cancelled with one update each. The spool of the run is removed by
+    the shipper.
+
+    Args:
+        run_pk (int): The primary key of the run.
+
+    Returns:
+        tuple: Whether the run was cancelled, the number of cancelled
+            outbox messages and the number of cancelled snapshot ranges.
+    """
+    with transaction.atomic():
+        cancelled = MailingRun.objects.filter(
+            pk=run_pk,
+            status__in=ACTIVE_STATUSES,
+        ).update(
+            status=MailingRun.RUN_CANCELLED,
+            paused=False,
+            date_finished=timezone.now(),
+        )
+        if not cancelled:
+            return False, 0, 0
+
+        messages = OutboxMessage.objects.filter(
+            run_id=run_pk,
+            status=OutboxMessage.STATUS_PENDING,
+        ).update(status=OutboxMessage.STATUS_CANCELLED, locked_until=None)
+        ranges = SnapshotRange.objects.filter(
+            run_id=run_pk,
+            status=SnapshotRange.STATUS_PENDING,
+        ).update(status=SnapshotRange.STATUS_CANCELLED, locked_until=None)
+    return True, messages, ranges
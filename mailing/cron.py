@@ -1,16 +1,87 @@
+import os
 import sys
-from django.core.mail import send_mail
+
+from django.conf import settings
+from django.utils import timezone
+
 from logs.models import Logging
-from mailing.models import Mailing
+from mailing.locks import MailingLock
+from mailing.models import Mailing, MailingRun
+from mailing.outbox import enqueue_mailing, finish_runs
+from mailing.runner import send_by_domain, send_in_order
+from mailing.snapshot import snapshot_mailing
+from mailing.spool import get_spool_dir, spool_run
 
 
-def run_mailing(mailing_pk=None):
+def run_mailing(mailing_pk=None, chunk_size=None, memory_report=False,
+                enqueue=None, by_domain=None, engine=None, spool=None,
+                snapshot=None, slot=None, resume=False):
     """
     Run a mailing by sending emails to the specified recipients.
 
+    Recipients are streamed from the database and every recipient gets a
+    separate message. Messages are sent in chunks over one reused SMTP
+    connection and the number of delivered messages is reported for each
+    chunk. The result of every delivery is written to the delivery log in
+    buffered bulk inserts. Deliveries that failed with a transient error
+    are enqueued into the outbox for a retry with exponential backoff.
+
+    After every chunk the primary key of its last contact is stored on
+    the run as a checkpoint. If the previous run of the mailing was
+    interrupted, it is resumed from that checkpoint instead of starting
+    over.
+
+    When grouping by domain is enabled, the recipients are partitioned by
+    email domain and the partitions are drained concurrently, each with
+    its own connection and checkpoint.
+
+    With the asyncio engine, messages are delivered over several
+    concurrent SMTP sessions instead of one blocking connection.
+
+    When spooling is enabled, the messages are only rendered into the
+    spool directory of the run and sent by `manage.py ship_spool`.
+
+    When snapshots are enabled, the recipients are frozen into a
+    snapshot of the run and sent in ranges by `manage.py send_ranges`
+    processes.
+
+    When enqueueing is enabled, the run is written to the outbox instead
+    and the messages are sent by `manage.py send_worker` processes.
+
+    The mailing is run under a lease-based lock taken for its scheduled
+    slot before any work is done, so a mailing is never run by two
+    processes at once and a slot fired on several hosts is run once.
+    The fencing token of the lock is stored on the run, so a process
+    whose lease expired stops once another one took the run over.
+
+    A paused run is not resumed until it is resumed with
+    `manage.py control_run`, and a run paused or cancelled while it is
+    sent is left with its checkpoint. No message after the checkpoint
+    is in flight at that point, so every recipient is sent once.
+
     Args:
         mailing_pk (int, optional): The primary key of the mailing to run.
             If not provided, it can be specified as a command-line argument.
+        chunk_size (int, optional): The number of messages sent per chunk.
+            Defaults to `settings.MAILING_CHUNK_SIZE`.
+        memory_report (bool, optional): Whether to print the current and
+            peak RSS of the process after every chunk.
+        enqueue (bool, optional): Whether to enqueue the run into the
+            outbox. Defaults to `settings.MAILING_USE_OUTBOX`.
+        by_domain (bool, optional): Whether to send the recipients
+            partitioned by email domain. Defaults to
+            `settings.MAILING_GROUP_BY_DOMAIN`.
+        engine (str, optional): The delivery engine, 'smtp' or 'async'.
+            Defaults to `settings.MAILING_ENGINE`.
+        spool (bool, optional): Whether to render the run into the spool.
+            Defaults to `settings.MAILING_USE_SPOOL`.
+        snapshot (bool, optional): Whether to snapshot the recipients for
+            range workers. Defaults to `settings.MAILING_USE_SNAPSHOT`.
+        slot (datetime, optional): The scheduled fire time being run.
+            Defaults to the current minute, as crontab fires once a
+            minute at most.
+        resume (bool, optional): Whether to only resume an interrupted
+            in-process run. No new run is started if there is none.
 
     Returns:
         None
@@ -21,32 +92,141 @@ def run_mailing(mailing_pk=None):
             print("Usage: python your_script.py <newsletter_pk>")
             sys.exit(1)
         mailing_pk = sys.argv[1]
+    if slot is None:
+        slot = timezone.now().replace(second=0, microsecond=0)
+
+    lock = MailingLock(mailing_pk, slot.isoformat())
+    if not lock.acquire():
+        print(f'Mailing {mailing_pk}: {lock.reason}')
+        return
+    try:
+        _run_mailing(
+            mailing_pk, lock.token, chunk_size, memory_report, enqueue,
+            by_domain, engine, spool, snapshot, resume,
+        )
+    finally:
+        lock.release()
+        if lock.lost:
+            print(f'Mailing {mailing_pk}: lock lease expired while running')
+
+
+def _run_mailing(mailing_pk, fence, chunk_size, memory_report, enqueue,
+                 by_domain, engine, spool, snapshot, resume):
+    """
+    Run a mailing while its lock is held.
+
+    Args:
+        mailing_pk (int): The primary key of the mailing to run.
+        fence (int): The fencing token of the lock of the mailing.
+        chunk_size (int): The number of messages sent per chunk.
+        memory_report (bool): Whether to print the RSS after every chunk.
+        enqueue (bool): Whether to enqueue the run into the outbox.
+        by_domain (bool): Whether to send the recipients partitioned by
+            email domain.
+        engine (str): The delivery engine, 'smtp' or 'async'.
+        spool (bool): Whether to render the run into the spool.
+        snapshot (bool): Whether to snapshot the recipients.
+        resume (bool): Whether to only resume an interrupted run.
+
+    Returns:
+        None
+    """
     try:
         mailing = Mailing.objects.get(pk=mailing_pk)
     except Mailing.DoesNotExist:
         print('Active Mailing DoesNotExist')
-        exit()
+        return
+
+    if enqueue is None:
+        enqueue = settings.MAILING_USE_OUTBOX
+    if enqueue and not resume:
+        run = enqueue_mailing(mailing)
+        print(f'Run {run.pk}: {run.total} messages enqueued')
+        return
+
+    if snapshot is None:
+        snapshot = settings.MAILING_USE_SNAPSHOT
+    if snapshot and not resume:
+        run, size, ranges = snapshot_mailing(mailing)
+        print(f'Run {run.pk}: {size} recipients in {ranges} ranges')
+        return
+
+    run = MailingRun.objects.filter(
+        mailing=mailing,
+        status=MailingRun.RUN_SENDING,
+    ).order_by('-pk').first()
+    if run is None and resume:
+        print(f'Mailing {mailing_pk}: no interrupted run')
+        return
+    elif run is None:
+        run = MailingRun.objects.create(
+            mailing=mailing,
+            status=MailingRun.RUN_SENDING
+        )
+    elif run.paused:
+        print(f'Run {run.pk} is paused')
+        return
     else:
-        contacts_list = mailing.contact_list.contacts.all()
-        contacts = [contact.email for contact in contacts_list]
-
-    response = send_mail(
-        subject=mailing.message_title,
-        message=mailing.message_content,
-        from_email=None,
-        recipient_list=contacts,
-    )
-    if response == 1:
-        attempt_status = 'ok'
+        print(f'Resuming run {run.pk}')
+    MailingRun.objects.filter(pk=run.pk).update(lock_token=fence)
+
+    if spool is None:
+        spool = settings.MAILING_USE_SPOOL
+    if by_domain is None:
+        by_domain = settings.MAILING_GROUP_BY_DOMAIN
+    # An interrupted run is resumed in the mode it was started in
+    if os.path.isdir(get_spool_dir(run.pk)):
+        spool = True
+    elif run.domain_checkpoints:
+        spool, by_domain = False, True
+    elif run.last_contact_id is not None:
+        spool, by_domain = False, False
+
+    if spool:
+        spooled = spool_run(run, chunk_size=chunk_size, fence=fence)
+        print(f'Run {run.pk}: {spooled} messages spooled')
+        return
+
+    if by_domain:
+        retries = send_by_domain(
+            run, chunk_size=chunk_size, engine=engine, fence=fence
+        )
+    else:
+        retries = send_in_order(
+            run,
+            chunk_size=chunk_size,
+            memory_report=memory_report,
+            engine=engine,
+            fence=fence,
+        )
+
+    run.refresh_from_db()
+    if run.lock_token != fence:
+        print(f'Run {run.pk} is sent by another process')
+        return
+    if run.paused or run.status == MailingRun.RUN_CANCELLED:
+        print(f'Run {run.pk}: {run.total} messages processed before stop')
+        return
+    if retries:
+        # The run is finished and logged once its retries are processed.
+        # Workers may have drained them already while the run was still
+        # sending, so it is checked right after it is queued.
+        print(f'Run {run.pk}: {retries} deliveries enqueued for retry')
+        run.status = MailingRun.RUN_QUEUED
+        run.save(update_fields=('status',))
+        finish_runs([run.pk])
+        return
+
+    run.status = MailingRun.RUN_DONE
+    run.date_finished = timezone.now()
+    run.save(update_fields=('status', 'date_finished'))
+
+    if run.sent == run.total:
+        attempt_status = Logging.ATTEMPT_OK
     else:
-        attempt_status = 'error'
+        attempt_status = Logging.ATTEMPT_ERROR
 
     Logging.objects.create(
         mailing=mailing,
         attempt_status=attempt_status
     )
-    # TODO: Implement scheduled messaging/mailings.
-
-    # TODO: Implement status checking and add a cron job for retrying
-    #       if an error occurs, until the status becomes 'ok,' then remove
-    #       the additional task.
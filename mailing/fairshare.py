@@ -0,0 +1,403 @@
+import threading
+import time
+import uuid
+from collections import deque, namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from mailing.models import SendingLimits
+from service.utils import get_redis_client, is_redis_cache
+
+# Takes a concurrency slot from the sorted set in KEYS[1] if fewer than
+# ARGV[1] slots are held. Slots are scored by the end of their lease, so
+# the slots of a crashed worker are freed once their lease expires.
+# ARGV holds (max slots, lease, token).
+ACQUIRE_SLOT_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local lease = tonumber(ARGV[2])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('ZADD', KEYS[1], now + lease, ARGV[3])
+redis.call('EXPIRE', KEYS[1], math.ceil(lease) + 1)
+return 1
+"""
+
+# Reserves up to ARGV[2] messages of the quota ARGV[1] in the counter in
+# KEYS[1] and returns the number of reserved messages. ARGV[3] is the
+# lifetime of the counter in seconds.
+RESERVE_QUOTA_SCRIPT = """
+local used = tonumber(redis.call('GET', KEYS[1]) or '0')
+local granted = math.min(
+    tonumber(ARGV[2]), math.max(0, tonumber(ARGV[1]) - used)
+)
+if granted > 0 then
+    redis.call('INCRBY', KEYS[1], granted)
+    redis.call('EXPIRE', KEYS[1], tonumber(ARGV[3]))
+end
+return granted
+"""
+
+# Seconds a daily quota counter is kept after its last use
+QUOTA_TTL = 2 * 24 * 60 * 60
+
+# Batch claimed for a user, holding one of the concurrency slots of
+# the user until it is released
+Turn = namedtuple('Turn', ('user_id', 'token', 'items'))
+
+
+class RedisTenantCounters:
+    """
+    Concurrency slots and quota counters stored in the Redis server of
+    the default cache.
+
+    The counters are shared by every process using the same cache, so
+    the limits of a user hold across all workers.
+
+    Methods:
+        acquire_slot: Take a concurrency slot.
+        release_slot: Give a concurrency slot back.
+        reserve: Reserve messages of a quota.
+        refund: Give reserved messages of a quota back.
+    """
+
+    def __init__(self, client):
+        self._client = client
+        self._acquire = self._client.register_script(ACQUIRE_SLOT_SCRIPT)
+        self._reserve = self._client.register_script(RESERVE_QUOTA_SCRIPT)
+
+    def acquire_slot(self, key, limit, lease, token):
+        """
+        Take a concurrency slot if fewer than `limit` slots are held.
+
+        Args:
+            key (str): The key of the slots.
+            limit (int): The maximum number of held slots.
+            lease (int): Seconds after which the slot is freed.
+            token (str): The identifier of the slot.
+
+        Returns:
+            bool: True if the slot was taken.
+        """
+        return bool(self._acquire(keys=[key], args=[limit, lease, token]))
+
+    def release_slot(self, key, token):
+        """
+        Give a concurrency slot back.
+
+        Args:
+            key (str): The key of the slots.
+            token (str): The identifier of the slot.
+
+        Returns:
+            None
+        """
+        self._client.zrem(key, token)
+
+    def reserve(self, key, quota, amount):
+        """
+        Reserve up to `amount` messages of a quota.
+
+        Args:
+            key (str): The key of the quota counter.
+            quota (int): The quota.
+            amount (int): The number of messages to reserve.
+
+        Returns:
+            int: The number of reserved messages.
+        """
+        return int(
+            self._reserve(keys=[key], args=[quota, amount, QUOTA_TTL])
+        )
+
+    def refund(self, key, amount):
+        """
+        Give reserved messages of a quota back.
+
+        Args:
+            key (str): The key of the quota counter.
+            amount (int): The number of unused messages.
+
+        Returns:
+            None
+        """
+        self._client.decrby(key, amount)
+
+
+class LocalTenantCounters:
+    """
+    Concurrency slots and quota counters kept in the memory of the
+    current process.
+
+    Used when the default cache is not Redis, so the limits are not
+    shared between processes.
+
+    Methods:
+        acquire_slot: Take a concurrency slot.
+        release_slot: Give a concurrency slot back.
+        reserve: Reserve messages of a quota.
+        refund: Give reserved messages of a quota back.
+    """
+
+    def __init__(self):
+        self._slots = {}
+        self._quotas = {}
+        self._lock = threading.Lock()
+
+    def acquire_slot(self, key, limit, lease, token):
+        """
+        Take a concurrency slot if fewer than `limit` slots are held.
+
+        Args:
+            key (str): The key of the slots.
+            limit (int): The maximum number of held slots.
+            lease (int): Seconds after which the slot is freed.
+            token (str): The identifier of the slot.
+
+        Returns:
+            bool: True if the slot was taken.
+        """
+        with self._lock:
+            now = time.monotonic()
+            slots = {
+                held: expires
+                for held, expires in self._slots.get(key, {}).items()
+                if expires > now
+            }
+            self._slots[key] = slots
+            if len(slots) >= limit:
+                return False
+            slots[token] = now + lease
+            return True
+
+    def release_slot(self, key, token):
+        """
+        Give a concurrency slot back.
+
+        Args:
+            key (str): The key of the slots.
+            token (str): The identifier of the slot.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._slots.get(key, {}).pop(token, None)
+
+    def reserve(self, key, quota, amount):
+        """
+        Reserve up to `amount` messages of a quota.
+
+        Args:
+            key (str): The key of the quota counter.
+            quota (int): The quota.
+            amount (int): The number of messages to reserve.
+
+        Returns:
+            int: The number of reserved messages.
+        """
+        with self._lock:
+            used = self._quotas.get(key, 0)
+            granted = min(amount, max(0, quota - used))
+            self._quotas[key] = used + granted
+            return granted
+
+    def refund(self, key, amount):
+        """
+        Give reserved messages of a quota back.
+
+        Args:
+            key (str): The key of the quota counter.
+            amount (int): The number of unused messages.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._quotas[key] = self._quotas.get(key, 0) - amount
+
+
+class FairScheduler:
+    """
+    Deficit round-robin scheduler of the batches of a worker across users.
+
+    Users with claimable messages take turns. On every turn the deficit
+    of a user grows by the quantum times the weight of the user and a
+    batch of at most the deficit is claimed for them, so a user with a
+    huge campaign gets the same share as a user with a small one. While
+    the deficit left after a batch is at least a full batch, the user
+    keeps the turn, so weights also apply when the quantum is not
+    smaller than a batch. A user is skipped while their concurrency
+    slots are all held or their daily quota is used up. The deficit of a
+    user whose messages are drained is reset.
+
+    Attributes:
+        quantum (int): The number of messages per turn of weight 1.
+        lease (int): Seconds after which the slot of a crashed worker is
+            freed.
+        users_ttl (float): Seconds the list of users with claimable
+            messages is reused.
+
+    Methods:
+        get_user_ids: Get the users with claimable messages.
+        claim: Claim the batch of the next user.
+        release: Free the concurrency slot of a turn.
+    """
+
+    def __init__(self, quantum=None, lease=None, counters=None,
+                 users_ttl=None):
+        if quantum is None:
+            quantum = settings.MAILING_FAIR_SHARE_QUANTUM
+        if lease is None:
+            lease = settings.MAILING_OUTBOX_LEASE
+        if users_ttl is None:
+            users_ttl = settings.MAILING_FAIR_SHARE_USERS_TTL
+        if counters is None:
+            if is_redis_cache():
+                counters = RedisTenantCounters(get_redis_client())
+            else:
+                counters = LocalTenantCounters()
+        self.quantum = quantum
+        self.lease = lease
+        self.counters = counters
+        self.users_ttl = users_ttl
+        self._deficits = {}
+        self._order = deque()
+        self._user_ids = None
+        self._users_expire = 0
+
+    def get_user_ids(self, load):
+        """
+        Get the users with claimable messages.
+
+        The users are loaded at most once per `users_ttl` seconds, and
+        again as soon as no user could be claimed for.
+
+        Args:
+            load (callable): Returns the users with claimable messages.
+
+        Returns:
+            list: Primary keys of the users.
+        """
+        now = time.monotonic()
+        if self._user_ids is None or now >= self._users_expire:
+            self._user_ids = list(load())
+            self._users_expire = now + self.users_ttl
+        return self._user_ids
+
+    def get_limits(self, user_ids):
+        """
+        Get the sending limits of users.
+
+        Args:
+            user_ids (iterable): Primary keys of the users.
+
+        Returns:
+            dict: (weight, max concurrency, daily quota) tuples by user.
+        """
+        limits = {
+            user_id: (
+                1,
+                settings.MAILING_USER_CONCURRENCY,
+                settings.MAILING_USER_DAILY_QUOTA,
+            )
+            for user_id in user_ids
+        }
+        for row in SendingLimits.objects.filter(user_id__in=limits):
+            limits[row.user_id] = (
+                row.weight,
+                row.max_concurrency or settings.MAILING_USER_CONCURRENCY,
+                settings.MAILING_USER_DAILY_QUOTA
+                if row.daily_quota is None else row.daily_quota,
+            )
+        return limits
+
+    def _rotate(self, user_ids):
+        active = set(user_ids)
+        for user_id in list(self._deficits):
+            if user_id not in active:
+                del self._deficits[user_id]
+        self._order = deque(
+            user_id for user_id in self._order if user_id in active
+        )
+        for user_id in sorted(active - set(self._deficits), key=str):
+            self._deficits[user_id] = 0
+            self._order.append(user_id)
+
+        for _ in range(len(self._order)):
+            user_id = self._order[0]
+            self._order.rotate(-1)
+            yield user_id
+
+    def claim(self, user_ids, claim_for_user, max_size):
+        """
+        Claim the batch of the next user that may send.
+
+        Args:
+            user_ids (iterable): Primary keys of the users with claimable
+                messages, None for mailings without an author.
+            claim_for_user (callable): Called with a user and a batch
+                size, returns the claimed messages of the user.
+            max_size (int): The maximum size of a batch.
+
+        Returns:
+            Turn | None: The claimed batch, or None if no user may send.
+        """
+        user_ids = list(user_ids)
+        limits = self.get_limits(
+            user_id for user_id in user_ids if user_id is not None
+        )
+        today = timezone.localdate().isoformat()
+        for user_id in self._rotate(user_ids):
+            weight, concurrency, quota = limits.get(
+                user_id, (1, settings.MAILING_USER_CONCURRENCY, 0)
+            )
+            slots_key = cache.make_key(f'fairshare:slots:{user_id}')
+            token = uuid.uuid4().hex
+            if not self.counters.acquire_slot(
+                slots_key, concurrency, self.lease, token
+            ):
+                continue
+
+            if self._deficits[user_id] < max_size:
+                self._deficits[user_id] += self.quantum * weight
+            size = min(self._deficits[user_id], max_size)
+            quota_key = cache.make_key(f'fairshare:quota:{user_id}:{today}')
+            if quota:
+                size = self.counters.reserve(quota_key, quota, size)
+            items = claim_for_user(user_id, size) if size else []
+            if quota and len(items) < size:
+                self.counters.refund(quota_key, size - len(items))
+
+            if not size or len(items) < size:
+                self._deficits[user_id] = 0
+            else:
+                self._deficits[user_id] -= len(items)
+            if not items:
+                self.counters.release_slot(slots_key, token)
+                continue
+            if self._deficits[user_id] >= max_size:
+                # The user keeps the turn for another full batch
+                self._order.remove(user_id)
+                self._order.appendleft(user_id)
+            return Turn(user_id, token, items)
+        self._user_ids = None
+        return None
+
+    def release(self, turn):
+        """
+        Free the concurrency slot of a turn once its batch is sent.
+
+        Args:
+            turn (Turn): The finished turn.
+
+        Returns:
+            None
+        """
+        self.counters.release_slot(
+            cache.make_key(f'fairshare:slots:{turn.user_id}'), turn.token
+        )
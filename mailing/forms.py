@@ -1,6 +1,8 @@
 from django import forms
+from django.template import TemplateSyntaxError
 from frontend.forms import StyleFormMixin
 from mailing.models import Mailing, MailingSettings
+from mailing.rendering import CompiledMailing
 
 
 class MailingForm(StyleFormMixin, forms.ModelForm):
@@ -12,6 +14,10 @@ class MailingForm(StyleFormMixin, forms.ModelForm):
     Attributes:
         Meta (class): A class that specifies the associated model (Mailing) and the fields to display in the form.
 
+    Methods:
+        clean_message_title: Check the merge fields of the message title.
+        clean_message_content: Check the merge fields of the message content.
+
     """
 
     class Meta:
@@ -23,6 +29,20 @@ class MailingForm(StyleFormMixin, forms.ModelForm):
             'contact_list',
         )
 
+    def _clean_template(self, field):
+        text = self.cleaned_data.get(field)
+        try:
+            CompiledMailing.check(text)
+        except TemplateSyntaxError as error:
+            raise forms.ValidationError(f'Ошибка в шаблоне: {error}')
+        return text
+
+    def clean_message_title(self):
+        return self._clean_template('message_title')
+
+    def clean_message_content(self):
+        return self._clean_template('message_content')
+
 
 class MailingSettingsForm(StyleFormMixin, forms.ModelForm):
     """
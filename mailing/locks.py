@@ -0,0 +1,326 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from service.utils import get_redis_client, is_redis_cache
+
+# Takes the lock in KEYS[1] and marks the scheduled slot in the optional
+# KEYS[3] as run. Returns a fencing token from the counter in KEYS[2], 0
+# if the lock is held or -1 if the slot has already been run. ARGV holds
+# the lease of the lock in milliseconds and the lifetime of the slot
+# mark in seconds.
+ACQUIRE_LOCK_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+if KEYS[3] and not redis.call(
+    'SET', KEYS[3], '1', 'NX', 'EX', tonumber(ARGV[2])
+) then
+    return -1
+end
+local token = redis.call('INCR', KEYS[2])
+redis.call('SET', KEYS[1], token, 'PX', tonumber(ARGV[1]))
+return token
+"""
+
+# Extends the lease of the lock in KEYS[1] to ARGV[2] milliseconds if it
+# is still held with the fencing token ARGV[1].
+RENEW_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], tonumber(ARGV[2]))
+end
+return 0
+"""
+
+# Releases the lock in KEYS[1] if it is still held with the fencing
+# token ARGV[1].
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Seconds a scheduled slot stays marked as run
+SLOT_TTL = 2 * 24 * 60 * 60
+
+
+class RedisLocks:
+    """
+    Lease-based locks stored in the Redis server of the default cache.
+
+    The locks are shared by every process using the same cache, so a
+    mailing is run by one host at a time.
+
+    Methods:
+        acquire: Take a lock and mark a scheduled slot as run.
+        renew: Extend the lease of a held lock.
+        release: Release a held lock.
+    """
+
+    def __init__(self, client):
+        self._acquire = client.register_script(ACQUIRE_LOCK_SCRIPT)
+        self._renew = client.register_script(RENEW_LOCK_SCRIPT)
+        self._release = client.register_script(RELEASE_LOCK_SCRIPT)
+
+    def acquire(self, key, fence_key, slot_key, lease):
+        """
+        Take a lock and mark a scheduled slot as run.
+
+        Args:
+            key (str): The key of the lock.
+            fence_key (str): The key of the fencing token counter.
+            slot_key (str | None): The key of the scheduled slot, None
+                for a lock without slots.
+            lease (float): The lease of the lock in seconds.
+
+        Returns:
+            int: The fencing token, 0 if the lock is held or -1 if the
+                slot has already been run.
+        """
+        keys = [key, fence_key]
+        if slot_key is not None:
+            keys.append(slot_key)
+        return int(self._acquire(
+            keys=keys, args=[int(lease * 1000), SLOT_TTL]
+        ))
+
+    def renew(self, key, token, lease):
+        """
+        Extend the lease of a held lock.
+
+        Args:
+            key (str): The key of the lock.
+            token (int): The fencing token the lock is held with.
+            lease (float): The new lease in seconds.
+
+        Returns:
+            bool: True if the lock is still held.
+        """
+        return bool(
+            self._renew(keys=[key], args=[token, int(lease * 1000)])
+        )
+
+    def release(self, key, token):
+        """
+        Release a held lock.
+
+        Args:
+            key (str): The key of the lock.
+            token (int): The fencing token the lock is held with.
+
+        Returns:
+            None
+        """
+        self._release(keys=[key], args=[token])
+
+
+class LocalLocks:
+    """
+    Lease-based locks kept in the memory of the current process.
+
+    Used when the default cache is not Redis, so mailings are only
+    protected from being run twice by the same process.
+
+    Methods:
+        acquire: Take a lock and mark a scheduled slot as run.
+        renew: Extend the lease of a held lock.
+        release: Release a held lock.
+    """
+
+    def __init__(self):
+        self._locks = {}
+        self._fences = {}
+        self._slots = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key, fence_key, slot_key, lease):
+        """
+        Take a lock and mark a scheduled slot as run.
+
+        Args:
+            key (str): The key of the lock.
+            fence_key (str): The key of the fencing token counter.
+            slot_key (str | None): The key of the scheduled slot, None
+                for a lock without slots.
+            lease (float): The lease of the lock in seconds.
+
+        Returns:
+            int: The fencing token, 0 if the lock is held or -1 if the
+                slot has already been run.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._locks.get(key, (0, 0))[1] > now:
+                return 0
+            if slot_key is not None:
+                if self._slots.get(slot_key, 0) > now:
+                    return -1
+                self._slots[slot_key] = now + SLOT_TTL
+            token = self._fences.get(fence_key, 0) + 1
+            self._fences[fence_key] = token
+            self._locks[key] = (token, now + lease)
+            return token
+
+    def renew(self, key, token, lease):
+        """
+        Extend the lease of a held lock.
+
+        Args:
+            key (str): The key of the lock.
+            token (int): The fencing token the lock is held with.
+            lease (float): The new lease in seconds.
+
+        Returns:
+            bool: True if the lock is still held.
+        """
+        with self._lock:
+            now = time.monotonic()
+            held, expires = self._locks.get(key, (0, 0))
+            if held != token or expires <= now:
+                return False
+            self._locks[key] = (token, now + lease)
+            return True
+
+    def release(self, key, token):
+        """
+        Release a held lock.
+
+        Args:
+            key (str): The key of the lock.
+            token (int): The fencing token the lock is held with.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            if self._locks.get(key, (0, 0))[0] == token:
+                del self._locks[key]
+
+
+_backend = None
+
+
+def get_lock_backend():
+    """
+    Get the lock backend shared by the current process.
+
+    Returns:
+        RedisLocks | LocalLocks: The backend of the default cache.
+    """
+    global _backend
+
+    if _backend is None:
+        if is_redis_cache():
+            _backend = RedisLocks(get_redis_client())
+        else:
+            _backend = LocalLocks()
+    return _backend
+
+
+class LeaseLock:
+    """
+    Lease-based lock renewed by a background thread while it is held.
+
+    Every acquisition gets a fencing token greater than the previous
+    ones. A holder whose lease expired before it was renewed is marked
+    as having lost the lock and has to stop its work. A lock taken for
+    a slot also marks the slot as run, so the slot is only run once.
+
+    Attributes:
+        name (str): The name of the lock.
+        slot (str | None): The slot being run.
+        lease (float): The lease of the lock in seconds.
+        token (int | None): The fencing token while the lock is held.
+        reason (str): Why the lock was not acquired.
+        lost (bool): Whether the lease expired before it was renewed.
+
+    Methods:
+        acquire: Take the lock and start renewing its lease.
+        release: Stop renewing the lease and release the lock.
+    """
+
+    def __init__(self, name, slot=None, lease=None, backend=None):
+        if lease is None:
+            lease = settings.MAILING_LOCK_LEASE
+        if backend is None:
+            backend = get_lock_backend()
+        self.name = name
+        self.slot = slot
+        self.lease = lease
+        self.backend = backend
+        self.token = None
+        self.reason = ''
+        self.lost = False
+        self._key = cache.make_key(f'lock:{name}')
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def acquire(self):
+        """
+        Take the lock and start renewing its lease.
+
+        Returns:
+            bool: True if the lock was acquired.
+        """
+        slot_key = None
+        if self.slot is not None:
+            slot_key = cache.make_key(f'lock:{self.name}:{self.slot}')
+        token = self.backend.acquire(
+            self._key,
+            cache.make_key(f'lock:{self.name}:fence'),
+            slot_key,
+            self.lease,
+        )
+        if token == 0:
+            self.reason = 'already running'
+            return False
+        if token < 0:
+            self.reason = f'slot {self.slot} already run'
+            return False
+
+        self.token = token
+        self._thread = threading.Thread(target=self._renew, daemon=True)
+        self._thread.start()
+        return True
+
+    def _renew(self):
+        while not self._stopped.wait(self.lease / 3):
+            if not self.backend.renew(self._key, self.token, self.lease):
+                self.lost = True
+                return
+
+    def release(self):
+        """
+        Stop renewing the lease and release the lock.
+
+        Returns:
+            None
+        """
+        if self.token is None:
+            return
+        self._stopped.set()
+        self._thread.join()
+        self.backend.release(self._key, self.token)
+        self.token = None
+
+
+class MailingLock(LeaseLock):
+    """
+    Lease-based lock of a mailing for one of its scheduled slots.
+
+    Only one process runs a mailing at a time, so a run overlapping the
+    next firing of its mailing is not sent twice, and every scheduled
+    slot is run once, so two hosts firing the same slot do not send it
+    twice. The fencing token of the lock is stored on the run to reject
+    the writes of a process that lost its lease.
+
+    Attributes:
+        mailing_pk (int): The primary key of the locked mailing.
+    """
+
+    def __init__(self, mailing_pk, slot, lease=None, backend=None):
+        super().__init__(f'mailing:{mailing_pk}', slot, lease, backend)
+        self.mailing_pk = mailing_pk
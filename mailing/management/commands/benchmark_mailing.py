@@ -0,0 +1,94 @@
+from django.core.management import BaseCommand
+
+from mailing import benchmarks
+
+# Benchmarks available to the command
+BENCHMARKS = {
+    'render': benchmarks.bench_render,
+    'mime': benchmarks.bench_mime,
+    'dkim': benchmarks.bench_dkim,
+    'engines': benchmarks.bench_engines,
+    'send': benchmarks.bench_send,
+}
+
+
+class Command(BaseCommand):
+    """
+    Custom management command for benchmarking the mailing pipeline.
+    """
+    help = 'Benchmark stages of the mailing pipeline.'
+
+    def add_arguments(self, parser):
+        """
+        Define command-line arguments for the management command.
+
+        Args:
+            parser (argparse.ArgumentParser): The ArgumentParser instance.
+
+        Returns:
+            None
+
+        Example:
+            To use this command, run:
+            $ python manage.py benchmark_mailing render --count 100000
+        """
+        parser.add_argument(
+            'benchmark',
+            choices=BENCHMARKS,
+            help='Name of the benchmark to run'
+        )
+        parser.add_argument(
+            '--count',
+            type=int,
+            default=100000,
+            help='Number of synthetic recipients, the largest one for send'
+        )
+
+    def handle(self, *args, **kwargs):
+        """
+        Handle the command execution.
+
+        This function runs the selected benchmark on synthetic recipients
+        and prints the time spent per `count` recipients and per message
+        for every measured variant, and the generated bytes per second
+        for variants producing serialised messages, or the messages per
+        second and core for variants using several processes, or the
+        delivered messages per second for delivery engines. End-to-end
+        sends also report the p50 and p99 delivery latency, the database
+        queries per message and the peak RSS of the process.
+
+        Args:
+            *args: Additional command arguments (not used).
+            **kwargs: Additional keyword arguments, including 'benchmark'
+                and 'count'.
+
+        Returns:
+            None
+
+        Example:
+            To compare render strategies for 100k recipients, run:
+            $ python manage.py benchmark_mailing render
+        """
+        results = BENCHMARKS[kwargs['benchmark']](kwargs['count'])
+        for name, result in results.items():
+            seconds = result['seconds']
+            count = result.get('count', kwargs['count'])
+            line = (
+                f'{name}: {seconds:.3f} s per {count} recipients, '
+                f'{seconds / count * 1000000:.2f} us per message'
+            )
+            if 'bytes' in result:
+                line += f', {result["bytes"] / seconds / 1000000:.1f} MB/s'
+            if 'workers' in result:
+                rate = count / seconds / result['workers']
+                line += f', {rate:.0f} msg/s per core'
+            if 'sent' in result:
+                line += f', {result["sent"] / seconds:.0f} msg/s delivered'
+            if 'queries' in result:
+                line += (
+                    f', latency p50 {result["p50"]:.2f} ms, '
+                    f'p99 {result["p99"]:.2f} ms, '
+                    f'{result["queries"]:.3f} queries per message, '
+                    f'peak RSS {result["peak_rss"]} KB'
+                )
+            self.stdout.write(line)
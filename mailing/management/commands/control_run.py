@@ -0,0 +1,73 @@
+from django.core.management import BaseCommand, CommandError
+
+from mailing.control import cancel_run, pause_run, resume_run
+
+
+class Command(BaseCommand):
+    """
+    Custom management command for pausing, resuming and cancelling runs.
+    """
+    help = 'Pause, resume or cancel a mailing run.'
+
+    def add_arguments(self, parser):
+        """
+        Define command-line arguments for the management command.
+
+        Args:
+            parser (argparse.ArgumentParser): The ArgumentParser instance.
+
+        Returns:
+            None
+
+        Example:
+            To use this command, run:
+            $ python manage.py control_run <run_pk> pause
+        """
+        parser.add_argument('run_pk', type=int, help='Mailing run ID')
+        parser.add_argument(
+            'action',
+            choices=('pause', 'resume', 'cancel'),
+            help='Control action'
+        )
+
+    def handle(self, *args, **kwargs):
+        """
+        Handle the command execution.
+
+        A paused run stops within one batch and continues from its
+        checkpoint once resumed. Cancelling a run drops its remaining
+        outbox messages and snapshot ranges.
+
+        Args:
+            *args: Additional command arguments (not used).
+            **kwargs: Additional keyword arguments, including 'run_pk'
+                and 'action'.
+
+        Returns:
+            None
+
+        Raises:
+            CommandError: If the run does not exist or is finished.
+
+        Example:
+            To drop the rest of a run sent to the wrong list, run:
+            $ python manage.py control_run <run_pk> cancel
+        """
+        run_pk = kwargs['run_pk']
+        if kwargs['action'] == 'cancel':
+            cancelled, messages, ranges = cancel_run(run_pk)
+            if not cancelled:
+                raise CommandError(f'Run {run_pk} is not active')
+            self.stdout.write(self.style.SUCCESS(
+                f'Run {run_pk} cancelled, {messages} outbox messages '
+                f'and {ranges} snapshot ranges dropped'
+            ))
+            return
+
+        if kwargs['action'] == 'pause':
+            changed, state = pause_run(run_pk), 'paused'
+        else:
+            changed, state = resume_run(run_pk), 'resumed'
+        if not changed:
+            raise CommandError(f'Run {run_pk} is not active')
+        self.stdout.write(self.style.SUCCESS(f'Run {run_pk} {state}'))
@@ -0,0 +1,76 @@
+from django.core.management import BaseCommand, CommandError
+
+from contacts.models import Suppression
+from mailing.suppression import import_suppressions
+from users.models import User
+
+
+class Command(BaseCommand):
+    """
+    Custom management command for importing suppressed email addresses.
+    """
+    help = 'Import a file of suppressed email addresses for a user.'
+
+    def add_arguments(self, parser):
+        """
+        Define command-line arguments for the management command.
+
+        Args:
+            parser (argparse.ArgumentParser): The ArgumentParser instance.
+
+        Returns:
+            None
+
+        Example:
+            To use this command, run:
+            $ python manage.py import_suppressions <user_email> <path>
+        """
+        parser.add_argument(
+            'user_email', type=str, help='Email of the user'
+        )
+        parser.add_argument(
+            'path',
+            type=str,
+            help='File with one address per line, or a CSV file with the '
+                 'address in the first column'
+        )
+        parser.add_argument(
+            '--reason',
+            choices=[reason for reason, label in Suppression.REASONS],
+            default=Suppression.REASON_UNSUBSCRIBED,
+            help='Reason of the suppressions'
+        )
+
+    def handle(self, *args, **kwargs):
+        """
+        Handle the command execution.
+
+        This function reads the suppression file line by line and inserts
+        its addresses in bulk into the suppression list of the user, so
+        they are skipped by every mailing of the user.
+
+        Args:
+            *args: Additional command arguments (not used).
+            **kwargs: Additional keyword arguments, including
+                'user_email', 'path' and 'reason'.
+
+        Returns:
+            None
+
+        Example:
+            To import bounced addresses, run:
+            $ python manage.py import_suppressions <user_email> bounces.csv \
+                --reason bounced
+        """
+        try:
+            user = User.objects.get(email=kwargs['user_email'])
+        except User.DoesNotExist:
+            raise CommandError(f'User {kwargs["user_email"]} does not exist')
+
+        with open(kwargs['path'], encoding='utf-8') as suppression_file:
+            imported = import_suppressions(
+                user, suppression_file, reason=kwargs['reason']
+            )
+        self.stdout.write(
+            self.style.SUCCESS(f'{imported} suppressed addresses imported')
+        )
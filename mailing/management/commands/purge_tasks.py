@@ -0,0 +1,55 @@
+from django.core.management import BaseCommand
+
+from mailing.tasks import purge_tasks
+
+
+class Command(BaseCommand):
+    """
+    Custom management command for deleting finished background tasks.
+    """
+    help = 'Delete finished background tasks.'
+
+    def add_arguments(self, parser):
+        """
+        Define command-line arguments for the management command.
+
+        Args:
+            parser (argparse.ArgumentParser): The ArgumentParser instance.
+
+        Returns:
+            None
+
+        Example:
+            To use this command, run:
+            $ python manage.py purge_tasks --days 7
+        """
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=None,
+            help='Days finished tasks are kept (default: TASKS_RETENTION_DAYS)'
+        )
+
+    def handle(self, *args, **kwargs):
+        """
+        Handle the command execution.
+
+        This function deletes the background tasks that were done or
+        failed before the retention period, so the arguments of old
+        calls are not kept. It is meant to be run daily from cron.
+
+        Args:
+            *args: Additional command arguments (not used).
+            **kwargs: Additional keyword arguments, including 'days'.
+
+        Returns:
+            None
+
+        Example:
+            To delete every task finished more than a day ago, run:
+            $ python manage.py purge_tasks --days 1
+        """
+        deleted = purge_tasks(days=kwargs['days'])
+        self.stdout.write(
+            self.style.SUCCESS(f'{deleted} finished background tasks deleted')
+        )
@@ -0,0 +1,67 @@
+import signal
+
+from django.core.management import BaseCommand
+
+from mailing.scheduler import MailingScheduler
+
+
+class Command(BaseCommand):
+    """
+    Custom management command for running the mailing scheduler daemon.
+    """
+    help = 'Run the scheduler that sends running mailings on time.'
+
+    def add_arguments(self, parser):
+        """
+        Define command-line arguments for the management command.
+
+        Args:
+            parser (argparse.ArgumentParser): The ArgumentParser instance.
+
+        Returns:
+            None
+
+        Example:
+            To use this command, run:
+            $ python manage.py run_scheduler --reload-interval 30
+        """
+        parser.add_argument(
+            '--reload-interval',
+            type=int,
+            default=None,
+            help='Seconds between two reloads of the mailing settings'
+        )
+
+    def handle(self, *args, **kwargs):
+        """
+        Handle the command execution.
+
+        This function starts a long-running scheduler that keeps the next
+        fire times of all running mailings in memory and sends due
+        mailings in-process. The scheduler stops on SIGINT or SIGTERM.
+
+        Args:
+            *args: Additional command arguments (not used).
+            **kwargs: Additional keyword arguments, including
+                'reload_interval'.
+
+        Returns:
+            None
+
+        Example:
+            To start the scheduler, run:
+            $ python manage.py run_scheduler
+        """
+        scheduler = MailingScheduler(
+            reload_interval=kwargs['reload_interval']
+        )
+
+        def stop(signum, frame):
+            scheduler.stop()
+
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGTERM, stop)
+
+        self.stdout.write(self.style.SUCCESS('Scheduler started'))
+        scheduler.run_forever()
+        self.stdout.write(self.style.SUCCESS('Scheduler stopped'))
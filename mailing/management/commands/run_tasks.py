@@ -0,0 +1,74 @@
+from django.core.management import BaseCommand
+
+from mailing.models import PRIORITIES
+from mailing.tasks import run_task_worker
+
+
+class Command(BaseCommand):
+    """
+    Custom management command for running background tasks.
+    """
+    help = 'Run enqueued background tasks.'
+
+    def add_arguments(self, parser):
+        """
+        Define command-line arguments for the management command.
+
+        Args:
+            parser (argparse.ArgumentParser): The ArgumentParser instance.
+
+        Returns:
+            None
+
+        Example:
+            To use this command, run:
+            $ python manage.py run_tasks --batch-size 20
+        """
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=None,
+            help='Number of background tasks claimed at a time'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Stop as soon as there is no task left to run'
+        )
+        parser.add_argument(
+            '--priority',
+            action='append',
+            choices=PRIORITIES,
+            help='Lane to run tasks from, may be repeated (default: all)'
+        )
+
+    def handle(self, *args, **kwargs):
+        """
+        Handle the command execution.
+
+        This function starts a worker that claims batches of pending
+        background tasks with `SELECT ... FOR UPDATE SKIP LOCKED`, calls
+        them and retries the failed ones with a backoff. Higher priority
+        lanes are drained first. Any number of workers can run at the
+        same time on one or several hosts.
+
+        Args:
+            *args: Additional command arguments (not used).
+            **kwargs: Additional keyword arguments, including
+                'batch_size', 'once' and 'priority'.
+
+        Returns:
+            None
+
+        Example:
+            To run every enqueued task and exit, run:
+            $ python manage.py run_tasks --once
+        """
+        processed = run_task_worker(
+            batch_size=kwargs['batch_size'],
+            once=kwargs['once'],
+            priorities=kwargs['priority'] or PRIORITIES
+        )
+        self.stdout.write(
+            self.style.SUCCESS(f'{processed} background tasks processed')
+        )
@@ -26,6 +26,48 @@ class Command(BaseCommand):
         parser.add_argument(
             'mailing_pk', type=str, help='PK of the mailing to be sent'
             )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=None,
+            help='Number of messages sent per SMTP chunk'
+        )
+        parser.add_argument(
+            '--memory-report',
+            action='store_true',
+            help='Print the process RSS after every sent chunk'
+        )
+        parser.add_argument(
+            '--enqueue',
+            action='store_true',
+            default=None,
+            help='Enqueue the mailing for send_worker instead of sending it'
+        )
+        parser.add_argument(
+            '--by-domain',
+            action='store_true',
+            default=None,
+            help='Send the recipients partitioned by email domain'
+        )
+        parser.add_argument(
+            '--engine',
+            choices=('smtp', 'async'),
+            default=None,
+            help='Deliver with blocking SMTP calls or concurrent asyncio '
+                 'sessions'
+        )
+        parser.add_argument(
+            '--spool',
+            action='store_true',
+            default=None,
+            help='Render the mailing into the spool for ship_spool'
+        )
+        parser.add_argument(
+            '--snapshot',
+            action='store_true',
+            default=None,
+            help='Snapshot the recipients for send_ranges workers'
+        )
 
     def handle(self, *args, **kwargs):
         """
@@ -38,7 +80,8 @@ class Command(BaseCommand):
         Args:
             *args: Additional command arguments (not used).
             **kwargs: Additional keyword arguments, including 'mailing_pk'
-                (the PK of the mailing).
+                (the PK of the mailing), 'chunk_size', 'memory_report',
+                'enqueue', 'by_domain', 'engine', 'spool' and 'snapshot'.
 
         Returns:
             None
@@ -48,4 +91,13 @@ class Command(BaseCommand):
             $ python manage.py send_scheduled_mailings <mailing_pk>
         """
         mailing_pk = kwargs['mailing_pk']
-        run_mailing(mailing_pk)
+        run_mailing(
+            mailing_pk,
+            chunk_size=kwargs['chunk_size'],
+            memory_report=kwargs['memory_report'],
+            enqueue=kwargs['enqueue'],
+            by_domain=kwargs['by_domain'],
+            engine=kwargs['engine'],
+            spool=kwargs['spool'],
+            snapshot=kwargs['snapshot']
+        )
@@ -0,0 +1,65 @@
+from django.core.management import BaseCommand
+
+from mailing.snapshot import run_range_worker
+
+
+class Command(BaseCommand):
+    """
+    Custom management command for sending ranges of run snapshots.
+    """
+    help = 'Send claimed ranges of mailing run snapshots.'
+
+    def add_arguments(self, parser):
+        """
+        Define command-line arguments for the management command.
+
+        Args:
+            parser (argparse.ArgumentParser): The ArgumentParser instance.
+
+        Returns:
+            None
+
+        Example:
+            To use this command, run:
+            $ python manage.py send_ranges --chunk-size 200
+        """
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=None,
+            help='Number of messages sent per SMTP chunk'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Stop as soon as there is no range left to claim'
+        )
+
+    def handle(self, *args, **kwargs):
+        """
+        Handle the command execution.
+
+        This function starts a worker that claims contiguous ranges of
+        run snapshots with `SELECT ... FOR UPDATE SKIP LOCKED` and sends
+        them. Any number of workers can run at the same time on one or
+        several hosts.
+
+        Args:
+            *args: Additional command arguments (not used).
+            **kwargs: Additional keyword arguments, including
+                'chunk_size' and 'once'.
+
+        Returns:
+            None
+
+        Example:
+            To send every snapshot range and exit, run:
+            $ python manage.py send_ranges --once
+        """
+        processed = run_range_worker(
+            chunk_size=kwargs['chunk_size'],
+            once=kwargs['once']
+        )
+        self.stdout.write(
+            self.style.SUCCESS(f'{processed} snapshot ranges sent')
+        )
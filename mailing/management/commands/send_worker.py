@@ -0,0 +1,65 @@
+from django.core.management import BaseCommand
+
+from mailing.outbox import run_worker
+
+
+class Command(BaseCommand):
+    """
+    Custom management command for sending messages from the outbox.
+    """
+    help = 'Send enqueued mailing messages from the outbox.'
+
+    def add_arguments(self, parser):
+        """
+        Define command-line arguments for the management command.
+
+        Args:
+            parser (argparse.ArgumentParser): The ArgumentParser instance.
+
+        Returns:
+            None
+
+        Example:
+            To use this command, run:
+            $ python manage.py send_worker --batch-size 200
+        """
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=None,
+            help='Number of outbox messages claimed at a time'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Stop as soon as the outbox is empty'
+        )
+
+    def handle(self, *args, **kwargs):
+        """
+        Handle the command execution.
+
+        This function starts a worker that claims batches of pending
+        outbox messages with `SELECT ... FOR UPDATE SKIP LOCKED`, sends
+        them and marks them as sent or failed. Any number of workers can
+        run at the same time on one or several hosts.
+
+        Args:
+            *args: Additional command arguments (not used).
+            **kwargs: Additional keyword arguments, including
+                'batch_size' and 'once'.
+
+        Returns:
+            None
+
+        Example:
+            To send everything that is enqueued and exit, run:
+            $ python manage.py send_worker --once
+        """
+        processed = run_worker(
+            batch_size=kwargs['batch_size'],
+            once=kwargs['once']
+        )
+        self.stdout.write(
+            self.style.SUCCESS(f'{processed} outbox messages processed')
+        )
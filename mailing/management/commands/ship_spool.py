@@ -0,0 +1,66 @@
+from django.core.management import BaseCommand
+
+from mailing.spool import run_shipper
+
+
+class Command(BaseCommand):
+    """
+    Custom management command for sending spooled mailing messages.
+    """
+    help = 'Send the messages of spooled mailing runs.'
+
+    def add_arguments(self, parser):
+        """
+        Define command-line arguments for the management command.
+
+        Args:
+            parser (argparse.ArgumentParser): The ArgumentParser instance.
+
+        Returns:
+            None
+
+        Example:
+            To use this command, run:
+            $ python manage.py ship_spool --batch-size 200
+        """
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=None,
+            help='Number of files after which the run counters are updated'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Stop as soon as there is nothing to ship'
+        )
+
+    def handle(self, *args, **kwargs):
+        """
+        Handle the command execution.
+
+        This function starts a shipper that streams the spooled messages
+        of every run to SMTP in the order they were rendered and deletes
+        every file once the relay has answered for it. While the relay
+        cannot be reached, the files are kept and shipped later. One
+        shipper should run per spool directory.
+
+        Args:
+            *args: Additional command arguments (not used).
+            **kwargs: Additional keyword arguments, including
+                'batch_size' and 'once'.
+
+        Returns:
+            None
+
+        Example:
+            To ship everything that is spooled and exit, run:
+            $ python manage.py ship_spool --once
+        """
+        shipped = run_shipper(
+            batch_size=kwargs['batch_size'],
+            once=kwargs['once']
+        )
+        self.stdout.write(
+            self.style.SUCCESS(f'{shipped} spooled messages shipped')
+        )
@@ -0,0 +1,70 @@
+# Generated by Django 4.2.4 on 2026-10-17 16:06
+
+import calendar
+from datetime import date, datetime, timedelta
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def get_next_run(mailing_settings, now):
+    # A frozen copy of mailing.service.get_next_run as of this migration
+    if not all((
+        mailing_settings.mailing_periods,
+        mailing_settings.mailing_time,
+        mailing_settings.start_date,
+        mailing_settings.end_date,
+    )):
+        return None
+
+    day = max(timezone.localdate(now), mailing_settings.start_date)
+    while True:
+        if mailing_settings.mailing_periods == 'weekly':
+            week_day = ((mailing_settings.mailing_week_day_num or 0) - 1) % 7
+            day += timedelta(days=(week_day - day.weekday()) % 7)
+        elif mailing_settings.mailing_periods == 'monthly':
+            year, month = day.year, day.month
+            while True:
+                last_day = calendar.monthrange(year, month)[1]
+                candidate = date(
+                    year, month, min(mailing_settings.start_date.day, last_day)
+                )
+                if candidate >= day:
+                    break
+                year, month = (
+                    (year + 1, 1) if month == 12 else (year, month + 1)
+                )
+            day = candidate
+        if day > mailing_settings.end_date:
+            return None
+        run_at = timezone.make_aware(
+            datetime.combine(day, mailing_settings.mailing_time)
+        )
+        if run_at > now:
+            return run_at
+        day += timedelta(days=1)
+
+
+def fill_next_run_at(apps, schema_editor):
+    MailingSettings = apps.get_model('mailing', 'MailingSettings')
+    now = timezone.now()
+    running = MailingSettings.objects.filter(status='running')
+    for mailing_settings in running:
+        mailing_settings.next_run_at = get_next_run(mailing_settings, now)
+        mailing_settings.save(update_fields=['next_run_at'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mailingsettings',
+            name='next_run_at',
+            field=models.DateTimeField(blank=True, db_index=True, editable=False, null=True, verbose_name='следующий запуск'),
+        ),
+        migrations.RunPython(fill_next_run_at, migrations.RunPython.noop),
+    ]
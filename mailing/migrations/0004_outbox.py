@@ -0,0 +1,48 @@
+# Generated by Django 4.2.4 on 2026-10-17 16:07
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contacts', '0002_initial'),
+        ('mailing', '0003_mailingsettings_next_run_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MailingRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('queued', 'в очереди'), ('done', 'завершён')], default='queued', max_length=50, verbose_name='статус запуска')),
+                ('date_created', models.DateTimeField(auto_now_add=True, verbose_name='дата создания')),
+                ('date_finished', models.DateTimeField(blank=True, null=True, verbose_name='дата завершения')),
+                ('mailing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='runs', to='mailing.mailing', verbose_name='рассылка')),
+            ],
+            options={
+                'verbose_name': 'запуск рассылки',
+                'verbose_name_plural': 'запуски рассылок',
+            },
+        ),
+        migrations.CreateModel(
+            name='OutboxMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('email', models.EmailField(max_length=255, verbose_name='почта')),
+                ('status', models.CharField(choices=[('pending', 'ожидает отправки'), ('sent', 'отправлено'), ('failed', 'ошибка')], default='pending', max_length=50, verbose_name='статус')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='попытки')),
+                ('locked_until', models.DateTimeField(blank=True, null=True, verbose_name='заблокировано до')),
+                ('date_sent', models.DateTimeField(blank=True, null=True, verbose_name='дата отправки')),
+                ('error', models.TextField(blank=True, null=True, verbose_name='ошибка')),
+                ('contact', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='contacts.contacts', verbose_name='контакт')),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='mailing.mailingrun', verbose_name='запуск рассылки')),
+            ],
+            options={
+                'verbose_name': 'сообщение в очереди',
+                'verbose_name_plural': 'сообщения в очереди',
+                'indexes': [models.Index(fields=['status', 'locked_until'], name='outbox_claim_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.4 on 2026-10-17 16:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0004_outbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mailingrun',
+            name='last_contact_id',
+            field=models.BigIntegerField(blank=True, null=True, verbose_name='последний контакт'),
+        ),
+        migrations.AddField(
+            model_name='mailingrun',
+            name='sent',
+            field=models.PositiveIntegerField(default=0, verbose_name='отправлено'),
+        ),
+        migrations.AddField(
+            model_name='mailingrun',
+            name='total',
+            field=models.PositiveIntegerField(default=0, verbose_name='обработано'),
+        ),
+        migrations.AlterField(
+            model_name='mailingrun',
+            name='status',
+            field=models.CharField(choices=[('queued', 'в очереди'), ('sending', 'отправляется'), ('done', 'завершён')], default='queued', max_length=50, verbose_name='статус запуска'),
+        ),
+    ]
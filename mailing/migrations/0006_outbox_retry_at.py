@@ -0,0 +1,22 @@
+# Generated by Django 4.2.4 on 2026-10-17 16:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0005_mailingrun_checkpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboxmessage',
+            name='retry_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='повторная попытка'),
+        ),
+        migrations.AddIndex(
+            model_name='outboxmessage',
+            index=models.Index(fields=['status', 'retry_at'], name='outbox_retry_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.4 on 2026-10-17 16:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0006_outbox_retry_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mailingrun',
+            name='domain_checkpoints',
+            field=models.JSONField(default=dict, verbose_name='последний контакт по доменам'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.4 on 2026-10-17 17:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0007_mailingrun_domain_checkpoints'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='mailingrun',
+            name='status',
+            field=models.CharField(choices=[('queued', 'в очереди'), ('sending', 'отправляется'), ('spooled', 'в спуле'), ('done', 'завершён')], default='queued', max_length=50, verbose_name='статус запуска'),
+        ),
+    ]
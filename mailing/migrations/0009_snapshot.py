@@ -0,0 +1,54 @@
+# Generated by Django 4.2.4 on 2026-10-17 17:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contacts', '0003_suppression'),
+        ('mailing', '0008_mailingrun_status_spooled'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SnapshotRecipient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seq', models.PositiveIntegerField(verbose_name='номер')),
+                ('email', models.EmailField(max_length=255, verbose_name='почта')),
+                ('telephone', models.CharField(max_length=50, verbose_name='номер телефона')),
+                ('contact', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='contacts.contacts', verbose_name='контакт')),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recipients', to='mailing.mailingrun', verbose_name='запуск рассылки')),
+            ],
+            options={
+                'verbose_name': 'получатель запуска',
+                'verbose_name_plural': 'получатели запусков',
+            },
+        ),
+        migrations.CreateModel(
+            name='SnapshotRange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_seq', models.PositiveIntegerField(verbose_name='первый номер')),
+                ('last_seq', models.PositiveIntegerField(verbose_name='последний номер')),
+                ('next_seq', models.PositiveIntegerField(verbose_name='следующий номер')),
+                ('status', models.CharField(choices=[('pending', 'ожидает отправки'), ('done', 'отправлен')], default='pending', max_length=50, verbose_name='статус')),
+                ('locked_until', models.DateTimeField(blank=True, null=True, verbose_name='заблокировано до')),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ranges', to='mailing.mailingrun', verbose_name='запуск рассылки')),
+            ],
+            options={
+                'verbose_name': 'диапазон запуска',
+                'verbose_name_plural': 'диапазоны запусков',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='snapshotrecipient',
+            constraint=models.UniqueConstraint(fields=('run', 'seq'), name='snapshot_run_seq_uniq'),
+        ),
+        migrations.AddIndex(
+            model_name='snapshotrange',
+            index=models.Index(fields=['status', 'locked_until'], name='snapshot_range_claim_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.4 on 2026-10-17 18:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0009_snapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BackgroundTask',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, verbose_name='задача')),
+                ('args', models.JSONField(default=list, verbose_name='аргументы')),
+                ('kwargs', models.JSONField(default=dict, verbose_name='именованные аргументы')),
+                ('status', models.CharField(choices=[('pending', 'ожидает выполнения'), ('done', 'выполнена'), ('failed', 'ошибка')], default='pending', max_length=50, verbose_name='статус')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='попытки')),
+                ('max_attempts', models.PositiveIntegerField(default=1, verbose_name='максимум попыток')),
+                ('locked_until', models.DateTimeField(blank=True, null=True, verbose_name='заблокировано до')),
+                ('retry_at', models.DateTimeField(blank=True, null=True, verbose_name='повторная попытка')),
+                ('date_created', models.DateTimeField(auto_now_add=True, verbose_name='дата создания')),
+                ('date_done', models.DateTimeField(blank=True, null=True, verbose_name='дата выполнения')),
+                ('error', models.TextField(blank=True, null=True, verbose_name='ошибка')),
+            ],
+            options={
+                'verbose_name': 'фоновая задача',
+                'verbose_name_plural': 'фоновые задачи',
+                'indexes': [models.Index(fields=['status', 'locked_until'], name='task_claim_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.4 on 2026-10-17 18:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0010_backgroundtask'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='backgroundtask',
+            name='task_claim_idx',
+        ),
+        migrations.AddField(
+            model_name='backgroundtask',
+            name='priority',
+            field=models.CharField(choices=[('transactional', 'транзакционная'), ('notification', 'уведомление'), ('campaign', 'рассылка')], default='notification', max_length=50, verbose_name='приоритет'),
+        ),
+        migrations.AddIndex(
+            model_name='backgroundtask',
+            index=models.Index(fields=['status', 'priority', 'locked_until'], name='task_claim_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.4 on 2026-10-17 19:15
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('mailing', '0011_backgroundtask_priority'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SendingLimits',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('weight', models.PositiveIntegerField(default=1, verbose_name='вес')),
+                ('max_concurrency', models.PositiveIntegerField(blank=True, null=True, verbose_name='одновременных отправок')),
+                ('daily_quota', models.PositiveIntegerField(blank=True, null=True, verbose_name='сообщений в день')),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='sending_limits', to=settings.AUTH_USER_MODEL, verbose_name='пользователь')),
+            ],
+            options={
+                'verbose_name': 'лимиты отправки',
+                'verbose_name_plural': 'лимиты отправки',
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.4 on 2026-10-17 19:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0012_sendinglimits'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mailingrun',
+            name='paused',
+            field=models.BooleanField(default=False, verbose_name='приостановлен'),
+        ),
+        migrations.AlterField(
+            model_name='mailingrun',
+            name='status',
+            field=models.CharField(choices=[('queued', 'в очереди'), ('sending', 'отправляется'), ('spooled', 'в спуле'), ('done', 'завершён'), ('cancelled', 'отменён')], default='queued', max_length=50, verbose_name='статус запуска'),
+        ),
+        migrations.AlterField(
+            model_name='outboxmessage',
+            name='status',
+            field=models.CharField(choices=[('pending', 'ожидает отправки'), ('sent', 'отправлено'), ('failed', 'ошибка'), ('cancelled', 'отменено')], default='pending', max_length=50, verbose_name='статус'),
+        ),
+        migrations.AlterField(
+            model_name='snapshotrange',
+            name='status',
+            field=models.CharField(choices=[('pending', 'ожидает отправки'), ('done', 'отправлен'), ('cancelled', 'отменён')], default='pending', max_length=50, verbose_name='статус'),
+        ),
+    ]
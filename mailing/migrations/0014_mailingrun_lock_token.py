@@ -0,0 +1,18 @@
+# Generated by Django 4.2.4 on 2026-10-17 20:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0013_run_control'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mailingrun',
+            name='lock_token',
+            field=models.BigIntegerField(blank=True, null=True, verbose_name='токен блокировки'),
+        ),
+    ]
@@ -0,0 +1,264 @@
+import re
+from email.utils import formatdate, make_msgid
+
+from django.conf import settings
+from django.core import signing
+from django.core.mail import EmailMessage
+from django.core.mail.message import DNS_NAME, sanitize_address
+
+# Headers that differ for every recipient of a mailing
+RECIPIENT_HEADERS = ('To', 'Date', 'Message-ID', 'List-Unsubscribe')
+
+# To header of messages whose recipients are only in the envelope
+UNDISCLOSED_RECIPIENTS = 'undisclosed-recipients:;'
+
+# Plain ASCII address that needs no encoding in a header
+PLAIN_ADDRESS_RE = re.compile(r'[\w.+-]+@[\w.-]+', re.ASCII)
+
+# Salt of the signed tokens in unsubscribe links
+UNSUBSCRIBE_SALT = 'mailing.unsubscribe'
+
+
+def get_unsubscribe_url(email):
+    """
+    Get the personal unsubscribe link of a recipient.
+
+    The link is built from `settings.MAILING_UNSUBSCRIBE_URL`, whose
+    `{token}` placeholder is replaced by the signed email address.
+
+    Args:
+        email (str): The email address of the recipient.
+
+    Returns:
+        str | None: The link, or None if no unsubscribe URL is configured.
+    """
+    if not settings.MAILING_UNSUBSCRIBE_URL:
+        return None
+    token = signing.dumps(email, salt=UNSUBSCRIBE_SALT)
+    return settings.MAILING_UNSUBSCRIBE_URL.format(token=token)
+
+
+def get_recipient_headers(email):
+    """
+    Get the extra headers of a message addressed to a recipient.
+
+    Args:
+        email (str): The email address of the recipient.
+
+    Returns:
+        dict: The `List-Unsubscribe` header if a link is configured.
+    """
+    url = get_unsubscribe_url(email)
+    if url is None:
+        return {}
+    return {'List-Unsubscribe': f'<{url}>'}
+
+
+class EncodedMessage:
+    """
+    Serialised MIME message with the interface used by email backends.
+
+    Methods:
+        as_bytes: Get the message with the given line separator.
+        as_string: Get the message as text.
+        get_charset: Get the charset of the message.
+    """
+
+    def __init__(self, data):
+        self._data = data
+
+    def __len__(self):
+        return len(self._data)
+
+    def as_bytes(self, unixfrom=False, linesep='\n'):
+        """
+        Get the message with the given line separator.
+
+        Args:
+            unixfrom (bool, optional): Not used, kept for compatibility.
+            linesep (str, optional): The line separator.
+
+        Returns:
+            bytes: The serialised message.
+        """
+        if linesep == '\r\n':
+            return self._data
+        return self._data.replace(b'\r\n', linesep.encode())
+
+    def as_string(self, unixfrom=False, linesep='\n'):
+        """
+        Get the message as text.
+
+        Args:
+            unixfrom (bool, optional): Not used, kept for compatibility.
+            linesep (str, optional): The line separator.
+
+        Returns:
+            str: The serialised message.
+        """
+        return self.as_bytes(linesep=linesep).decode('utf-8')
+
+    def get_charset(self):
+        """
+        Get the charset of the message.
+
+        Returns:
+            None: The body charset is declared in its own headers.
+        """
+        return None
+
+
+class MessageTemplate:
+    """
+    MIME message of a mailing encoded once per run.
+
+    The subject, sender, MIME headers and encoded body are serialised
+    once. A message for a recipient is the cached bytes with the
+    recipient headers (To, Date, Message-ID and the unsubscribe link)
+    spliced in, so no encoding happens per recipient. A message for a
+    batch of envelope recipients hides them from each other like Bcc.
+
+    Attributes:
+        subject (str): The subject of the messages.
+        body (str): The body of the messages.
+        from_email (str): The sender of the messages.
+        encoding (str): The charset used for the headers.
+
+    Methods:
+        get_address: Get the To header value of a recipient.
+        get_headers: Get the serialised recipient headers of a message.
+        render: Get the serialised message for a recipient.
+        build: Build the email message for a recipient.
+        build_batch: Build one email message for many recipients.
+    """
+
+    def __init__(self, subject, body, from_email=None):
+        message = EmailMessage(subject, body, from_email)
+        self.subject = subject
+        self.body = body
+        self.from_email = message.from_email
+        self.encoding = message.encoding or settings.DEFAULT_CHARSET
+
+        mime = message.message()
+        for header in RECIPIENT_HEADERS:
+            del mime[header]
+        head, separator, content = mime.as_bytes(
+            linesep='\r\n'
+        ).partition(b'\r\n\r\n')
+        self._head = head + b'\r\n'
+        self._content = separator + content
+
+    def get_address(self, email):
+        """
+        Get the To header value of a recipient.
+
+        Plain ASCII addresses are used as they are, others are parsed
+        and encoded like Django does.
+
+        Args:
+            email (str): The email address of the recipient.
+
+        Returns:
+            str: The address encoded for the header.
+        """
+        if PLAIN_ADDRESS_RE.fullmatch(email):
+            return email
+        return sanitize_address(email, self.encoding)
+
+    def get_headers(self, email=None):
+        """
+        Get the serialised recipient headers of a message.
+
+        Args:
+            email (str, optional): The email address of the recipient.
+                Recipients are undisclosed if not provided.
+
+        Returns:
+            bytes: The recipient headers separated by CRLF.
+        """
+        if email is None:
+            to = UNDISCLOSED_RECIPIENTS
+        else:
+            to = self.get_address(email)
+        headers = [
+            f'To: {to}',
+            f'Date: {formatdate(localtime=settings.EMAIL_USE_LOCALTIME)}',
+            f'Message-ID: {make_msgid(domain=DNS_NAME)}',
+        ]
+        if email is not None:
+            headers.extend(
+                f'{name}: {value}'
+                for name, value in get_recipient_headers(email).items()
+            )
+        return '\r\n'.join(headers).encode('ascii')
+
+    def render(self, email=None):
+        """
+        Get the serialised message for a recipient.
+
+        Args:
+            email (str, optional): The email address of the recipient.
+                Recipients are undisclosed if not provided.
+
+        Returns:
+            bytes: The message with CRLF line separators.
+        """
+        return self._head + self.get_headers(email) + self._content
+
+    def build(self, email):
+        """
+        Build the email message for a recipient.
+
+        Args:
+            email (str): The email address of the recipient.
+
+        Returns:
+            TemplateMessage: The message addressed to the recipient.
+        """
+        return TemplateMessage(self, to=[email])
+
+    def build_batch(self, emails):
+        """
+        Build one email message for a batch of envelope recipients.
+
+        The recipients are only passed to the SMTP envelope, the To
+        header of the message does not disclose them.
+
+        Args:
+            emails (list): The email addresses of the recipients.
+
+        Returns:
+            TemplateMessage: The message addressed to the recipients.
+        """
+        return TemplateMessage(self, bcc=emails)
+
+
+class TemplateMessage(EmailMessage):
+    """
+    Email message serialised from a cached MessageTemplate.
+
+    Behaves like an EmailMessage addressed to one recipient or to a
+    batch of Bcc recipients, but its `message()` splices the recipient
+    headers into the bytes encoded once per run instead of encoding the
+    message again.
+    """
+
+    def __init__(self, template, to=None, bcc=None):
+        super().__init__(
+            subject=template.subject,
+            body=template.body,
+            from_email=template.from_email,
+            to=to,
+            bcc=bcc,
+        )
+        self.template = template
+
+    def message(self):
+        """
+        Get the serialised message.
+
+        Returns:
+            EncodedMessage: The message addressed to the recipient.
+        """
+        email = self.to[0] if self.to else None
+        return EncodedMessage(self.template.render(email))
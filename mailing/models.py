@@ -6,6 +6,12 @@ from users.models import User
 # Define a dictionary for fields that can be nullable
 NULLABLE = {'blank': True, 'null': True}
 
+# Priority classes of outgoing mail, from the highest to the lowest
+PRIORITY_TRANSACTIONAL = 'transactional'
+PRIORITY_NOTIFICATION = 'notification'
+PRIORITY_CAMPAIGN = 'campaign'
+PRIORITIES = (PRIORITY_TRANSACTIONAL, PRIORITY_NOTIFICATION, PRIORITY_CAMPAIGN)
+
 
 class Mailing(models.Model):
     """
@@ -97,9 +103,12 @@ class MailingSettings(models.Model):
         mailing_week_day_num (IntegerField): The day of the week for the mailing.
         end_date (DateField): The end date of the mailing.
         cron_setting (TextField): The CRON settings for the mailing.
+        next_run_at (DateTimeField): The precomputed time of the next run
+            (indexed, empty unless the mailing is running).
 
     Methods:
         __str__: String representation of the mailing settings.
+        save: Recompute `next_run_at` and save the mailing settings.
 
     Meta:
         verbose_name (str): The singular name of the model.
@@ -164,6 +173,26 @@ class MailingSettings(models.Model):
         **NULLABLE,
         verbose_name='настройка CRON'
     )
+    next_run_at = models.DateTimeField(
+        **NULLABLE,
+        db_index=True,
+        editable=False,
+        verbose_name='следующий запуск'
+    )
+
+    def save(self, *args, **kwargs):
+        from mailing.service import get_next_run
+
+        if self.status == self.MAILING_RUNNING:
+            self.next_run_at = get_next_run(self)
+        else:
+            self.next_run_at = None
+
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'next_run_at'}
+
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f'{self.mailing.title}'
@@ -171,3 +200,505 @@ class MailingSettings(models.Model):
     class Meta:
         verbose_name = 'Настройки рассылки'
         verbose_name_plural = 'настройки рассылок'
+
+
+class MailingRun(models.Model):
+    """
+    Model for representing a single run of a mailing.
+
+    A run is created when a mailing is enqueued and groups the outbox
+    messages of every recipient of that run. Runs sent in-process keep
+    a checkpoint of the last contact handed to SMTP, so an interrupted
+    run resumes where it stopped. Runs rendered into the spool stay
+    spooled until `ship_spool` has sent every spooled message.
+
+    Workers check `paused` and the cancelled status between batches, so a
+    paused run stops within one batch and continues from its checkpoint
+    once it is resumed.
+
+    Attributes:
+        mailing (ForeignKey): The mailing being sent.
+        status (CharField): The status of the run (queued, sending,
+            spooled, done, cancelled).
+        paused (BooleanField): Whether the run is paused.
+        date_created (DateTimeField): The timestamp of when the run was
+            created (auto-generated).
+        date_finished (DateTimeField): The timestamp of when the last
+            message of the run was processed.
+        last_contact_id (BigIntegerField): The checkpoint, the primary key
+            of the last contact handed to SMTP.
+        domain_checkpoints (JSONField): The checkpoint of every email
+            domain of a run sent in per-domain partitions.
+        total (PositiveIntegerField): The number of processed messages.
+        sent (PositiveIntegerField): The number of delivered messages.
+        lock_token (BigIntegerField): The fencing token of the mailing
+            lock of the process sending the run.
+
+    Methods:
+        __str__: String representation of the mailing run.
+
+    Meta:
+        verbose_name (str): The singular name of the model.
+        verbose_name_plural (str): The plural name of the model.
+    """
+    RUN_QUEUED = 'queued'
+    RUN_SENDING = 'sending'
+    RUN_SPOOLED = 'spooled'
+    RUN_DONE = 'done'
+    RUN_CANCELLED = 'cancelled'
+
+    RUN_STATUSES = (
+        (RUN_QUEUED, 'в очереди'),
+        (RUN_SENDING, 'отправляется'),
+        (RUN_SPOOLED, 'в спуле'),
+        (RUN_DONE, 'завершён'),
+        (RUN_CANCELLED, 'отменён'),
+    )
+
+    mailing = models.ForeignKey(
+        Mailing,
+        on_delete=models.CASCADE,
+        related_name='runs',
+        verbose_name='рассылка'
+    )
+    status = models.CharField(
+        max_length=50,
+        choices=RUN_STATUSES,
+        default=RUN_QUEUED,
+        verbose_name='статус запуска'
+    )
+    paused = models.BooleanField(
+        default=False,
+        verbose_name='приостановлен'
+    )
+    date_created = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='дата создания'
+    )
+    date_finished = models.DateTimeField(
+        **NULLABLE,
+        verbose_name='дата завершения'
+    )
+    last_contact_id = models.BigIntegerField(
+        **NULLABLE,
+        verbose_name='последний контакт'
+    )
+    domain_checkpoints = models.JSONField(
+        default=dict,
+        verbose_name='последний контакт по доменам'
+    )
+    total = models.PositiveIntegerField(
+        default=0,
+        verbose_name='обработано'
+    )
+    sent = models.PositiveIntegerField(
+        default=0,
+        verbose_name='отправлено'
+    )
+    lock_token = models.BigIntegerField(
+        **NULLABLE,
+        verbose_name='токен блокировки'
+    )
+
+    def __str__(self):
+        return f'{self.mailing} #{self.pk}'
+
+    class Meta:
+        verbose_name = 'запуск рассылки'
+        verbose_name_plural = 'запуски рассылок'
+
+
+class OutboxMessage(models.Model):
+    """
+    Model for representing one message of a mailing run in the outbox.
+
+    Outbox messages are claimed by `send_worker` processes. A claimed
+    message is leased until `locked_until`; messages of a crashed worker
+    become claimable again once their lease expires. Messages that failed
+    with a transient error stay pending until `retry_at`.
+
+    Attributes:
+        run (ForeignKey): The mailing run the message belongs to.
+        contact (ForeignKey): The recipient contact.
+        email (EmailField): The recipient email address.
+        status (CharField): The delivery status (pending, sent, failed,
+            cancelled).
+        attempts (PositiveIntegerField): The number of delivery attempts.
+        locked_until (DateTimeField): The end of the current worker lease.
+        retry_at (DateTimeField): The time of the next delivery attempt
+            after a transient failure.
+        date_sent (DateTimeField): The timestamp of a successful delivery.
+        error (TextField): The error of the last failed attempt.
+
+    Methods:
+        __str__: String representation of the outbox message.
+
+    Meta:
+        verbose_name (str): The singular name of the model.
+        verbose_name_plural (str): The plural name of the model.
+        indexes (list): Indexes used by workers to find claimable messages
+            and due retries.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_CANCELLED = 'cancelled'
+
+    STATUSES = (
+        (STATUS_PENDING, 'ожидает отправки'),
+        (STATUS_SENT, 'отправлено'),
+        (STATUS_FAILED, 'ошибка'),
+        (STATUS_CANCELLED, 'отменено'),
+    )
+
+    run = models.ForeignKey(
+        MailingRun,
+        on_delete=models.CASCADE,
+        related_name='messages',
+        verbose_name='запуск рассылки'
+    )
+    contact = models.ForeignKey(
+        Contacts,
+        on_delete=models.SET_NULL,
+        verbose_name='контакт',
+        **NULLABLE
+    )
+    email = models.EmailField(max_length=255, verbose_name='почта')
+    status = models.CharField(
+        max_length=50,
+        choices=STATUSES,
+        default=STATUS_PENDING,
+        verbose_name='статус'
+    )
+    attempts = models.PositiveIntegerField(
+        default=0,
+        verbose_name='попытки'
+    )
+    locked_until = models.DateTimeField(
+        **NULLABLE,
+        verbose_name='заблокировано до'
+    )
+    retry_at = models.DateTimeField(
+        **NULLABLE,
+        verbose_name='повторная попытка'
+    )
+    date_sent = models.DateTimeField(
+        **NULLABLE,
+        verbose_name='дата отправки'
+    )
+    error = models.TextField(
+        **NULLABLE,
+        verbose_name='ошибка'
+    )
+
+    def __str__(self):
+        return f'{self.email} ({self.status})'
+
+    class Meta:
+        verbose_name = 'сообщение в очереди'
+        verbose_name_plural = 'сообщения в очереди'
+        indexes = [
+            models.Index(
+                fields=('status', 'locked_until'),
+                name='outbox_claim_idx'
+            ),
+            models.Index(
+                fields=('status', 'retry_at'),
+                name='outbox_retry_idx'
+            ),
+        ]
+
+
+class SnapshotRecipient(models.Model):
+    """
+    Model for representing a recipient in the snapshot of a mailing run.
+
+    The recipients of a run are copied from its contact list when the
+    run starts, so editing the list does not change the run. Recipients
+    are numbered with dense sequence numbers, so workers can split the
+    run into contiguous ranges.
+
+    Attributes:
+        run (ForeignKey): The mailing run the recipient belongs to.
+        seq (PositiveIntegerField): The sequence number of the recipient
+            in the run, starting at 1.
+        contact (ForeignKey): The recipient contact.
+        email (EmailField): The recipient email address.
+        telephone (CharField): The recipient telephone number.
+
+    Methods:
+        __str__: String representation of the snapshot recipient.
+
+    Meta:
+        verbose_name (str): The singular name of the model.
+        verbose_name_plural (str): The plural name of the model.
+        constraints (list): One recipient per sequence number of a run,
+            also used to read a range of a run.
+    """
+    run = models.ForeignKey(
+        MailingRun,
+        on_delete=models.CASCADE,
+        related_name='recipients',
+        verbose_name='запуск рассылки'
+    )
+    seq = models.PositiveIntegerField(verbose_name='номер')
+    contact = models.ForeignKey(
+        Contacts,
+        on_delete=models.SET_NULL,
+        verbose_name='контакт',
+        **NULLABLE
+    )
+    email = models.EmailField(max_length=255, verbose_name='почта')
+    telephone = models.CharField(
+        max_length=50,
+        verbose_name='номер телефона'
+    )
+
+    def __str__(self):
+        return f'{self.run_id}#{self.seq} {self.email}'
+
+    class Meta:
+        verbose_name = 'получатель запуска'
+        verbose_name_plural = 'получатели запусков'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('run', 'seq'),
+                name='snapshot_run_seq_uniq'
+            ),
+        ]
+
+
+class SnapshotRange(models.Model):
+    """
+    Model for representing a contiguous range of a run snapshot.
+
+    Ranges are claimed by `send_ranges` processes like outbox messages.
+    A claimed range is leased until `locked_until` and the lease is
+    extended after every sent chunk; a range of a crashed worker becomes
+    claimable again once its lease expires and resumes from `next_seq`.
+
+    Attributes:
+        run (ForeignKey): The mailing run the range belongs to.
+        first_seq (PositiveIntegerField): The first sequence number.
+        last_seq (PositiveIntegerField): The last sequence number.
+        next_seq (PositiveIntegerField): The checkpoint, the sequence
+            number of the next recipient to send.
+        status (CharField): The status of the range (pending, done,
+            cancelled).
+        locked_until (DateTimeField): The end of the current worker lease.
+
+    Methods:
+        __str__: String representation of the snapshot range.
+
+    Meta:
+        verbose_name (str): The singular name of the model.
+        verbose_name_plural (str): The plural name of the model.
+        indexes (list): Index used by workers to find claimable ranges.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_DONE = 'done'
+    STATUS_CANCELLED = 'cancelled'
+
+    STATUSES = (
+        (STATUS_PENDING, 'ожидает отправки'),
+        (STATUS_DONE, 'отправлен'),
+        (STATUS_CANCELLED, 'отменён'),
+    )
+
+    run = models.ForeignKey(
+        MailingRun,
+        on_delete=models.CASCADE,
+        related_name='ranges',
+        verbose_name='запуск рассылки'
+    )
+    first_seq = models.PositiveIntegerField(verbose_name='первый номер')
+    last_seq = models.PositiveIntegerField(verbose_name='последний номер')
+    next_seq = models.PositiveIntegerField(verbose_name='следующий номер')
+    status = models.CharField(
+        max_length=50,
+        choices=STATUSES,
+        default=STATUS_PENDING,
+        verbose_name='статус'
+    )
+    locked_until = models.DateTimeField(
+        **NULLABLE,
+        verbose_name='заблокировано до'
+    )
+
+    def __str__(self):
+        return f'{self.run_id}#{self.first_seq}-{self.last_seq}'
+
+    class Meta:
+        verbose_name = 'диапазон запуска'
+        verbose_name_plural = 'диапазоны запусков'
+        indexes = [
+            models.Index(
+                fields=('status', 'locked_until'),
+                name='snapshot_range_claim_idx'
+            ),
+        ]
+
+
+class BackgroundTask(models.Model):
+    """
+    Model for representing a call of a background task.
+
+    Background tasks are enqueued by `@task` functions once the current
+    transaction is committed and claimed by `run_tasks` processes like
+    outbox messages. Every priority class is a separate lane and workers
+    drain the higher lanes first. A claimed task is leased until
+    `locked_until`; a failed task stays pending until `retry_at` until
+    its attempts are exhausted.
+
+    Attributes:
+        name (CharField): The dotted path of the task function.
+        args (JSONField): The positional arguments of the call.
+        kwargs (JSONField): The keyword arguments of the call.
+        priority (CharField): The priority class of the task
+            (transactional, notification, campaign).
+        status (CharField): The status of the task (pending, done, failed).
+        attempts (PositiveIntegerField): The number of attempts.
+        max_attempts (PositiveIntegerField): The maximum number of
+            attempts.
+        locked_until (DateTimeField): The end of the current worker lease.
+        retry_at (DateTimeField): The time of the next attempt after a
+            failure.
+        date_created (DateTimeField): The timestamp of the enqueueing.
+        date_done (DateTimeField): The timestamp of a successful call.
+        error (TextField): The error of the last failed attempt.
+
+    Methods:
+        __str__: String representation of the background task.
+
+    Meta:
+        verbose_name (str): The singular name of the model.
+        verbose_name_plural (str): The plural name of the model.
+        indexes (list): Index used by workers to find claimable tasks.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+
+    STATUSES = (
+        (STATUS_PENDING, 'ожидает выполнения'),
+        (STATUS_DONE, 'выполнена'),
+        (STATUS_FAILED, 'ошибка'),
+    )
+
+    PRIORITIES = (
+        (PRIORITY_TRANSACTIONAL, 'транзакционная'),
+        (PRIORITY_NOTIFICATION, 'уведомление'),
+        (PRIORITY_CAMPAIGN, 'рассылка'),
+    )
+
+    name = models.CharField(max_length=255, verbose_name='задача')
+    args = models.JSONField(default=list, verbose_name='аргументы')
+    kwargs = models.JSONField(
+        default=dict,
+        verbose_name='именованные аргументы'
+    )
+    priority = models.CharField(
+        max_length=50,
+        choices=PRIORITIES,
+        default=PRIORITY_NOTIFICATION,
+        verbose_name='приоритет'
+    )
+    status = models.CharField(
+        max_length=50,
+        choices=STATUSES,
+        default=STATUS_PENDING,
+        verbose_name='статус'
+    )
+    attempts = models.PositiveIntegerField(
+        default=0,
+        verbose_name='попытки'
+    )
+    max_attempts = models.PositiveIntegerField(
+        default=1,
+        verbose_name='максимум попыток'
+    )
+    locked_until = models.DateTimeField(
+        **NULLABLE,
+        verbose_name='заблокировано до'
+    )
+    retry_at = models.DateTimeField(
+        **NULLABLE,
+        verbose_name='повторная попытка'
+    )
+    date_created = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='дата создания'
+    )
+    date_done = models.DateTimeField(
+        **NULLABLE,
+        verbose_name='дата выполнения'
+    )
+    error = models.TextField(
+        **NULLABLE,
+        verbose_name='ошибка'
+    )
+
+    def __str__(self):
+        return f'{self.name} ({self.status})'
+
+    class Meta:
+        verbose_name = 'фоновая задача'
+        verbose_name_plural = 'фоновые задачи'
+        indexes = [
+            models.Index(
+                fields=('status', 'priority', 'locked_until'),
+                name='task_claim_idx'
+            ),
+        ]
+
+
+class SendingLimits(models.Model):
+    """
+    Model for representing the sending limits of a user.
+
+    Outbox workers serve users in deficit round-robin. A user gets
+    `weight` times the quantum of messages per turn, sends at most
+    `max_concurrency` batches at a time and at most `daily_quota`
+    messages per day. Users without limits get the defaults of the
+    settings.
+
+    Attributes:
+        user (OneToOneField): The user the limits apply to.
+        weight (PositiveIntegerField): The share of the user relative to
+            other users.
+        max_concurrency (PositiveIntegerField): The maximum number of
+            batches sent at a time, `settings.MAILING_USER_CONCURRENCY`
+            if empty.
+        daily_quota (PositiveIntegerField): The maximum number of
+            messages sent per day, `settings.MAILING_USER_DAILY_QUOTA`
+            if empty, unlimited if 0.
+
+    Methods:
+        __str__: String representation of the sending limits.
+
+    Meta:
+        verbose_name (str): The singular name of the model.
+        verbose_name_plural (str): The plural name of the model.
+    """
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        related_name='sending_limits',
+        verbose_name='пользователь'
+    )
+    weight = models.PositiveIntegerField(default=1, verbose_name='вес')
+    max_concurrency = models.PositiveIntegerField(
+        **NULLABLE,
+        verbose_name='одновременных отправок'
+    )
+    daily_quota = models.PositiveIntegerField(
+        **NULLABLE,
+        verbose_name='сообщений в день'
+    )
+
+    def __str__(self):
+        return f'{self.user} (x{self.weight})'
+
+    class Meta:
+        verbose_name = 'лимиты отправки'
+        verbose_name_plural = 'лимиты отправки'
@@ -0,0 +1,540 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.db import close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from contacts.models import Contacts
+from logs.models import Logging
+from logs.service import DeliveryLogBuffer
+from mailing.fairshare import FairScheduler
+from mailing.models import MailingRun, OutboxMessage, SnapshotRange
+from mailing.recipients import (
+    Recipient, RecipientDeduplicator, iter_recipients,
+)
+from mailing.rendering import CompiledMailing
+from mailing.retry import get_retry_at
+from mailing.sender import chunked, deliver_all
+from mailing.suppression import get_suppression_set
+
+
+def enqueue_mailing(mailing, chunk_size=None):
+    """
+    Create a run of a mailing with one outbox message per recipient.
+
+    Recipients are streamed from the database and inserted with
+    `bulk_create` in chunks, so memory usage does not depend on the size
+    of the contact list. Duplicate addresses and recipients on the
+    suppression list of the author of the mailing are not enqueued.
+
+    The run and its messages are created in one transaction, so workers
+    only claim the messages once `total` of the run is stored and the
+    run cannot be finished before it is fully enqueued.
+
+    Args:
+        mailing (Mailing): The mailing to enqueue.
+        chunk_size (int, optional): The number of rows inserted at a
+            time. Defaults to `settings.MAILING_ITERATOR_CHUNK_SIZE`.
+
+    Returns:
+        MailingRun: The created mailing run.
+    """
+    if chunk_size is None:
+        chunk_size = settings.MAILING_ITERATOR_CHUNK_SIZE
+
+    deduplicator = RecipientDeduplicator(mailing)
+    suppression = get_suppression_set(mailing)
+    stream = suppression.filter(deduplicator.filter(iter_recipients(mailing)))
+    with transaction.atomic():
+        run = MailingRun.objects.create(mailing=mailing)
+        for recipients in chunked(stream, chunk_size):
+            OutboxMessage.objects.bulk_create(
+                OutboxMessage(
+                    run=run,
+                    contact_id=recipient.pk,
+                    email=recipient.email,
+                )
+                for recipient in recipients
+            )
+            run.total += len(recipients)
+        run.save(update_fields=('total',))
+    return run
+
+
+def enqueue_retries(run, failures, now=None):
+    """
+    Enqueue the transient delivery failures of a run for a retry.
+
+    Args:
+        run (MailingRun): The run the failed deliveries belong to.
+        failures (iterable): (recipient, DeliveryResult) pairs of the
+            failed deliveries, recipients with `pk` and `email` attributes.
+        now (datetime, optional): The current time. Defaults to now.
+
+    Returns:
+        int: The number of enqueued retries.
+    """
+    if now is None:
+        now = timezone.now()
+
+    retries = []
+    for recipient, result in failures:
+        retry_at = get_retry_at(result, 1, now)
+        if retry_at is not None:
+            retries.append(
+                OutboxMessage(
+                    run=run,
+                    contact_id=recipient.pk,
+                    email=recipient.email,
+                    attempts=1,
+                    retry_at=retry_at,
+                    error=result.error,
+                )
+            )
+    OutboxMessage.objects.bulk_create(retries)
+    return len(retries)
+
+
+def get_claimable(now, retries_only=False):
+    """
+    Get the condition of outbox messages a worker may claim.
+
+    Messages of paused and cancelled runs are not claimable.
+
+    Args:
+        now (datetime): The current time.
+        retries_only (bool, optional): Whether only messages that are
+            due for a retry are claimable.
+
+    Returns:
+        Q: The condition of claimable messages.
+    """
+    if retries_only:
+        due = Q(retry_at__lte=now)
+    else:
+        due = Q(retry_at__isnull=True) | Q(retry_at__lte=now)
+    return (
+        due
+        & (Q(locked_until__isnull=True) | Q(locked_until__lt=now))
+        & Q(status=OutboxMessage.STATUS_PENDING)
+        & Q(run__paused=False)
+        & ~Q(run__status=MailingRun.RUN_CANCELLED)
+    )
+
+
+def claim_batch(batch_size=None, lease=None, retries_only=False,
+                condition=None):
+    """
+    Claim a batch of pending outbox messages for the current worker.
+
+    The rows are selected with `SELECT ... FOR UPDATE SKIP LOCKED`, so
+    concurrent workers never claim the same message, and leased until
+    `now + lease`. Messages whose lease has expired, e.g. because their
+    worker crashed, are claimed again. Messages waiting for a retry are
+    only claimed once their `retry_at` has passed. The `locked_until`
+    of the claimed instances identifies the lease of the worker.
+
+    Args:
+        batch_size (int, optional): The maximum number of messages to
+            claim. Defaults to `settings.MAILING_OUTBOX_BATCH_SIZE`.
+        lease (int, optional): The lease duration in seconds. Defaults
+            to `settings.MAILING_OUTBOX_LEASE`.
+        retries_only (bool, optional): Whether to claim only messages
+            that are due for a retry.
+        condition (Q, optional): An additional condition of the claimed
+            messages.
+
+    Returns:
+        list: The claimed OutboxMessage instances.
+    """
+    if batch_size is None:
+        batch_size = settings.MAILING_OUTBOX_BATCH_SIZE
+    if lease is None:
+        lease = settings.MAILING_OUTBOX_LEASE
+
+    now = timezone.now()
+    with transaction.atomic():
+        messages = list(
+            OutboxMessage.objects.select_for_update(
+                skip_locked=True, of=('self',)
+            ).filter(
+                get_claimable(now, retries_only),
+                condition or Q(),
+            ).order_by('pk')[:batch_size]
+        )
+        locked_until = now + timedelta(seconds=lease)
+        OutboxMessage.objects.filter(
+            pk__in=[message.pk for message in messages]
+        ).update(locked_until=locked_until)
+    for message in messages:
+        message.locked_until = locked_until
+    return messages
+
+
+def get_held(messages):
+    """
+    Get the condition of claimed outbox messages whose lease is held.
+
+    A message reclaimed by another worker after its lease expired has a
+    different `locked_until` and does not match.
+
+    Args:
+        messages (list): The claimed OutboxMessage instances.
+
+    Returns:
+        Q: The condition of the messages still leased to the worker.
+    """
+    leases = {}
+    for message in messages:
+        leases.setdefault(message.locked_until, []).append(message.pk)
+    held = Q(pk__in=[])
+    for locked_until, pks in leases.items():
+        held |= Q(pk__in=pks, locked_until=locked_until)
+    return held
+
+
+def renew_lease(messages, lease=None):
+    """
+    Extend the lease of claimed outbox messages before they are sent.
+
+    Args:
+        messages (list): The claimed OutboxMessage instances.
+        lease (int, optional): The lease duration in seconds. Defaults
+            to `settings.MAILING_OUTBOX_LEASE`.
+
+    Returns:
+        list: The messages whose lease was still held, with their new
+            `locked_until`. The others are left to the worker that
+            reclaimed them.
+    """
+    if lease is None:
+        lease = settings.MAILING_OUTBOX_LEASE
+
+    locked_until = timezone.now() + timedelta(seconds=lease)
+    with transaction.atomic():
+        held = set(
+            OutboxMessage.objects.select_for_update().filter(
+                get_held(messages)
+            ).values_list('pk', flat=True)
+        )
+        OutboxMessage.objects.filter(pk__in=held).update(
+            locked_until=locked_until
+        )
+    messages = [message for message in messages if message.pk in held]
+    for message in messages:
+        message.locked_until = locked_until
+    return messages
+
+
+def claim_fair_batch(scheduler, batch_size=None):
+    """
+    Claim a batch of pending outbox messages of the next user in turn.
+
+    The users with claimable messages are looked up at most once per
+    `settings.MAILING_FAIR_SHARE_USERS_TTL` seconds, not for every batch.
+
+    Args:
+        scheduler (FairScheduler): The scheduler of the worker.
+        batch_size (int, optional): The maximum number of messages to
+            claim. Defaults to `settings.MAILING_OUTBOX_BATCH_SIZE`.
+
+    Returns:
+        Turn | None: The claimed messages of a user, or None if no user
+            may send.
+    """
+    if batch_size is None:
+        batch_size = settings.MAILING_OUTBOX_BATCH_SIZE
+
+    user_ids = scheduler.get_user_ids(
+        lambda: OutboxMessage.objects.filter(
+            get_claimable(timezone.now())
+        ).order_by().values_list(
+            'run__mailing__user_id', flat=True
+        ).distinct()
+    )
+    return scheduler.claim(
+        user_ids,
+        lambda user_id, size: claim_batch(
+            size, condition=Q(run__mailing__user_id=user_id)
+        ),
+        batch_size,
+    )
+
+
+def finish_runs(run_pks):
+    """
+    Mark runs without pending messages as done and log their result.
+
+    Runs with snapshot ranges that are not sent yet are not finished.
+
+    Args:
+        run_pks (iterable): Primary keys of the runs to check.
+
+    Returns:
+        None
+    """
+    for run in MailingRun.objects.filter(
+        pk__in=run_pks,
+        status=MailingRun.RUN_QUEUED,
+    ).select_related('mailing'):
+        if run.messages.filter(status=OutboxMessage.STATUS_PENDING).exists():
+            continue
+        if run.ranges.filter(status=SnapshotRange.STATUS_PENDING).exists():
+            continue
+
+        finished = MailingRun.objects.filter(
+            pk=run.pk,
+            status=MailingRun.RUN_QUEUED,
+        ).update(status=MailingRun.RUN_DONE, date_finished=timezone.now())
+        if not finished:
+            continue
+
+        if run.sent < run.total:
+            attempt_status = Logging.ATTEMPT_ERROR
+        else:
+            attempt_status = Logging.ATTEMPT_OK
+        Logging.objects.create(
+            mailing=run.mailing,
+            attempt_status=attempt_status
+        )
+
+
+def process_batch(connection, delivery_log, batch_size=None,
+                  retries_only=False, scheduler=None):
+    """
+    Claim a batch of outbox messages, send them and record the results.
+
+    The messages of every run are delivered together, so identical
+    messages are sent in envelope batches. Messages that failed with a
+    transient error are rescheduled with an exponential backoff until
+    the attempts are exhausted, other failed messages are marked as
+    failed.
+
+    With a scheduler the batch is claimed for the next user in turn and
+    holds one of their concurrency slots until it is sent.
+
+    Args:
+        connection: The open email backend shared by the worker.
+        delivery_log (DeliveryLogBuffer): The buffer the result of every
+            delivery is added to.
+        batch_size (int, optional): The maximum number of messages to
+            claim.
+        retries_only (bool, optional): Whether to process only messages
+            that are due for a retry.
+        scheduler (FairScheduler, optional): The scheduler sharing the
+            worker between users.
+
+    Returns:
+        int: The number of processed messages.
+    """
+    if scheduler is None:
+        messages = claim_batch(batch_size, retries_only=retries_only)
+        return send_batch(connection, delivery_log, messages)
+
+    turn = claim_fair_batch(scheduler, batch_size)
+    if turn is None:
+        return 0
+    try:
+        return send_batch(connection, delivery_log, turn.items)
+    finally:
+        scheduler.release(turn)
+
+
+def send_batch(connection, delivery_log, messages):
+    """
+    Send claimed outbox messages and record the results.
+
+    The messages are sent in slices of
+    `settings.MAILING_OUTBOX_LEASE_BATCH`. The lease of a slice is
+    renewed before it is sent and its results are only stored for the
+    messages still leased to the worker, so a batch outlasting its
+    lease, e.g. under a shared rate limit, is never sent twice.
+
+    Args:
+        connection: The open email backend shared by the worker.
+        delivery_log (DeliveryLogBuffer): The buffer the result of every
+            delivery is added to.
+        messages (list): The claimed OutboxMessage instances.
+
+    Returns:
+        int: The number of processed messages.
+    """
+    if not messages:
+        return 0
+
+    runs = {
+        run.pk: run
+        for run in MailingRun.objects.filter(
+            pk__in={message.run_id for message in messages}
+        ).select_related('mailing', 'mailing__contact_list')
+    }
+    compiled = {
+        run_pk: CompiledMailing(run.mailing) for run_pk, run in runs.items()
+    }
+    telephones = dict(
+        Contacts.objects.filter(
+            pk__in={message.contact_id for message in messages}
+        ).values_list('pk', 'telephone')
+    )
+
+    batches = {run_pk: [] for run_pk in runs}
+    for message in messages:
+        batches[message.run_id].append(message)
+
+    sent_per_run = dict.fromkeys(runs, 0)
+    for run_pk, batch in batches.items():
+        for messages_slice in chunked(
+            batch, settings.MAILING_OUTBOX_LEASE_BATCH
+        ):
+            messages_slice = renew_lease(messages_slice)
+            if not messages_slice:
+                continue
+            sent_per_run[run_pk] += send_slice(
+                connection, delivery_log, compiled[run_pk], messages_slice,
+                telephones,
+            )
+
+    for run_pk, run_sent in sent_per_run.items():
+        if run_sent:
+            MailingRun.objects.filter(pk=run_pk).update(
+                sent=F('sent') + run_sent
+            )
+    delivery_log.flush()
+
+    finish_runs(runs.keys())
+    return len(messages)
+
+
+def send_slice(connection, delivery_log, compiled, messages, telephones):
+    """
+    Send leased outbox messages of one run and store their results.
+
+    Args:
+        connection: The open email backend shared by the worker.
+        delivery_log (DeliveryLogBuffer): The buffer the result of every
+            delivery is added to.
+        compiled (CompiledMailing): The compiled mailing of the run.
+        messages (list): The leased OutboxMessage instances.
+        telephones (dict): The telephones of the contacts by primary key.
+
+    Returns:
+        int: The number of sent messages stored as sent.
+    """
+    held = get_held(messages)
+    recipients = [
+        Recipient(
+            message.contact_id,
+            message.email,
+            telephones.get(message.contact_id, ''),
+        )
+        for message in messages
+    ]
+    results = deliver_all(connection, compiled, recipients)
+
+    sent, failed = [], []
+    for message, (recipient, result) in zip(messages, results):
+        delivery_log.add(
+            message.run_id, recipient.pk, recipient.email, result
+        )
+        if result.sent:
+            sent.append(message.pk)
+            continue
+
+        message.attempts += 1
+        message.error = result.error
+        message.locked_until = None
+        message.retry_at = get_retry_at(result, message.attempts)
+        if message.retry_at is None:
+            message.status = OutboxMessage.STATUS_FAILED
+        failed.append(message)
+
+    with transaction.atomic():
+        still_held = set(
+            OutboxMessage.objects.select_for_update().filter(
+                held
+            ).values_list('pk', flat=True)
+        )
+        sent = [pk for pk in sent if pk in still_held]
+        OutboxMessage.objects.filter(pk__in=sent).update(
+            status=OutboxMessage.STATUS_SENT,
+            attempts=F('attempts') + 1,
+            date_sent=timezone.now(),
+            locked_until=None,
+            retry_at=None,
+        )
+        OutboxMessage.objects.bulk_update(
+            [message for message in failed if message.pk in still_held],
+            ('status', 'attempts', 'locked_until', 'retry_at', 'error'),
+        )
+    return len(sent)
+
+
+def run_worker(batch_size=None, idle_sleep=None, once=False):
+    """
+    Process outbox messages until the outbox is empty or forever.
+
+    Batches are shared between the users with pending messages by a
+    FairScheduler, so a huge campaign does not starve smaller ones.
+
+    Args:
+        batch_size (int, optional): The maximum number of messages
+            claimed at a time.
+        idle_sleep (float, optional): Seconds to wait when the outbox is
+            empty. Defaults to `settings.MAILING_OUTBOX_IDLE_SLEEP`.
+        once (bool, optional): Whether to stop as soon as the outbox is
+            empty.
+
+    Returns:
+        int: The number of processed messages.
+    """
+    if idle_sleep is None:
+        idle_sleep = settings.MAILING_OUTBOX_IDLE_SLEEP
+
+    processed = 0
+    connection = get_connection()
+    delivery_log = DeliveryLogBuffer()
+    scheduler = FairScheduler()
+    try:
+        while True:
+            close_old_connections()
+            count = process_batch(
+                connection, delivery_log, batch_size, scheduler=scheduler
+            )
+            processed += count
+            if count:
+                continue
+            if once:
+                return processed
+            connection.close()
+            time.sleep(idle_sleep)
+    finally:
+        connection.close()
+
+
+def process_retries(batch_size=None):
+    """
+    Send every outbox message that is due for a retry.
+
+    Args:
+        batch_size (int, optional): The maximum number of messages
+            claimed at a time.
+
+    Returns:
+        int: The number of processed messages.
+    """
+    processed = 0
+    connection = get_connection()
+    delivery_log = DeliveryLogBuffer()
+    try:
+        while True:
+            count = process_batch(
+                connection, delivery_log, batch_size, retries_only=True
+            )
+            if not count:
+                return processed
+            processed += count
+    finally:
+        connection.close()
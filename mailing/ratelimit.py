@@ -0,0 +1,266 @@
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+
+from mailing.models import PRIORITIES, PRIORITY_CAMPAIGN
+from service.utils import get_redis_client, is_redis_cache
+
+# Takes tokens from every bucket in KEYS or from none of them.
+# ARGV holds (rate, capacity, tokens, reserve) quadruplets for the
+# buckets in KEYS. The tokens are only taken if the reserve is left in
+# the bucket afterwards. A bucket lends the tokens beyond its capacity,
+# so a batch larger than the burst waits for a full bucket and leaves it
+# in debt. Returns the number of seconds to wait before the tokens are
+# available in all buckets, as a string since Lua numbers are truncated
+# to integers by Redis.
+TAKE_TOKENS_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local wait = 0
+local tokens = {}
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[4 * i - 3])
+    local capacity = tonumber(ARGV[4 * i - 2])
+    local reserve = tonumber(ARGV[4 * i])
+    local needed = reserve + math.min(
+        tonumber(ARGV[4 * i - 1]), capacity - reserve
+    )
+    local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+    local available = tonumber(bucket[1]) or capacity
+    local ts = tonumber(bucket[2]) or now
+    available = math.min(capacity, available + math.max(0, now - ts) * rate)
+    if available < needed then
+        wait = math.max(wait, (needed - available) / rate)
+    end
+    tokens[i] = available
+end
+if wait > 0 then
+    return tostring(wait)
+end
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[4 * i - 3])
+    local capacity = tonumber(ARGV[4 * i - 2])
+    local taken = tonumber(ARGV[4 * i - 1])
+    redis.call('HSET', key, 'tokens', tokens[i] - taken, 'ts', now)
+    redis.call('EXPIRE', key, math.ceil((capacity + taken) / rate) + 1)
+end
+return '0'
+"""
+
+
+class RedisTokenBuckets:
+    """
+    Token buckets stored in the Redis server of the default cache.
+
+    The buckets are shared by every process using the same cache, so
+    several workers send within one common budget.
+
+    Methods:
+        take: Take tokens from each of the given buckets.
+    """
+
+    def __init__(self, client):
+        self._client = client
+        self._script = self._client.register_script(TAKE_TOKENS_SCRIPT)
+
+    def take(self, buckets):
+        """
+        Take tokens from each bucket, or from none of them.
+
+        Args:
+            buckets (list): (key, rate, capacity, tokens, reserve) tuples.
+
+        Returns:
+            float: Zero if the tokens were taken, otherwise the number of
+                seconds until all buckets have enough tokens.
+        """
+        keys, args = [], []
+        for key, rate, capacity, tokens, reserve in buckets:
+            keys.append(key)
+            args.extend((rate, capacity, tokens, reserve))
+        return float(self._script(keys=keys, args=args))
+
+
+class LocalTokenBuckets:
+    """
+    Token buckets kept in the memory of the current process.
+
+    Used when the default cache is not Redis, so the budget is not shared
+    between processes.
+
+    Methods:
+        take: Take tokens from each of the given buckets.
+    """
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, buckets):
+        """
+        Take tokens from each bucket, or from none of them.
+
+        The tokens are only taken if the reserve is left in the bucket
+        afterwards. A bucket lends the tokens beyond its capacity, so a
+        batch larger than the burst waits for a full bucket and leaves it
+        in debt.
+
+        Args:
+            buckets (list): (key, rate, capacity, tokens, reserve) tuples.
+
+        Returns:
+            float: Zero if the tokens were taken, otherwise the number of
+                seconds until all buckets have enough tokens.
+        """
+        with self._lock:
+            now = time.monotonic()
+            wait, available_tokens = 0, []
+            for key, rate, capacity, tokens, reserve in buckets:
+                available, ts = self._buckets.get(key, (capacity, now))
+                available = min(capacity, available + (now - ts) * rate)
+                needed = reserve + min(tokens, capacity - reserve)
+                if available < needed:
+                    wait = max(wait, (needed - available) / rate)
+                available_tokens.append(available)
+            if wait:
+                return wait
+
+            for (key, rate, capacity, tokens, reserve), available in zip(
+                buckets, available_tokens
+            ):
+                self._buckets[key] = (available - tokens, now)
+            return 0
+
+
+class RateLimiter:
+    """
+    Rate limiter for outgoing mail.
+
+    Every message takes a token from the bucket of the sending SMTP
+    account and, for each of its recipients, a token from the bucket of
+    the recipient's domain, so neither the relay nor a single provider
+    receives more than its configured rate. Limits are defined in
+    `settings.MAILING_RATE_LIMITS` as (messages per second, burst) pairs.
+
+    Every priority class may use the whole budget of a bucket while the
+    others are idle. `settings.MAILING_PRIORITY_SHARES` reserves a share
+    of the burst of every bucket for each class, which the lower classes
+    must leave in the bucket, so a campaign draining an account or a
+    domain never delays transactional mail by more than the reserve
+    takes to refill.
+
+    Methods:
+        get_buckets: Get the buckets a message has to take tokens from.
+        wait: Block until a message may be sent.
+    """
+
+    def __init__(self, limits=None, backend=None, shares=None):
+        if limits is None:
+            limits = settings.MAILING_RATE_LIMITS
+        if shares is None:
+            shares = settings.MAILING_PRIORITY_SHARES
+        if (set(shares) != set(PRIORITIES)
+                or any(share <= 0 for share in shares.values())
+                or sum(shares.values()) > 1):
+            raise ImproperlyConfigured(
+                'MAILING_PRIORITY_SHARES must give every priority class a '
+                'share above 0, and the shares must not exceed 1 in total.'
+            )
+        if backend is None:
+            if is_redis_cache():
+                backend = RedisTokenBuckets(get_redis_client())
+            else:
+                backend = LocalTokenBuckets()
+        self.limits = limits
+        self.backend = backend
+        # Share of the burst of a bucket a class must leave to the higher
+        # classes, rounded so a float error does not hold back a token
+        self.reserves = {
+            priority: round(
+                sum(shares[higher] for higher in PRIORITIES[:index]), 6
+            )
+            for index, priority in enumerate(PRIORITIES)
+        }
+
+    def get_buckets(self, account, recipients, priority=PRIORITY_CAMPAIGN):
+        """
+        Get the buckets a message has to take tokens from.
+
+        Args:
+            account (str): The SMTP account the message is sent from.
+            recipients (iterable): The recipient email addresses.
+            priority (str, optional): The priority class of the message.
+
+        Returns:
+            list: (key, rate, capacity, tokens, reserve) tuples.
+        """
+        reserve = self.reserves[priority]
+        rate, capacity = self.limits['account']
+        buckets = [(
+            cache.make_key(f'ratelimit:account:{account}'),
+            rate,
+            capacity,
+            1,
+            capacity * reserve,
+        )]
+
+        domains = Counter(
+            email.rpartition('@')[2].lower() for email in recipients
+        )
+        for domain, count in sorted(domains.items()):
+            rate, capacity = self.limits['domains'].get(
+                domain, self.limits['domain']
+            )
+            buckets.append((
+                cache.make_key(f'ratelimit:domain:{domain}'),
+                rate,
+                capacity,
+                count,
+                capacity * reserve,
+            ))
+        return buckets
+
+    def wait(self, account, recipients, priority=PRIORITY_CAMPAIGN):
+        """
+        Block until a message may be sent from the account to recipients.
+
+        Args:
+            account (str): The SMTP account the message is sent from.
+            recipients (iterable): The recipient email addresses.
+            priority (str, optional): The priority class of the message.
+
+        Returns:
+            float: The number of seconds spent waiting.
+        """
+        buckets = self.get_buckets(account, recipients, priority)
+        waited = 0
+        while True:
+            delay = self.backend.take(buckets)
+            if not delay:
+                return waited
+            time.sleep(delay)
+            waited += delay
+
+
+_rate_limiter = None
+
+
+def get_rate_limiter():
+    """
+    Get the rate limiter shared by the current process.
+
+    Returns:
+        RateLimiter | None: The rate limiter, or None if rate limiting is
+            disabled.
+    """
+    global _rate_limiter
+
+    if not settings.MAILING_RATE_LIMIT_ENABLED:
+        return None
+    if _rate_limiter is None:
+        _rate_limiter = RateLimiter()
+    return _rate_limiter
@@ -0,0 +1,243 @@
+import threading
+from collections import namedtuple
+
+from django.conf import settings
+from django.db.models import Count, Min, Value
+from django.db.models.functions import Lower, StrIndex, Substr, Trim
+
+from contacts.models import Contacts
+from mailing.suppression import hash_email, normalize_email
+
+# Fields of a contact needed to address and personalise a message
+RECIPIENT_FIELDS = ('pk', 'email', 'telephone')
+
+# Recipient of a message built outside of a recipients queryset
+Recipient = namedtuple('Recipient', RECIPIENT_FIELDS)
+
+
+def get_list_contacts(mailing, deduplicate=None):
+    """
+    Get the contacts of a mailing's contact list.
+
+    When de-duplication in the database is enabled, only the contact with
+    the lowest primary key is kept for every normalised email, so a
+    contact added to the list several times or an address stored in
+    several contacts is sent once. Primary key order is preserved, so
+    checkpoints keep working.
+
+    Args:
+        mailing (Mailing): The mailing whose contact list is used.
+        deduplicate (bool, optional): Whether to de-duplicate the
+            contacts in the database. Defaults to
+            `settings.MAILING_DEDUPLICATE_IN_DB`.
+
+    Returns:
+        QuerySet: The contacts of the list.
+    """
+    if deduplicate is None:
+        deduplicate = settings.MAILING_DEDUPLICATE_IN_DB
+    contacts = Contacts.objects.filter(
+        contactslist__list=mailing.contact_list
+    )
+    if not deduplicate:
+        return contacts
+
+    first_pks = contacts.annotate(
+        address=Lower(Trim('email'))
+    ).order_by().values('address').annotate(
+        first_pk=Min('pk')
+    ).values('first_pk')
+    return Contacts.objects.filter(pk__in=first_pks)
+
+
+def count_duplicates(mailing):
+    """
+    Count the recipients of a mailing's contact list that are duplicates.
+
+    Args:
+        mailing (Mailing): The mailing whose contact list is used.
+
+    Returns:
+        int: The number of list entries beyond the first one of every
+            normalised email.
+    """
+    if mailing.contact_list_id is None:
+        return 0
+    counts = Contacts.objects.filter(
+        contactslist__list=mailing.contact_list
+    ).aggregate(
+        rows=Count('pk'),
+        addresses=Count(Lower(Trim('email')), distinct=True),
+    )
+    return counts['rows'] - counts['addresses']
+
+
+class RecipientDeduplicator:
+    """
+    De-duplication of the recipients of a run.
+
+    When de-duplication in the database is enabled the recipient stream
+    is already unique and only the number of dropped duplicates is
+    counted, with a single query. Otherwise the stream is filtered with
+    a set of hashes of the normalised addresses seen so far; the set
+    only covers the current process, so duplicates sent before a run
+    was resumed are not known.
+
+    Attributes:
+        dropped (int): The number of dropped duplicate recipients.
+
+    Methods:
+        filter: Skip the recipients whose address was already streamed.
+    """
+
+    def __init__(self, mailing):
+        self.in_db = settings.MAILING_DEDUPLICATE_IN_DB
+        self.dropped = count_duplicates(mailing) if self.in_db else 0
+        self._seen = set()
+        self._lock = threading.Lock()
+
+    def filter(self, recipients):
+        """
+        Skip the recipients whose address was already streamed.
+
+        Args:
+            recipients (iterable): Recipients with an `email` attribute.
+
+        Yields:
+            The first recipient of every normalised address.
+        """
+        if self.in_db:
+            yield from recipients
+            return
+        for recipient in recipients:
+            address = hash_email(normalize_email(recipient.email))
+            with self._lock:
+                duplicate = address in self._seen
+                if duplicate:
+                    self.dropped += 1
+                else:
+                    self._seen.add(address)
+            if not duplicate:
+                yield recipient
+
+
+def get_contacts_queryset(mailing):
+    """
+    Get the contacts of a mailing's contact list annotated with `domain`.
+
+    Args:
+        mailing (Mailing): The mailing whose contact list is used.
+
+    Returns:
+        QuerySet: The contacts with the lowercased domain of their email.
+    """
+    return get_list_contacts(mailing).annotate(
+        domain=Lower(
+            Substr('email', StrIndex('email', Value('@')) + 1)
+        )
+    )
+
+
+def get_domain_backlog(mailing, checkpoints=None):
+    """
+    Count the recipients of a mailing per email domain.
+
+    Args:
+        mailing (Mailing): The mailing whose contact list is used.
+        checkpoints (dict, optional): The primary key of the last contact
+            already sent per domain; those contacts are not counted.
+
+    Returns:
+        dict: The number of recipients left per domain, largest first.
+    """
+    if mailing.contact_list_id is None:
+        return {}
+
+    backlog = get_contacts_queryset(mailing).order_by().values(
+        'domain'
+    ).annotate(count=Count('pk')).values_list('domain', 'count')
+    backlog = dict(backlog)
+
+    for domain, last_contact_id in (checkpoints or {}).items():
+        if domain in backlog:
+            backlog[domain] = get_contacts_queryset(mailing).filter(
+                domain=domain,
+                pk__gt=last_contact_id,
+            ).count()
+
+    return dict(
+        sorted(backlog.items(), key=lambda item: item[1], reverse=True)
+    )
+
+
+def get_recipients_queryset(mailing, deduplicate=None):
+    """
+    Get the recipients of a mailing as lightweight rows.
+
+    Only the columns listed in `RECIPIENT_FIELDS` are selected and the
+    rows are ordered by primary key, so no Contacts model instances are built
+    while sending.
+
+    Args:
+        mailing (Mailing): The mailing whose contact list is used.
+        deduplicate (bool, optional): Whether to de-duplicate the
+            recipients in the database. Defaults to
+            `settings.MAILING_DEDUPLICATE_IN_DB`.
+
+    Returns:
+        QuerySet: A named values list of recipient rows.
+    """
+    return get_list_contacts(mailing, deduplicate).order_by('pk').values_list(
+        *RECIPIENT_FIELDS, named=True
+    )
+
+
+def get_domain_recipients_queryset(mailing, domain):
+    """
+    Get the recipients of a mailing with an email on the given domain.
+
+    Args:
+        mailing (Mailing): The mailing whose contact list is used.
+        domain (str): The lowercased email domain.
+
+    Returns:
+        QuerySet: A named values list of recipient rows.
+    """
+    return get_contacts_queryset(mailing).filter(
+        domain=domain
+    ).order_by('pk').values_list(*RECIPIENT_FIELDS, named=True)
+
+
+def iter_recipients(mailing, chunk_size=None, after=None, domain=None):
+    """
+    Stream the recipients of a mailing.
+
+    The queryset is consumed with `iterator()`, which uses a server-side
+    cursor on PostgreSQL, so memory usage stays flat regardless of the
+    size of the contact list.
+
+    Args:
+        mailing (Mailing): The mailing whose contact list is used.
+        chunk_size (int, optional): The number of rows fetched from the
+            database at a time. Defaults to
+            `settings.MAILING_ITERATOR_CHUNK_SIZE`.
+        after (int, optional): Only stream contacts with a greater primary
+            key, used to resume an interrupted run.
+        domain (str, optional): Only stream recipients with an email on
+            this lowercased domain.
+
+    Yields:
+        Row: The next recipient with `pk`, `email` and `telephone`
+            attributes.
+    """
+    if chunk_size is None:
+        chunk_size = settings.MAILING_ITERATOR_CHUNK_SIZE
+    if mailing.contact_list_id is None:
+        return
+    if domain is None:
+        queryset = get_recipients_queryset(mailing)
+    else:
+        queryset = get_domain_recipients_queryset(mailing, domain)
+    if after is not None:
+        queryset = queryset.filter(pk__gt=after)
+    yield from queryset.iterator(chunk_size=chunk_size)
@@ -0,0 +1,245 @@
+import re
+
+from django.template import Context, Engine, Library
+from django.template import defaultfilters, defaulttags
+
+from mailing.mime import MessageTemplate
+
+# Names of the merge fields available in the title and content of a mailing
+MERGE_FIELDS = ('email', 'telephone', 'list_name')
+
+# A plain merge field without filters, e.g. `{{ email }}`
+MERGE_FIELD_RE = re.compile(r'{{\s*(\w+)\s*}}')
+
+# Template tags available to authors of mailings. Tags exposing more
+# than the merge fields, such as `debug`, `load`, `include` or `url`,
+# are left out.
+ALLOWED_TAGS = (
+    'comment', 'cycle', 'filter', 'firstof', 'for', 'if', 'ifchanged',
+    'lorem', 'now', 'regroup', 'resetcycle', 'spaceless', 'templatetag',
+    'verbatim', 'widthratio', 'with',
+)
+
+
+def get_template_library():
+    """
+    Get the only template library available to mailings.
+
+    Returns:
+        Library: The default filters and the allowed default tags.
+    """
+    library = Library()
+    library.filters.update(defaultfilters.register.filters)
+    library.tags.update(
+        (name, defaulttags.register.tags[name]) for name in ALLOWED_TAGS
+    )
+    return library
+
+
+# Template engine for plain-text messages, merge fields are not escaped.
+# Its builtins are replaced by the restricted library and it has no
+# loaders or libraries, so any other tag is a syntax error.
+engine = Engine(autoescape=False)
+engine.template_builtins = [get_template_library()]
+
+
+def has_merge_fields(text):
+    """
+    Check whether a text contains template tags or variables.
+
+    Args:
+        text (str): The text to check.
+
+    Returns:
+        bool: True if the text has to be rendered per recipient.
+    """
+    return bool(text) and ('{{' in text or '{%' in text)
+
+
+class MergeTemplate:
+    """
+    Template made only of text and plain merge fields.
+
+    The text is split once into literal parts and field names, so a
+    render is a single join instead of a template engine pass.
+
+    Methods:
+        compile: Build a merge template if the text allows it.
+        render: Render the template with merge field values.
+    """
+
+    def __init__(self, parts):
+        self._parts = parts
+
+    @classmethod
+    def compile(cls, text):
+        """
+        Build a merge template if the text only uses plain merge fields.
+
+        Args:
+            text (str): The template text.
+
+        Returns:
+            MergeTemplate | None: The template, or None if the text uses
+                tags, filters or unknown variables.
+        """
+        if '{%' in text or '{#' in text:
+            return None
+
+        parts = MERGE_FIELD_RE.split(text)
+        literals, fields = parts[::2], parts[1::2]
+        if any('{{' in literal for literal in literals):
+            return None
+        if any(field not in MERGE_FIELDS for field in fields):
+            return None
+        return cls(parts)
+
+    def render(self, context):
+        """
+        Render the template with merge field values.
+
+        Args:
+            context (dict): The merge field values.
+
+        Returns:
+            str: The rendered text.
+        """
+        parts = self._parts[:]
+        for index in range(1, len(parts), 2):
+            parts[index] = str(context[parts[index]])
+        return ''.join(parts)
+
+
+class DjangoTemplate:
+    """
+    Template rendered with the Django template language.
+
+    Used for texts with tags or filters, e.g. `{{ email|upper }}`. Only
+    the default filters and the tags in `ALLOWED_TAGS` can be used.
+
+    Methods:
+        render: Render the template with merge field values.
+    """
+
+    def __init__(self, text):
+        self._template = engine.from_string(text)
+
+    def render(self, context):
+        """
+        Render the template with merge field values.
+
+        Args:
+            context (dict): The merge field values.
+
+        Returns:
+            str: The rendered text.
+        """
+        return self._template.render(Context(context, autoescape=False))
+
+
+class CompiledMailing:
+    """
+    Title and content of a mailing compiled once per run.
+
+    Texts with merge fields such as `{{ email }}`, `{{ telephone }}` or
+    `{{ list_name }}` are parsed into templates once and rendered for
+    every recipient from a small dict. Texts with only plain merge fields
+    are rendered by splicing the values between precomputed literals,
+    other templates by the Django template engine. Texts without merge
+    fields are returned verbatim without rendering, and the MIME message
+    of a mailing without merge fields is encoded once for the whole run.
+
+    Attributes:
+        mailing (Mailing): The compiled mailing.
+        list_name (str): The name of the mailing's contact list.
+        personalized (bool): Whether the messages differ per recipient.
+        message_template (MessageTemplate | None): The MIME message
+            shared by all recipients, None if the mailing is personalised.
+
+    Methods:
+        check: Check that a text of a mailing can be compiled.
+        get_context: Get the merge field values of a recipient.
+        render: Render the title and content for a recipient.
+    """
+
+    def __init__(self, mailing):
+        self.mailing = mailing
+        self.list_name = (
+            mailing.contact_list.name if mailing.contact_list_id else ''
+        )
+        self._title = mailing.message_title
+        self._content = mailing.message_content
+        self._title_template = self._compile(self._title)
+        self._content_template = self._compile(self._content)
+        self.personalized = (
+            self._title_template is not None
+            or self._content_template is not None
+        )
+        self.message_template = None
+        if not self.personalized:
+            self.message_template = MessageTemplate(self._title, self._content)
+
+    @staticmethod
+    def _compile(text):
+        if not has_merge_fields(text):
+            return None
+        return MergeTemplate.compile(text) or DjangoTemplate(text)
+
+    @classmethod
+    def check(cls, text):
+        """
+        Check that a title or content of a mailing can be compiled.
+
+        Args:
+            text (str): The text to check.
+
+        Returns:
+            None
+
+        Raises:
+            TemplateSyntaxError: If the text uses an unknown or forbidden
+                tag or filter.
+        """
+        cls._compile(text)
+
+    def get_context(self, recipient):
+        """
+        Get the merge field values of a recipient.
+
+        Args:
+            recipient: The recipient with `email` and optionally
+                `telephone` attributes.
+
+        Returns:
+            dict: The merge field values.
+        """
+        return {
+            'email': recipient.email,
+            'telephone': getattr(recipient, 'telephone', ''),
+            'list_name': self.list_name,
+        }
+
+    def render(self, recipient):
+        """
+        Render the title and content of the mailing for a recipient.
+
+        Args:
+            recipient: The recipient with `email` and optionally
+                `telephone` attributes.
+
+        Returns:
+            tuple: The subject and the body of the message.
+        """
+        if not self.personalized:
+            return self._title, self._content
+
+        context = self.get_context(recipient)
+        title, content = self._title, self._content
+        if self._title_template is not None:
+            # Line breaks are not allowed in the subject header
+            title = ' '.join(
+                self._title_template.render(context).splitlines()
+            )
+        if self._content_template is not None:
+            content = self._content_template.render(context)
+        return title, content
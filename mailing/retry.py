@@ -0,0 +1,67 @@
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+
+def is_transient(result):
+    """
+    Check whether a failed delivery is worth retrying.
+
+    Replies with a 4xx code and failures without a reply, such as a
+    refused or reset connection, are transient. Replies with a 5xx code
+    are permanent.
+
+    Args:
+        result (DeliveryResult): The result of the failed delivery.
+
+    Returns:
+        bool: True if the delivery should be retried.
+    """
+    if result.smtp_code is None:
+        return True
+    return 400 <= result.smtp_code < 500
+
+
+def get_retry_delay(attempts):
+    """
+    Compute the delay before the next delivery attempt.
+
+    The delay grows exponentially with the number of attempts, is capped
+    by `settings.MAILING_RETRY_MAX_DELAY` and gets a random jitter of up
+    to the same amount, so retries of one failed batch are spread out.
+
+    Args:
+        attempts (int): The number of attempts made so far.
+
+    Returns:
+        timedelta: The delay before the next attempt.
+    """
+    delay = min(
+        settings.MAILING_RETRY_BASE_DELAY * 2 ** max(attempts - 1, 0),
+        settings.MAILING_RETRY_MAX_DELAY,
+    )
+    return timedelta(seconds=delay + random.uniform(0, delay))
+
+
+def get_retry_at(result, attempts, now=None):
+    """
+    Get the time of the next delivery attempt of a failed message.
+
+    Args:
+        result (DeliveryResult): The result of the failed delivery.
+        attempts (int): The number of attempts made so far.
+        now (datetime, optional): The current time. Defaults to now.
+
+    Returns:
+        datetime | None: The time of the next attempt, or None if the
+            failure is permanent or the attempts are exhausted.
+    """
+    if not is_transient(result):
+        return None
+    if attempts >= settings.MAILING_RETRY_MAX_ATTEMPTS:
+        return None
+    if now is None:
+        now = timezone.now()
+    return now + get_retry_delay(attempts)
@@ -0,0 +1,314 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, nullcontext
+
+from django.conf import settings
+from django.db import connection as db_connection
+from django.db.models import F
+
+from logs.service import DeliveryLogBuffer
+from mailing.control import is_stopped
+from mailing.models import MailingRun
+from mailing.outbox import enqueue_retries
+from mailing.recipients import (
+    RecipientDeduplicator, get_domain_backlog, iter_recipients,
+)
+from mailing.sender import send_in_chunks
+from mailing.smtp_async import send_in_chunks_async
+from mailing.suppression import get_suppression_set
+from service.utils import get_memory_usage
+
+
+def send_recipients(run, recipients, checkpoint, chunk_size=None,
+                    memory_report=False, label='', engine=None, fence=None,
+                    checkpoint_lock=None):
+    """
+    Send a run of a mailing to a stream of recipients.
+
+    Every delivery is written to the delivery log, transient failures
+    are enqueued for a retry and after every chunk the run counters and
+    its checkpoint are updated in a single query. Sending stops after
+    the chunk during which the run was paused or cancelled, or once the
+    run is taken over by a process with a newer fencing token.
+
+    Args:
+        run (MailingRun): The run being sent.
+        recipients (iterable): Recipients with `pk`, `email` and
+            `telephone` attributes.
+        checkpoint (callable): Called with every ChunkReport, returns the
+            checkpoint fields of the run to update, or None if the
+            sender lost its lease and must stop.
+        chunk_size (int, optional): The number of messages sent per chunk.
+        memory_report (bool, optional): Whether to print the current and
+            peak RSS of the process after every chunk.
+        label (str, optional): A prefix of the printed chunk reports.
+        engine (str, optional): The delivery engine, 'smtp' or 'async'.
+            Defaults to `settings.MAILING_ENGINE`.
+        fence (int, optional): The fencing token of the mailing lock the
+            run is sent under.
+        checkpoint_lock (optional): A lock held while the checkpoint is
+            computed and stored, so concurrent senders of the same run
+            never overwrite a checkpoint with an older one.
+
+    Returns:
+        int: The number of deliveries enqueued for a retry.
+    """
+    fenced = {} if fence is None else {'lock_token': fence}
+    if checkpoint_lock is None:
+        checkpoint_lock = nullcontext()
+    if engine is None:
+        engine = settings.MAILING_ENGINE
+    if engine == 'async':
+        reports = send_in_chunks_async(
+            run.mailing, recipients, chunk_size=chunk_size
+        )
+    else:
+        reports = send_in_chunks(
+            run.mailing, recipients, chunk_size=chunk_size
+        )
+
+    retries = 0
+    # The reports are closed on a break, so their engine is stopped
+    # before the run is left with its checkpoint
+    with closing(reports), DeliveryLogBuffer() as delivery_log:
+        for report in reports:
+            print(
+                f'{label}Chunk {report.number}: '
+                f'{report.sent}/{report.size} sent'
+            )
+            for recipient, result in report.results:
+                delivery_log.add(run.pk, recipient.pk, recipient.email, result)
+            retries += enqueue_retries(
+                run,
+                (
+                    (recipient, result)
+                    for recipient, result in report.results
+                    if not result.sent
+                )
+            )
+            with checkpoint_lock:
+                fields = checkpoint(report)
+                updated = fields is not None and MailingRun.objects.filter(
+                    pk=run.pk, **fenced
+                ).update(
+                    total=F('total') + report.size,
+                    sent=F('sent') + report.sent,
+                    **fields
+                )
+            if not updated:
+                print(f'{label}Run {run.pk} is sent by another process')
+                break
+            if memory_report:
+                current_rss, peak_rss = get_memory_usage()
+                print(f'RSS: {current_rss} KB, peak: {peak_rss} KB')
+            if is_stopped(run.pk):
+                print(f'{label}Run {run.pk} stopped')
+                break
+    return retries
+
+
+def send_in_order(run, chunk_size=None, memory_report=False, engine=None,
+                  fence=None):
+    """
+    Send a run to its recipients in primary key order.
+
+    The primary key of the last contact of every chunk is stored as the
+    checkpoint of the run. Duplicate addresses and recipients on the
+    suppression list of the author of the mailing are skipped.
+
+    Args:
+        run (MailingRun): The run being sent.
+        chunk_size (int, optional): The number of messages sent per chunk.
+        memory_report (bool, optional): Whether to print the current and
+            peak RSS of the process after every chunk.
+        engine (str, optional): The delivery engine, 'smtp' or 'async'.
+        fence (int, optional): The fencing token of the mailing lock.
+
+    Returns:
+        int: The number of deliveries enqueued for a retry.
+    """
+    deduplicator = RecipientDeduplicator(run.mailing)
+    suppression = get_suppression_set(run.mailing)
+    retries = send_recipients(
+        run,
+        suppression.filter(deduplicator.filter(
+            iter_recipients(run.mailing, after=run.last_contact_id)
+        )),
+        lambda report: {'last_contact_id': report.last_recipient.pk},
+        chunk_size=chunk_size,
+        memory_report=memory_report,
+        engine=engine,
+        fence=fence,
+    )
+    print(f'Run {run.pk}: {deduplicator.dropped} duplicate recipients')
+    print(f'Run {run.pk}: {suppression.skipped} suppressed recipients')
+    return retries
+
+
+class DomainProgress:
+    """
+    Thread-safe progress of a run sent in per-domain partitions.
+
+    Keeps the checkpoint, the number of delivered messages and the
+    backlog of every domain and prints the throughput of a domain after
+    each of its chunks.
+
+    Attributes:
+        lock (RLock): The lock the checkpoint of the run is stored under.
+        checkpoints (dict): The last contact sent per domain.
+        backlog (dict): The number of recipients left per domain.
+        sent (dict): The number of delivered messages per domain.
+
+    Methods:
+        start: Record the start time of a domain partition.
+        finish: Record the end time of a domain partition.
+        get_rate: Get the delivery rate of a domain.
+        checkpoint: Record a sent chunk of a domain.
+        print_summary: Print the throughput of every domain.
+    """
+
+    def __init__(self, checkpoints, backlog):
+        self.checkpoints = dict(checkpoints)
+        self.backlog = dict(backlog)
+        self.sent = dict.fromkeys(backlog, 0)
+        self._started = dict.fromkeys(backlog, time.monotonic())
+        self._finished = {}
+        self.lock = threading.RLock()
+
+    def start(self, domain):
+        """
+        Record the start time of a domain partition.
+
+        Args:
+            domain (str): The email domain.
+
+        Returns:
+            None
+        """
+        self._started[domain] = time.monotonic()
+
+    def finish(self, domain):
+        """
+        Record the end time of a domain partition.
+
+        Args:
+            domain (str): The email domain.
+
+        Returns:
+            None
+        """
+        self._finished[domain] = time.monotonic()
+
+    def get_rate(self, domain):
+        """
+        Get the number of messages per second delivered to a domain.
+
+        Args:
+            domain (str): The email domain.
+
+        Returns:
+            float: The delivery rate of the domain.
+        """
+        finished = self._finished.get(domain, time.monotonic())
+        elapsed = finished - self._started[domain]
+        return self.sent[domain] / elapsed if elapsed else 0
+
+    def checkpoint(self, domain, report):
+        """
+        Record a sent chunk of a domain.
+
+        Args:
+            domain (str): The email domain of the chunk.
+            report (ChunkReport): The report of the sent chunk.
+
+        Returns:
+            dict: The checkpoint fields of the run to update.
+        """
+        with self.lock:
+            self.checkpoints[domain] = report.last_recipient.pk
+            self.backlog[domain] -= report.size
+            self.sent[domain] += report.sent
+            print(
+                f'{domain}: {self.get_rate(domain):.1f} msg/s, '
+                f'backlog {self.backlog[domain]}'
+            )
+            return {'domain_checkpoints': dict(self.checkpoints)}
+
+    def print_summary(self):
+        """
+        Print the delivered messages and throughput of every domain.
+
+        Returns:
+            None
+        """
+        for domain, sent in self.sent.items():
+            print(
+                f'{domain}: {sent} sent, {self.get_rate(domain):.1f} msg/s, '
+                f'backlog {self.backlog[domain]}'
+            )
+
+
+def send_by_domain(run, chunk_size=None, workers=None, engine=None,
+                   fence=None):
+    """
+    Send a run to its recipients partitioned by email domain.
+
+    Every domain is drained by its own thread over its own SMTP
+    connection, or its own sessions of the asyncio engine, so one slow
+    or throttled provider does not block the others and every partition
+    is sent at the rate of its domain. The largest partitions are
+    started first. Duplicate addresses and recipients on the suppression
+    list of the author of the mailing are skipped. The checkpoint of
+    every domain is stored on the run, so an interrupted run resumes each
+    partition where it stopped.
+
+    Args:
+        run (MailingRun): The run being sent.
+        chunk_size (int, optional): The number of messages sent per chunk.
+        workers (int, optional): The number of domains drained at the
+            same time. Defaults to `settings.MAILING_DOMAIN_WORKERS`.
+        engine (str, optional): The delivery engine, 'smtp' or 'async'.
+        fence (int, optional): The fencing token of the mailing lock.
+
+    Returns:
+        int: The number of deliveries enqueued for a retry.
+    """
+    if workers is None:
+        workers = settings.MAILING_DOMAIN_WORKERS
+
+    mailing = run.mailing
+    deduplicator = RecipientDeduplicator(mailing)
+    suppression = get_suppression_set(mailing)
+    backlog = get_domain_backlog(mailing, run.domain_checkpoints)
+    progress = DomainProgress(run.domain_checkpoints, backlog)
+    print(f'Run {run.pk}: {len(backlog)} domains, backlog {backlog}')
+
+    def drain(domain):
+        progress.start(domain)
+        try:
+            return send_recipients(
+                run,
+                suppression.filter(deduplicator.filter(iter_recipients(
+                    mailing,
+                    after=run.domain_checkpoints.get(domain),
+                    domain=domain,
+                ))),
+                lambda report: progress.checkpoint(domain, report),
+                chunk_size=chunk_size,
+                label=f'{domain}: ',
+                engine=engine,
+                fence=fence,
+                checkpoint_lock=progress.lock,
+            )
+        finally:
+            progress.finish(domain)
+            db_connection.close()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        retries = sum(executor.map(drain, backlog))
+
+    progress.print_summary()
+    print(f'Run {run.pk}: {deduplicator.dropped} duplicate recipients')
+    print(f'Run {run.pk}: {suppression.skipped} suppressed recipients')
+    return retries
@@ -0,0 +1,219 @@
+import heapq
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from mailing.cron import run_mailing
+from mailing.models import MailingRun, MailingSettings
+from mailing.outbox import process_retries
+from mailing.service import get_next_run
+
+
+class MailingScheduler:
+    """
+    In-process scheduler for running mailings.
+
+    The scheduler keeps a heap of (next fire time, mailing pk) pairs and
+    dispatches due mailings in the current process, so no interpreter is
+    started per send. On every reload only the mailings whose indexed
+    `next_run_at` falls before the next reload are read, so the cost of a
+    reload does not depend on the total number of scheduled mailings.
+
+    Before a mailing is run its `next_run_at` is advanced with a
+    conditional update, so a fire time is only dispatched once even if
+    its settings changed in the meantime. The fire time is passed on as
+    the slot of the mailing lock, so schedulers on several hosts never
+    send the same slot twice.
+
+    Unless outbox workers are used, the scheduler also sends the failed
+    deliveries that are due for a retry.
+
+    On every reload the in-process runs that were resumed, or whose
+    process died, are run again from their checkpoint instead of
+    waiting for the next fire time of their mailing.
+
+    Attributes:
+        reload_interval (int): Seconds between two schedule reloads.
+        max_sleep (int): The longest time the scheduler sleeps at once.
+
+    Methods:
+        reload: Load the mailings due before the next reload.
+        run_pending: Run every mailing that is due.
+        resume_runs: Resume the interrupted in-process runs.
+        run_forever: Run the scheduler loop until stopped.
+        stop: Ask the scheduler loop to exit.
+    """
+
+    def __init__(self, reload_interval=None, max_sleep=60):
+        if reload_interval is None:
+            reload_interval = settings.MAILING_SCHEDULER_RELOAD_INTERVAL
+        self.reload_interval = reload_interval
+        self.max_sleep = max_sleep
+        self._heap = []
+        self._running = False
+
+    def reload(self, now=None):
+        """
+        Load the mailings that are due before the next reload.
+
+        Args:
+            now (datetime, optional): The current time. Defaults to now.
+
+        Returns:
+            None
+        """
+        if now is None:
+            now = timezone.now()
+
+        horizon = now + timedelta(seconds=self.reload_interval)
+        self._heap = [
+            (next_run_at, mailing_pk)
+            for mailing_pk, next_run_at in MailingSettings.objects.filter(
+                next_run_at__lte=horizon,
+                mailing__isnull=False,
+            ).values_list('mailing_id', 'next_run_at')
+        ]
+        heapq.heapify(self._heap)
+
+    def claim(self, mailing_pk, fire_time, now):
+        """
+        Advance `next_run_at` of a mailing past the given fire time.
+
+        Fire times missed while the scheduler was down are collapsed into
+        a single run: the next run is searched after the current time.
+
+        Args:
+            mailing_pk (int): The primary key of the mailing.
+            fire_time (datetime): The fire time being dispatched.
+            now (datetime): The current time.
+
+        Returns:
+            bool: True if the fire time was still current and is now
+                claimed by this scheduler.
+        """
+        mailing_settings = MailingSettings.objects.filter(
+            mailing_id=mailing_pk,
+            next_run_at=fire_time,
+        ).first()
+        if mailing_settings is None:
+            return False
+
+        return MailingSettings.objects.filter(
+            pk=mailing_settings.pk,
+            next_run_at=fire_time,
+        ).update(
+            next_run_at=get_next_run(
+                mailing_settings, after=max(fire_time, now)
+            )
+        ) == 1
+
+    def run_pending(self, now=None):
+        """
+        Run every mailing whose fire time has come.
+
+        Args:
+            now (datetime, optional): The current time. Defaults to now.
+
+        Returns:
+            int: The number of mailings that were run.
+        """
+        if now is None:
+            now = timezone.now()
+
+        dispatched = 0
+        while self._heap and self._heap[0][0] <= now:
+            fire_time, mailing_pk = heapq.heappop(self._heap)
+            if not self.claim(mailing_pk, fire_time, now):
+                continue
+
+            try:
+                run_mailing(mailing_pk, slot=fire_time)
+            except Exception as error:
+                print(f'Mailing {mailing_pk} failed: {error}')
+            dispatched += 1
+        return dispatched
+
+    def resume_runs(self, now=None):
+        """
+        Resume the in-process runs that are neither paused nor finished.
+
+        Each run is resumed under the lock of its mailing with the
+        current time as the slot, so a run still sent by another process
+        keeps its lock and is skipped.
+
+        Args:
+            now (datetime, optional): The current time. Defaults to now.
+
+        Returns:
+            int: The number of mailings whose run was resumed.
+        """
+        if now is None:
+            now = timezone.now()
+
+        mailing_pks = MailingRun.objects.filter(
+            status=MailingRun.RUN_SENDING,
+            paused=False,
+        ).values_list('mailing_id', flat=True).distinct()
+        resumed = 0
+        for mailing_pk in list(mailing_pks):
+            try:
+                run_mailing(mailing_pk, slot=now, resume=True)
+            except Exception as error:
+                print(f'Mailing {mailing_pk} failed: {error}')
+            resumed += 1
+        return resumed
+
+    def seconds_until_next(self, now=None):
+        """
+        Get the number of seconds until the earliest fire time.
+
+        Args:
+            now (datetime, optional): The current time. Defaults to now.
+
+        Returns:
+            float: The seconds to wait, capped by `max_sleep`.
+        """
+        if now is None:
+            now = timezone.now()
+        if not self._heap:
+            return self.max_sleep
+        delay = (self._heap[0][0] - now).total_seconds()
+        return min(max(delay, 0), self.max_sleep)
+
+    def run_forever(self):
+        """
+        Run the scheduler loop until `stop` is called.
+
+        Returns:
+            None
+        """
+        self._running = True
+        next_reload = 0
+        while self._running:
+            close_old_connections()
+            if time.monotonic() >= next_reload:
+                self.reload()
+                self.resume_runs()
+                next_reload = time.monotonic() + self.reload_interval
+
+            self.run_pending()
+            if not settings.MAILING_USE_OUTBOX:
+                process_retries()
+
+            delay = min(
+                self.seconds_until_next(),
+                max(next_reload - time.monotonic(), 0),
+            )
+            time.sleep(delay)
+
+    def stop(self):
+        """
+        Ask the scheduler loop to exit after the current iteration.
+
+        Returns:
+            None
+        """
+        self._running = False
@@ -0,0 +1,378 @@
+import smtplib
+import time
+from collections import namedtuple
+from itertools import islice
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.core.mail.message import sanitize_address
+
+from mailing.mime import get_recipient_headers
+from mailing.models import PRIORITY_CAMPAIGN
+from mailing.ratelimit import get_rate_limiter
+from mailing.rendering import CompiledMailing
+from mailing.signing import get_signer
+
+# Result of sending one chunk of messages over a shared connection
+ChunkReport = namedtuple(
+    'ChunkReport', ('number', 'size', 'sent', 'last_recipient', 'results')
+)
+
+# Result of delivering a single message, latency is in milliseconds
+DeliveryResult = namedtuple(
+    'DeliveryResult', ('sent', 'error', 'smtp_code', 'latency')
+)
+
+# Reply code assumed for a message accepted by the email backend
+SMTP_OK = 250
+
+
+def build_message(compiled, recipient):
+    """
+    Build the email message of a mailing for one recipient.
+
+    Messages of a mailing without merge fields are spliced from the MIME
+    message encoded once per run, personalised ones are encoded per
+    recipient.
+
+    Args:
+        compiled (CompiledMailing): The compiled mailing to send.
+        recipient: The recipient with `email` and `telephone` attributes.
+
+    Returns:
+        EmailMessage: The message addressed to the recipient.
+    """
+    if compiled.message_template is not None:
+        return compiled.message_template.build(recipient.email)
+
+    subject, body = compiled.render(recipient)
+    return EmailMessage(
+        subject=subject,
+        body=body,
+        from_email=None,
+        to=[recipient.email],
+        headers=get_recipient_headers(recipient.email),
+    )
+
+
+def get_envelope_batch_size(compiled):
+    """
+    Get the number of recipients a message of a mailing is sent to at once.
+
+    Recipients are only batched into one SMTP transaction when every
+    one of them gets identical bytes, i.e. the mailing has no merge
+    fields and no personal unsubscribe links are sent.
+
+    Args:
+        compiled (CompiledMailing): The compiled mailing to send.
+
+    Returns:
+        int: The envelope batch size, 1 if messages are sent per recipient.
+    """
+    if compiled.message_template is None or settings.MAILING_UNSUBSCRIBE_URL:
+        return 1
+    return max(settings.MAILING_ENVELOPE_BATCH_SIZE, 1)
+
+
+def build_envelopes(compiled, recipients):
+    """
+    Build the messages of a mailing for a list of recipients.
+
+    Identical messages are built once per batch of envelope recipients,
+    personalised ones for every recipient separately. When DKIM signing
+    is enabled, the messages are signed by the signing processes and
+    yielded as soon as they are signed.
+
+    Args:
+        compiled (CompiledMailing): The compiled mailing to send.
+        recipients (list): Recipients with `email` and `telephone`
+            attributes.
+
+    Returns:
+        iterable: (recipients, EmailMessage) pairs of every message in
+            the order of `recipients`.
+    """
+    batch_size = get_envelope_batch_size(compiled)
+    if batch_size == 1:
+        batches = [[recipient] for recipient in recipients]
+        messages = [
+            build_message(compiled, recipient) for recipient in recipients
+        ]
+    else:
+        batches = list(chunked(recipients, batch_size))
+        messages = [
+            compiled.message_template.build_batch(
+                [recipient.email for recipient in batch]
+            )
+            for batch in batches
+        ]
+
+    signer = get_signer()
+    if signer is not None:
+        messages = signer.sign_messages(messages)
+    return zip(batches, messages)
+
+
+def deliver_all(connection, compiled, recipients,
+                priority=PRIORITY_CAMPAIGN):
+    """
+    Deliver a mailing to a list of recipients over an open connection.
+
+    Identical messages are sent once per batch of envelope recipients,
+    personalised ones to every recipient separately. When DKIM signing
+    is enabled, the messages are signed by the signing processes while
+    the signed ones are being sent.
+
+    Args:
+        connection: The email backend to send the messages with.
+        compiled (CompiledMailing): The compiled mailing to send.
+        recipients (list): Recipients with `email` and `telephone`
+            attributes.
+        priority (str, optional): The priority class of the messages.
+
+    Returns:
+        list: (recipient, DeliveryResult) pairs in the order of
+            `recipients`.
+    """
+    results = []
+    for batch, message in build_envelopes(compiled, recipients):
+        if len(batch) == 1:
+            results.append((batch[0], deliver(connection, message, priority)))
+        else:
+            results.extend(
+                zip(batch, deliver_batch(connection, message, priority))
+            )
+    return results
+
+
+def chunked(iterable, chunk_size):
+    """
+    Split an iterable into lists of at most `chunk_size` items.
+
+    Args:
+        iterable (iterable): The items to split.
+        chunk_size (int): The maximum number of items in a chunk.
+
+    Yields:
+        list: The next chunk of items.
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def send_in_chunks(mailing, recipients, chunk_size=None, connection=None):
+    """
+    Send a mailing to its recipients in chunks over one SMTP connection.
+
+    The mailing is compiled once, then a message is rendered for every
+    recipient, or for every envelope batch of a mailing without merge
+    fields, and delivered over the same connection, so the SMTP session
+    is opened once for the whole run.
+    A failed delivery does not abort the run: the connection is reopened
+    and sending continues with the next message.
+
+    Args:
+        mailing (Mailing): The mailing to send.
+        recipients (iterable): Recipients with `email` and `telephone`
+            attributes.
+        chunk_size (int, optional): The number of messages per chunk.
+            Defaults to `settings.MAILING_CHUNK_SIZE`.
+        connection (optional): The email backend to use. A new one is
+            created with `get_connection()` if not provided.
+
+    Yields:
+        ChunkReport: The chunk number, its size, how many messages of the
+            chunk were delivered, the last recipient of the chunk and the
+            (recipient, DeliveryResult) pairs of the chunk.
+    """
+    if chunk_size is None:
+        chunk_size = settings.MAILING_CHUNK_SIZE
+    if connection is None:
+        connection = get_connection()
+
+    compiled = CompiledMailing(mailing)
+    try:
+        for number, chunk in enumerate(chunked(recipients, chunk_size), 1):
+            results = deliver_all(connection, compiled, chunk)
+            sent = sum(result.sent for recipient, result in results)
+            yield ChunkReport(number, len(chunk), sent, chunk[-1], results)
+    finally:
+        connection.close()
+
+
+def get_smtp_code(error):
+    """
+    Get the SMTP reply code of a delivery error.
+
+    Args:
+        error (Exception): The error raised while sending a message.
+
+    Returns:
+        int | None: The reply code, or None if the server did not reply.
+    """
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        for code, message in error.recipients.values():
+            return code
+    return None
+
+
+def get_sender_account(connection):
+    """
+    Get the SMTP account messages are sent from over a connection.
+
+    Args:
+        connection: The email backend.
+
+    Returns:
+        str: The SMTP username, or 'default' if there is none.
+    """
+    return (
+        getattr(connection, 'username', None)
+        or settings.EMAIL_HOST_USER
+        or 'default'
+    )
+
+
+def deliver(connection, message, priority=PRIORITY_CAMPAIGN):
+    """
+    Deliver a single message over an open connection.
+
+    When rate limiting is enabled, the call blocks until the share of
+    the priority class in the budget of the sending account and every
+    recipient domain have budget left. The time spent waiting is not
+    included in the latency.
+
+    Args:
+        connection: The email backend to send the message with.
+        message (EmailMessage): The message to send.
+        priority (str, optional): The priority class of the message.
+
+    Returns:
+        DeliveryResult: Whether the message was sent, the error if not,
+            the SMTP reply code and the delivery latency.
+    """
+    rate_limiter = get_rate_limiter()
+    if rate_limiter is not None:
+        rate_limiter.wait(
+            get_sender_account(connection), message.recipients(), priority
+        )
+
+    started = time.perf_counter()
+    try:
+        connection.open()
+        sent = connection.send_messages([message])
+    except (smtplib.SMTPException, OSError) as error:
+        connection.close()
+        return DeliveryResult(
+            False,
+            str(error),
+            get_smtp_code(error),
+            (time.perf_counter() - started) * 1000,
+        )
+
+    latency = (time.perf_counter() - started) * 1000
+    if not sent:
+        return DeliveryResult(False, 'Message was not accepted', None, latency)
+    return DeliveryResult(True, None, SMTP_OK, latency)
+
+
+def send_envelope(connection, message):
+    """
+    Send a message to all its envelope recipients in one transaction.
+
+    Over an SMTP backend the message is passed to `sendmail` directly,
+    so recipients refused by the server are reported while the others
+    still receive the message. Other backends send it as a whole.
+
+    Args:
+        connection: The open email backend.
+        message (EmailMessage): The message to send.
+
+    Returns:
+        dict: The refused recipient addresses mapped to the
+            (code, response) pairs of the server.
+
+    Raises:
+        smtplib.SMTPException: If the message was not accepted.
+    """
+    smtp = getattr(connection, 'connection', None)
+    if not isinstance(smtp, smtplib.SMTP):
+        if not connection.send_messages([message]):
+            raise smtplib.SMTPException('Message was not accepted')
+        return {}
+
+    encoding = message.encoding or settings.DEFAULT_CHARSET
+    addresses = {
+        sanitize_address(email, encoding): email
+        for email in message.recipients()
+    }
+    try:
+        refused = smtp.sendmail(
+            sanitize_address(message.from_email, encoding),
+            list(addresses),
+            message.message().as_bytes(linesep='\r\n'),
+        )
+    except smtplib.SMTPRecipientsRefused as error:
+        refused = error.recipients
+    return {
+        addresses.get(address, address): reply
+        for address, reply in refused.items()
+    }
+
+
+def deliver_batch(connection, message, priority=PRIORITY_CAMPAIGN):
+    """
+    Deliver a message to a batch of envelope recipients.
+
+    The body is sent once for all recipients. When rate limiting is
+    enabled, the message takes one token from the share of the priority
+    class in the budget of the sending account, and one token per
+    recipient from the bucket of the recipient's domain, so batching
+    does not raise the rate a provider receives.
+
+    Args:
+        connection: The email backend to send the message with.
+        message (EmailMessage): The message with its recipients in Bcc.
+        priority (str, optional): The priority class of the message.
+
+    Returns:
+        list: A DeliveryResult per recipient in the order of
+            `message.recipients()`.
+    """
+    recipients = message.recipients()
+    rate_limiter = get_rate_limiter()
+    if rate_limiter is not None:
+        rate_limiter.wait(
+            get_sender_account(connection), recipients, priority
+        )
+
+    started = time.perf_counter()
+    try:
+        connection.open()
+        refused = send_envelope(connection, message)
+    except (smtplib.SMTPException, OSError) as error:
+        connection.close()
+        result = DeliveryResult(
+            False,
+            str(error),
+            get_smtp_code(error),
+            (time.perf_counter() - started) * 1000,
+        )
+        return [result] * len(recipients)
+
+    latency = (time.perf_counter() - started) * 1000
+    results = []
+    for email in recipients:
+        if email in refused:
+            code, response = refused[email]
+            error = response.decode(errors='replace')
+            results.append(DeliveryResult(False, error, code, latency))
+        else:
+            results.append(DeliveryResult(True, None, SMTP_OK, latency))
+    return results
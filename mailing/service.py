@@ -1,6 +1,10 @@
-from datetime import date
+import calendar
+from datetime import date, datetime, timedelta
 
 from crontab import CronTab
+from django.utils import timezone
+
+from mailing.models import MailingSettings
 
 
 def create_cron_jobs(mailing):
@@ -72,3 +76,76 @@ def remove_cron_jobs(mailing):
 
     cron.remove_all(comment=f'mailing_{mailing.pk}')
     cron.write()
+
+
+def _next_matching_date(mailing_settings, day):
+    """
+    Get the first date not earlier than `day` matching the mailing period.
+
+    Weekly mailings use the crontab numbering of `mailing_week_day_num`
+    (0 or 7 is Sunday, 1 is Monday). Monthly mailings run on the day of
+    month of `start_date`, clamped to the last day of shorter months.
+
+    Args:
+        mailing_settings (MailingSettings): The mailing schedule.
+        day (date): The earliest acceptable date.
+
+    Returns:
+        date: The next matching date.
+    """
+    periods = mailing_settings.mailing_periods
+
+    if periods == MailingSettings.MAILING_WEEKLY:
+        week_day = ((mailing_settings.mailing_week_day_num or 0) - 1) % 7
+        return day + timedelta(days=(week_day - day.weekday()) % 7)
+
+    if periods == MailingSettings.MAILING_MONTHLY:
+        year, month = day.year, day.month
+        while True:
+            last_day = calendar.monthrange(year, month)[1]
+            candidate = date(
+                year, month, min(mailing_settings.start_date.day, last_day)
+            )
+            if candidate >= day:
+                return candidate
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+    return day
+
+
+def get_next_run(mailing_settings, after=None):
+    """
+    Compute the next time a mailing has to be sent.
+
+    Args:
+        mailing_settings (MailingSettings): The mailing schedule.
+        after (datetime, optional): The moment after which the next run
+            is searched. Defaults to now.
+
+    Returns:
+        datetime | None: The aware datetime of the next run, or None if
+            the schedule is incomplete or has no runs left before
+            `end_date`.
+    """
+    if not all((
+        mailing_settings.mailing_periods,
+        mailing_settings.mailing_time,
+        mailing_settings.start_date,
+        mailing_settings.end_date,
+    )):
+        return None
+
+    if after is None:
+        after = timezone.now()
+
+    day = max(timezone.localdate(after), mailing_settings.start_date)
+    while True:
+        day = _next_matching_date(mailing_settings, day)
+        if day > mailing_settings.end_date:
+            return None
+        run_at = timezone.make_aware(
+            datetime.combine(day, mailing_settings.mailing_time)
+        )
+        if run_at > after:
+            return run_at
+        day += timedelta(days=1)
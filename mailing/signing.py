@@ -0,0 +1,183 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.mail import EmailMessage
+
+from mailing.mime import EncodedMessage
+
+try:
+    import dkim
+except ImportError:
+    dkim = None
+
+# Headers covered by the DKIM signature of a message
+DKIM_HEADERS = (
+    b'from', b'to', b'subject', b'date', b'message-id',
+    b'mime-version', b'content-type', b'content-transfer-encoding',
+    b'list-unsubscribe',
+)
+
+# Signing parameters of the current worker process
+_worker = {}
+
+
+def init_worker(private_key, selector, domain):
+    """
+    Keep the signing parameters in a signing worker process.
+
+    Called once when a worker process of the pool starts, so the private
+    key is read and passed to a worker only once.
+
+    Args:
+        private_key (bytes): The PEM encoded private key.
+        selector (str): The DKIM selector.
+        domain (str): The signing domain.
+
+    Returns:
+        None
+    """
+    _worker.update(
+        private_key=private_key,
+        selector=selector.encode(),
+        domain=domain.encode(),
+    )
+
+
+def sign_data(data):
+    """
+    Sign a serialised message in a signing worker process.
+
+    Args:
+        data (bytes): The message with CRLF line separators.
+
+    Returns:
+        bytes: The message prefixed with its DKIM-Signature header.
+    """
+    signature = dkim.sign(
+        data,
+        _worker['selector'],
+        _worker['domain'],
+        _worker['private_key'],
+        include_headers=list(DKIM_HEADERS),
+    )
+    return signature + data
+
+
+class SignedMessage(EmailMessage):
+    """
+    Email message with a DKIM signed serialisation.
+
+    Keeps the sender and recipients of the original message, while its
+    `message()` returns the signed bytes unchanged, so the signature is
+    not invalidated by encoding the message again.
+    """
+
+    def __init__(self, message, data):
+        super().__init__(
+            subject=message.subject,
+            body=message.body,
+            from_email=message.from_email,
+            to=message.to,
+            bcc=message.bcc,
+        )
+        self.data = data
+
+    def message(self):
+        """
+        Get the signed message.
+
+        Returns:
+            EncodedMessage: The serialised signed message.
+        """
+        return EncodedMessage(self.data)
+
+
+class DkimSigner:
+    """
+    DKIM signing stage of outgoing mail.
+
+    RSA signing is CPU-bound, so messages are signed in a pool of worker
+    processes instead of the threads that send them. Every worker gets
+    the private key once when it starts. Messages are signed in the
+    order they are submitted and handed to the SMTP connection as soon
+    as they are signed, while the pool keeps signing the next ones.
+
+    Attributes:
+        workers (int): The number of signing processes.
+
+    Methods:
+        sign_messages: Sign email messages in the worker pool.
+        close: Shut the worker pool down.
+    """
+
+    def __init__(self, private_key, selector, domain, workers=None):
+        self.workers = workers or settings.DKIM_WORKERS or os.cpu_count()
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=init_worker,
+            initargs=(private_key, selector, domain),
+        )
+
+    def sign_messages(self, messages):
+        """
+        Sign email messages in the worker pool.
+
+        Args:
+            messages (list): The EmailMessage instances to sign.
+
+        Yields:
+            SignedMessage: The signed messages in the order of `messages`.
+        """
+        data = [
+            message.message().as_bytes(linesep='\r\n')
+            for message in messages
+        ]
+        chunksize = max(len(data) // (self.workers * 4), 1)
+        signed = self._executor.map(sign_data, data, chunksize=chunksize)
+        for message, signed_data in zip(messages, signed):
+            yield SignedMessage(message, signed_data)
+
+    def close(self):
+        """
+        Shut the worker pool down.
+
+        Returns:
+            None
+        """
+        self._executor.shutdown()
+
+
+_signer = None
+_signer_lock = threading.Lock()
+
+
+def get_signer():
+    """
+    Get the DKIM signer shared by the current process.
+
+    The signer is created under a lock, so concurrent sender threads
+    share one worker pool.
+
+    Returns:
+        DkimSigner | None: The signer, or None if no DKIM key is
+            configured.
+
+    Raises:
+        ImportError: If a key is configured but dkimpy is not installed.
+    """
+    global _signer
+
+    if not settings.DKIM_PRIVATE_KEY_PATH:
+        return None
+    if dkim is None:
+        raise ImportError('DKIM signing requires dkimpy: pip install dkimpy')
+    with _signer_lock:
+        if _signer is None:
+            with open(settings.DKIM_PRIVATE_KEY_PATH, 'rb') as key_file:
+                private_key = key_file.read()
+            _signer = DkimSigner(
+                private_key, settings.DKIM_SELECTOR, settings.DKIM_DOMAIN
+            )
+    return _signer
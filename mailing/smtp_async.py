@@ -0,0 +1,476 @@
+import asyncio
+import re
+import smtplib
+import ssl
+import threading
+import time
+from base64 import b64encode
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.core.mail.message import sanitize_address
+
+from mailing.ratelimit import get_rate_limiter
+from mailing.rendering import CompiledMailing
+from mailing.sender import (
+    SMTP_OK, ChunkReport, DeliveryResult, build_envelopes, chunked,
+    get_sender_account, get_smtp_code,
+)
+
+# Lines of a message body starting with a period, see RFC 5321 4.5.2
+PERIOD_RE = re.compile(rb'^\.', re.MULTILINE)
+
+# Result of a queued message dropped by `AsyncEngine.cancel`
+CANCELLED = DeliveryResult(False, 'Cancelled', None, 0)
+
+
+class AsyncSMTPSession:
+    """
+    Minimal asyncio SMTP client session.
+
+    Supports STARTTLS, implicit TLS, AUTH PLAIN and LOGIN, and sends the
+    envelope commands of a message in one round trip when the server
+    advertises PIPELINING (RFC 2920).
+
+    Attributes:
+        pipelining (bool): Whether the server supports pipelining.
+
+    Methods:
+        connect: Open the session, say EHLO and log in.
+        send: Send a message to its envelope recipients.
+        close: Quit and close the session.
+    """
+
+    def __init__(self, host, port, username=None, password=None,
+                 use_tls=False, use_ssl=False, timeout=60):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.use_ssl = use_ssl
+        self.timeout = timeout
+        self.pipelining = False
+        self._reader = None
+        self._writer = None
+
+    async def _read_reply(self):
+        lines = []
+        while True:
+            line = await asyncio.wait_for(
+                self._reader.readline(), self.timeout
+            )
+            if not line:
+                raise smtplib.SMTPServerDisconnected('Connection closed')
+            lines.append(line[4:].strip())
+            if line[3:4] != b'-':
+                return int(line[:3]), b'\n'.join(lines)
+
+    async def _command(self, line):
+        self._writer.write(line.encode() + b'\r\n')
+        await self._writer.drain()
+        return await self._read_reply()
+
+    async def _ehlo(self):
+        code, response = await self._command('EHLO localhost')
+        if code != 250:
+            raise smtplib.SMTPHeloError(code, response)
+        extensions = response.upper().split(b'\n')
+        self.pipelining = b'PIPELINING' in extensions
+        return extensions
+
+    async def connect(self):
+        """
+        Open the session, say EHLO, start TLS and log in if configured.
+
+        Returns:
+            None
+
+        Raises:
+            smtplib.SMTPException: If the server rejects the session.
+        """
+        context = ssl.create_default_context()
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(
+                self.host,
+                self.port,
+                ssl=context if self.use_ssl else None,
+            ),
+            self.timeout,
+        )
+        code, response = await self._read_reply()
+        if code != 220:
+            raise smtplib.SMTPConnectError(code, response)
+
+        extensions = await self._ehlo()
+        if self.use_tls:
+            code, response = await self._command('STARTTLS')
+            if code != 220:
+                raise smtplib.SMTPNotSupportedError(response)
+            await self._writer.start_tls(context, server_hostname=self.host)
+            extensions = await self._ehlo()
+
+        if self.username:
+            await self._login(extensions)
+
+    async def _login(self, extensions):
+        credentials = f'\0{self.username}\0{self.password}'.encode()
+        if any(b'LOGIN' in line and b'PLAIN' not in line
+               for line in extensions if line.startswith(b'AUTH')):
+            code, response = await self._command('AUTH LOGIN')
+            if code == 334:
+                code, response = await self._command(
+                    b64encode(self.username.encode()).decode()
+                )
+            if code == 334:
+                code, response = await self._command(
+                    b64encode(self.password.encode()).decode()
+                )
+        else:
+            code, response = await self._command(
+                f'AUTH PLAIN {b64encode(credentials).decode()}'
+            )
+        if code != 235:
+            raise smtplib.SMTPAuthenticationError(code, response)
+
+    async def send(self, from_email, recipients, data):
+        """
+        Send a message to its envelope recipients.
+
+        Args:
+            from_email (str): The envelope sender.
+            recipients (list): The envelope recipients.
+            data (bytes): The message with CRLF line separators.
+
+        Returns:
+            dict: The refused recipients mapped to the (code, response)
+                pairs of the server.
+
+        Raises:
+            smtplib.SMTPException: If the message was not accepted.
+        """
+        commands = [f'MAIL FROM:<{from_email}>']
+        commands.extend(f'RCPT TO:<{recipient}>' for recipient in recipients)
+        commands.append('DATA')
+        if self.pipelining:
+            self._writer.write(
+                ''.join(f'{command}\r\n' for command in commands).encode()
+            )
+            await self._writer.drain()
+            replies = [await self._read_reply() for command in commands]
+        else:
+            replies = [await self._command(command) for command in commands]
+
+        (mail_code, mail_response), *rcpt_replies = replies[:-1]
+        data_code, data_response = replies[-1]
+        refused = {
+            recipient: reply
+            for recipient, reply in zip(recipients, rcpt_replies)
+            if reply[0] >= 400
+        }
+        if data_code == 354 and len(refused) == len(recipients):
+            # Some servers accept DATA without any valid recipient
+            await self._command('.')
+            data_code = 554
+        if data_code != 354:
+            await self._command('RSET')
+            if mail_code >= 400:
+                raise smtplib.SMTPSenderRefused(
+                    mail_code, mail_response, from_email
+                )
+            if len(refused) == len(recipients):
+                raise smtplib.SMTPRecipientsRefused(refused)
+            raise smtplib.SMTPDataError(data_code, data_response)
+
+        data = PERIOD_RE.sub(b'..', data)
+        if not data.endswith(b'\r\n'):
+            data += b'\r\n'
+        self._writer.write(data + b'.\r\n')
+        await self._writer.drain()
+        code, response = await self._read_reply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, response)
+        return refused
+
+    async def close(self):
+        """
+        Quit and close the session, ignoring errors.
+
+        Returns:
+            None
+        """
+        if self._writer is None:
+            return
+        try:
+            await asyncio.wait_for(self._command('QUIT'), self.timeout)
+        except Exception:
+            pass
+        self._writer.close()
+        self._writer = None
+
+
+class AsyncEngine:
+    """
+    asyncio delivery engine with N concurrent SMTP sessions.
+
+    The engine runs an event loop in a background thread. Messages are
+    submitted from the sending thread into a bounded queue, so a full
+    queue blocks the recipient stream feeding it. Each of the sessions
+    takes the next message from the queue as soon as its previous one
+    is accepted, so up to `sessions` messages wait for the relay at the
+    same time.
+
+    Attributes:
+        sessions (int): The number of concurrent SMTP sessions.
+        queue_size (int): The maximum number of queued messages.
+        username (str): The SMTP account messages are sent from.
+
+    Methods:
+        start: Start the event loop and the sessions.
+        submit: Queue a message for delivery.
+        cancel: Drop the queued messages without sending them.
+        stop: Wait for the queued messages and close the sessions.
+    """
+
+    def __init__(self, sessions=None, queue_size=None, host=None, port=None,
+                 username=None, password=None, use_tls=None, use_ssl=None,
+                 timeout=None):
+        self.sessions = sessions or settings.MAILING_ASYNC_SESSIONS
+        self.queue_size = queue_size or settings.MAILING_ASYNC_QUEUE_SIZE
+        self.host = host or settings.EMAIL_HOST
+        self.port = port or settings.EMAIL_PORT
+        self.username = (
+            settings.EMAIL_HOST_USER if username is None else username
+        )
+        self.password = (
+            settings.EMAIL_HOST_PASSWORD if password is None else password
+        )
+        self.use_tls = settings.EMAIL_USE_TLS if use_tls is None else use_tls
+        self.use_ssl = settings.EMAIL_USE_SSL if use_ssl is None else use_ssl
+        self.timeout = timeout or settings.EMAIL_TIMEOUT or 60
+        self._loop = None
+        self._queue = None
+        self._workers = None
+        self._cancelled = False
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        """
+        Start the event loop thread and the SMTP sessions.
+
+        Returns:
+            None
+        """
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._loop.run_forever, daemon=True
+        )
+        self._thread.start()
+
+        async def start_workers():
+            self._queue = asyncio.Queue(self.queue_size)
+            self._workers = [
+                asyncio.create_task(self._work())
+                for number in range(self.sessions)
+            ]
+
+        asyncio.run_coroutine_threadsafe(start_workers(), self._loop).result()
+
+    def submit(self, message):
+        """
+        Queue a message for delivery, blocking while the queue is full.
+
+        Args:
+            message (EmailMessage): The message to send.
+
+        Returns:
+            concurrent.futures.Future: Resolves to a DeliveryResult per
+                recipient in the order of `message.recipients()`.
+        """
+        encoding = message.encoding or settings.DEFAULT_CHARSET
+        future = Future()
+        item = (
+            sanitize_address(message.from_email, encoding),
+            message.recipients(),
+            [
+                sanitize_address(email, encoding)
+                for email in message.recipients()
+            ],
+            message.message().as_bytes(linesep='\r\n'),
+            future,
+        )
+        asyncio.run_coroutine_threadsafe(
+            self._queue.put(item), self._loop
+        ).result()
+        return future
+
+    def cancel(self):
+        """
+        Drop the queued messages without sending them.
+
+        The futures of the dropped messages resolve to failed results.
+        Messages a session is already transmitting are still delivered.
+
+        Returns:
+            None
+        """
+        self._cancelled = True
+
+    def stop(self):
+        """
+        Wait for the queued messages, close the sessions and the loop.
+
+        Returns:
+            None
+        """
+        async def stop_workers():
+            for worker in self._workers:
+                await self._queue.put(None)
+            await asyncio.gather(*self._workers)
+
+        asyncio.run_coroutine_threadsafe(stop_workers(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    async def _work(self):
+        session = None
+        rate_limiter = get_rate_limiter()
+        account = get_sender_account(self)
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                break
+            from_email, emails, addresses, data, future = item
+            if self._cancelled:
+                future.set_result([CANCELLED] * len(emails))
+                continue
+
+            started = time.perf_counter()
+            try:
+                if rate_limiter is not None:
+                    await self._loop.run_in_executor(
+                        None, rate_limiter.wait, account, emails
+                    )
+                    if self._cancelled:
+                        future.set_result([CANCELLED] * len(emails))
+                        continue
+                    started = time.perf_counter()
+                if session is None:
+                    session = AsyncSMTPSession(
+                        self.host, self.port, self.username, self.password,
+                        self.use_tls, self.use_ssl, self.timeout,
+                    )
+                    await session.connect()
+                refused = await session.send(from_email, addresses, data)
+            except smtplib.SMTPRecipientsRefused as error:
+                refused = error.recipients
+            except Exception as error:
+                # Any error fails the message instead of the session task,
+                # so the future is always resolved
+                if session is not None:
+                    await session.close()
+                    session = None
+                result = DeliveryResult(
+                    False,
+                    str(error) or type(error).__name__,
+                    get_smtp_code(error),
+                    (time.perf_counter() - started) * 1000,
+                )
+                future.set_result([result] * len(emails))
+                continue
+
+            latency = (time.perf_counter() - started) * 1000
+            results = []
+            for email, address in zip(emails, addresses):
+                if address in refused:
+                    code, response = refused[address]
+                    error = response.decode(errors='replace')
+                    results.append(DeliveryResult(False, error, code, latency))
+                else:
+                    results.append(
+                        DeliveryResult(True, None, SMTP_OK, latency)
+                    )
+            future.set_result(results)
+
+        if session is not None:
+            await session.close()
+
+
+def get_chunk_report(number, chunk, futures):
+    """
+    Build the report of a chunk from the results of its messages.
+
+    Blocks until every message of the chunk is delivered.
+
+    Args:
+        number (int): The number of the chunk.
+        chunk (list): The recipients of the chunk.
+        futures (list): (recipients, Future) pairs of the chunk messages.
+
+    Returns:
+        ChunkReport: The report of the chunk.
+    """
+    results = [
+        (recipient, result)
+        for batch, future in futures
+        for recipient, result in zip(batch, future.result())
+    ]
+    sent = sum(result.sent for recipient, result in results)
+    return ChunkReport(number, len(chunk), sent, chunk[-1], results)
+
+
+def send_in_chunks_async(mailing, recipients, chunk_size=None,
+                         sessions=None, engine=None):
+    """
+    Send a mailing to its recipients with the asyncio delivery engine.
+
+    Messages are rendered in the calling thread and queued to the
+    engine, whose sessions deliver them concurrently. A chunk is
+    reported once all of its messages are delivered, and the next chunk
+    is only queued when the caller asks for its report. No message is
+    in flight while the caller stores a checkpoint, so a run stopped
+    after a report never sends a recipient past its checkpoint.
+
+    Args:
+        mailing (Mailing): The mailing to send.
+        recipients (iterable): Recipients with `email` and `telephone`
+            attributes.
+        chunk_size (int, optional): The number of messages per chunk.
+            Defaults to `settings.MAILING_CHUNK_SIZE`.
+        sessions (int, optional): The number of concurrent SMTP sessions.
+            Defaults to `settings.MAILING_ASYNC_SESSIONS`.
+        engine (AsyncEngine, optional): The engine to use. A new one is
+            started and stopped if not provided.
+
+    Yields:
+        ChunkReport: The reports of the chunks in order.
+    """
+    if chunk_size is None:
+        chunk_size = settings.MAILING_CHUNK_SIZE
+    owns_engine = engine is None
+    if owns_engine:
+        engine = AsyncEngine(sessions=sessions)
+        engine.start()
+
+    compiled = CompiledMailing(mailing)
+    try:
+        for number, chunk in enumerate(chunked(recipients, chunk_size), 1):
+            futures = [
+                (batch, engine.submit(message))
+                for batch, message in build_envelopes(compiled, chunk)
+            ]
+            yield get_chunk_report(number, chunk, futures)
+    finally:
+        if owns_engine:
+            # Messages still queued when the stream fails mid-chunk are
+            # not sent and stay after the checkpoint
+            engine.cancel()
+            engine.stop()
@@ -0,0 +1,135 @@
+import asyncio
+import threading
+
+
+class SMTPSink:
+    """
+    Local SMTP server that accepts and discards every message.
+
+    The server runs on its own event loop in a background thread of the
+    current process, so mailings can be sent and benchmarked offline. It
+    advertises PIPELINING, accepts any AUTH and can delay its reply to
+    every message to simulate the latency of a remote relay.
+
+    Attributes:
+        host (str): The address the server listens on.
+        port (int): The port the server listens on, chosen by the system
+            if 0.
+        latency (float): Seconds waited before a message is accepted.
+        messages (int): The number of accepted messages.
+        recipients (int): The number of accepted envelope recipients.
+        size (int): The number of accepted message bytes.
+
+    Methods:
+        start: Start the server in a background thread.
+        stop: Stop the server.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.messages = 0
+        self.recipients = 0
+        self.size = 0
+        self._loop = None
+        self._server = None
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        """
+        Start the server in a background thread.
+
+        Returns:
+            tuple: The host and port the server listens on.
+        """
+        started = threading.Event()
+        self._loop = asyncio.new_event_loop()
+
+        def serve():
+            asyncio.set_event_loop(self._loop)
+            self._server = self._loop.run_until_complete(
+                asyncio.start_server(self._handle, self.host, self.port)
+            )
+            self.port = self._server.sockets[0].getsockname()[1]
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=serve, daemon=True)
+        self._thread.start()
+        started.wait()
+        return self.host, self.port
+
+    def stop(self):
+        """
+        Stop the server and its thread.
+
+        Returns:
+            None
+        """
+        async def close():
+            self._server.close()
+            await self._server.wait_closed()
+
+        asyncio.run_coroutine_threadsafe(close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    async def _handle(self, reader, writer):
+        recipients = 0
+        writer.write(b'220 localhost SMTP sink\r\n')
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line[:4].upper()
+                if command in (b'EHLO', b'HELO'):
+                    writer.write(
+                        b'250-localhost\r\n'
+                        b'250-PIPELINING\r\n'
+                        b'250-8BITMIME\r\n'
+                        b'250 AUTH PLAIN LOGIN\r\n'
+                    )
+                elif command == b'AUTH':
+                    writer.write(b'235 Authentication successful\r\n')
+                elif command == b'MAIL':
+                    recipients = 0
+                    writer.write(b'250 OK\r\n')
+                elif command == b'RCPT':
+                    recipients += 1
+                    writer.write(b'250 OK\r\n')
+                elif command == b'DATA':
+                    writer.write(b'354 End data with <CR><LF>.<CR><LF>\r\n')
+                    await writer.drain()
+                    size = 0
+                    while True:
+                        data = await reader.readline()
+                        if data in (b'.\r\n', b''):
+                            break
+                        size += len(data)
+                    if self.latency:
+                        await asyncio.sleep(self.latency)
+                    self.messages += 1
+                    self.recipients += recipients
+                    self.size += size
+                    writer.write(b'250 OK: queued\r\n')
+                elif command == b'QUIT':
+                    writer.write(b'221 Bye\r\n')
+                    break
+                else:
+                    # RSET, NOOP and anything else
+                    writer.write(b'250 OK\r\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
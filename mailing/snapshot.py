@@ -0,0 +1,269 @@
+import time
+from collections import namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from mailing.control import is_stopped
+from mailing.models import MailingRun, SnapshotRange, SnapshotRecipient
+from mailing.outbox import finish_runs
+from mailing.recipients import get_recipients_queryset
+from mailing.runner import send_recipients
+from mailing.suppression import get_suppression_set
+
+# Recipient of a snapshot range with its sequence number
+SnapshotRow = namedtuple('SnapshotRow', ('seq', 'pk', 'email', 'telephone'))
+
+
+def create_snapshot(run):
+    """
+    Freeze the recipients of a run into its snapshot.
+
+    The recipients are copied with a single `INSERT ... SELECT` from the
+    recipients query of the mailing, numbered with `ROW_NUMBER()` in
+    primary key order, so no row is read into the current process. The
+    recipients are always de-duplicated in the database, as the ranges
+    of a snapshot are sent by separate processes which cannot share the
+    addresses they have seen.
+
+    Args:
+        run (MailingRun): The run to snapshot.
+
+    Returns:
+        int: The number of recipients in the snapshot.
+    """
+    if run.mailing.contact_list_id is None:
+        return 0
+
+    sql, params = get_recipients_queryset(
+        run.mailing, deduplicate=True
+    ).query.sql_with_params()
+    table = connection.ops.quote_name(SnapshotRecipient._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} (run_id, seq, contact_id, email, telephone) '
+            f'SELECT %s, ROW_NUMBER() OVER (ORDER BY recipients.id), '
+            f'recipients.id, recipients.email, recipients.telephone '
+            f'FROM ({sql}) AS recipients',
+            (run.pk, *params),
+        )
+        return cursor.rowcount
+
+
+def create_ranges(run, size, range_size=None):
+    """
+    Split the snapshot of a run into contiguous ranges.
+
+    Args:
+        run (MailingRun): The run whose snapshot is split.
+        size (int): The number of recipients in the snapshot.
+        range_size (int, optional): The number of recipients per range.
+            Defaults to `settings.MAILING_SNAPSHOT_RANGE_SIZE`.
+
+    Returns:
+        int: The number of created ranges.
+    """
+    if range_size is None:
+        range_size = settings.MAILING_SNAPSHOT_RANGE_SIZE
+
+    ranges = SnapshotRange.objects.bulk_create(
+        SnapshotRange(
+            run=run,
+            first_seq=first_seq,
+            last_seq=min(first_seq + range_size - 1, size),
+            next_seq=first_seq,
+        )
+        for first_seq in range(1, size + 1, range_size)
+    )
+    return len(ranges)
+
+
+def snapshot_mailing(mailing, range_size=None):
+    """
+    Create a run of a mailing with a snapshot of its recipients.
+
+    The snapshot and its ranges are created in one transaction, so
+    workers never claim a range of a partial snapshot. The run is
+    queued and sent by `manage.py send_ranges` processes.
+
+    Args:
+        mailing (Mailing): The mailing to snapshot.
+        range_size (int, optional): The number of recipients per range.
+
+    Returns:
+        tuple: The created MailingRun, the number of recipients and the
+            number of ranges.
+    """
+    with transaction.atomic():
+        run = MailingRun.objects.create(mailing=mailing)
+        size = create_snapshot(run)
+        ranges = create_ranges(run, size, range_size)
+    if not ranges:
+        finish_runs([run.pk])
+    return run, size, ranges
+
+
+def claim_range(lease=None):
+    """
+    Claim a pending snapshot range for the current worker.
+
+    The row is selected with `SELECT ... FOR UPDATE SKIP LOCKED`, so
+    concurrent workers never claim the same range, and leased until
+    `now + lease`. Only the range row is locked, not the rows of its run
+    and mailing. Ranges whose lease has expired are claimed again.
+    Ranges of paused runs are not claimed.
+
+    Args:
+        lease (int, optional): The lease duration in seconds. Defaults
+            to `settings.MAILING_OUTBOX_LEASE`.
+
+    Returns:
+        SnapshotRange | None: The claimed range, or None if there is no
+            claimable range.
+    """
+    if lease is None:
+        lease = settings.MAILING_OUTBOX_LEASE
+
+    now = timezone.now()
+    with transaction.atomic():
+        snapshot_range = SnapshotRange.objects.select_for_update(
+            skip_locked=True, of=('self',)
+        ).filter(
+            Q(locked_until__isnull=True) | Q(locked_until__lt=now),
+            status=SnapshotRange.STATUS_PENDING,
+            run__paused=False,
+        ).select_related('run__mailing').order_by('pk').first()
+        if snapshot_range is not None:
+            snapshot_range.locked_until = now + timedelta(seconds=lease)
+            snapshot_range.save(update_fields=('locked_until',))
+    return snapshot_range
+
+
+def iter_range(snapshot_range, chunk_size=None):
+    """
+    Stream the recipients of a snapshot range from its checkpoint.
+
+    Args:
+        snapshot_range (SnapshotRange): The range to stream.
+        chunk_size (int, optional): The number of rows fetched from the
+            database at a time. Defaults to
+            `settings.MAILING_ITERATOR_CHUNK_SIZE`.
+
+    Yields:
+        SnapshotRow: The next recipient with `seq`, `pk`, `email` and
+            `telephone` attributes.
+    """
+    if chunk_size is None:
+        chunk_size = settings.MAILING_ITERATOR_CHUNK_SIZE
+    rows = SnapshotRecipient.objects.filter(
+        run_id=snapshot_range.run_id,
+        seq__gte=snapshot_range.next_seq,
+        seq__lte=snapshot_range.last_seq,
+    ).order_by('seq').values_list('seq', 'contact_id', 'email', 'telephone')
+    for row in rows.iterator(chunk_size=chunk_size):
+        yield SnapshotRow._make(row)
+
+
+def send_range(snapshot_range, suppression, chunk_size=None, lease=None):
+    """
+    Send the recipients of a claimed snapshot range.
+
+    After every chunk the sequence number of the next recipient is
+    stored on the range and its lease is extended, so a range taken
+    over from a crashed worker resumes where it stopped. The end of the
+    lease serves as the fencing token of the range: a worker whose lease
+    expired and was claimed again stops without storing its progress.
+    Once the range is sent it is marked as done and the run is finished
+    if it was its last range. A range of a run paused while it was sent
+    is released and stays pending.
+
+    Args:
+        snapshot_range (SnapshotRange): The claimed range.
+        suppression (SuppressionSet): The suppression list of the author
+            of the mailing.
+        chunk_size (int, optional): The number of messages sent per chunk.
+        lease (int, optional): The lease duration in seconds. Defaults
+            to `settings.MAILING_OUTBOX_LEASE`.
+
+    Returns:
+        int: The number of deliveries enqueued for a retry.
+    """
+    if lease is None:
+        lease = settings.MAILING_OUTBOX_LEASE
+
+    def leased():
+        return SnapshotRange.objects.filter(
+            pk=snapshot_range.pk,
+            locked_until=snapshot_range.locked_until,
+        )
+
+    def checkpoint(report):
+        locked_until = timezone.now() + timedelta(seconds=lease)
+        if not leased().update(
+            next_seq=report.last_recipient.seq + 1,
+            locked_until=locked_until,
+        ):
+            return None
+        snapshot_range.locked_until = locked_until
+        return {}
+
+    run = snapshot_range.run
+    retries = send_recipients(
+        run,
+        suppression.filter(iter_range(snapshot_range)),
+        checkpoint,
+        chunk_size=chunk_size,
+        label=f'Range {snapshot_range}: ',
+    )
+    if is_stopped(run.pk):
+        leased().filter(
+            status=SnapshotRange.STATUS_PENDING,
+        ).update(locked_until=None)
+        return retries
+    if leased().update(
+        status=SnapshotRange.STATUS_DONE,
+        next_seq=snapshot_range.last_seq + 1,
+        locked_until=None,
+    ):
+        finish_runs([run.pk])
+    return retries
+
+
+def run_range_worker(chunk_size=None, idle_sleep=None, once=False):
+    """
+    Send claimed snapshot ranges until none is left or forever.
+
+    The suppression list of a run is loaded once per worker.
+
+    Args:
+        chunk_size (int, optional): The number of messages sent per chunk.
+        idle_sleep (float, optional): Seconds to wait when there is no
+            claimable range. Defaults to `settings.MAILING_OUTBOX_IDLE_SLEEP`.
+        once (bool, optional): Whether to stop as soon as there is no
+            claimable range.
+
+    Returns:
+        int: The number of sent ranges.
+    """
+    if idle_sleep is None:
+        idle_sleep = settings.MAILING_OUTBOX_IDLE_SLEEP
+
+    suppressions = {}
+    processed = 0
+    while True:
+        close_old_connections()
+        snapshot_range = claim_range()
+        if snapshot_range is None:
+            if once:
+                return processed
+            time.sleep(idle_sleep)
+            continue
+
+        run = snapshot_range.run
+        if run.pk not in suppressions:
+            suppressions[run.pk] = get_suppression_set(run.mailing)
+        send_range(snapshot_range, suppressions[run.pk], chunk_size)
+        processed += 1
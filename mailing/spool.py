@@ -0,0 +1,443 @@
+import json
+import os
+import shutil
+import time
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import close_old_connections
+from django.db.models import F
+
+from logs.service import DeliveryLogBuffer
+from mailing.control import is_stopped
+from mailing.locks import LeaseLock
+from mailing.mime import EncodedMessage
+from mailing.models import MailingRun
+from mailing.outbox import enqueue_retries, finish_runs
+from mailing.recipients import (
+    Recipient, RecipientDeduplicator, iter_recipients,
+)
+from mailing.rendering import CompiledMailing
+from mailing.sender import build_envelopes, chunked, deliver, deliver_batch
+from mailing.suppression import get_suppression_set
+
+# Header prepended to every spool file with the envelope of the message,
+# it is stripped before the message is sent
+ENVELOPE_HEADER = b'X-Mailcraft-Envelope: '
+
+
+class SpooledMessage(EmailMessage):
+    """
+    Email message read from the spool.
+
+    Keeps the envelope stored in the spool file, while its `message()`
+    returns the spooled bytes unchanged, so a DKIM signature made while
+    rendering stays valid.
+    """
+
+    def __init__(self, from_email, recipients, data):
+        if len(recipients) == 1:
+            super().__init__(from_email=from_email, to=recipients)
+        else:
+            super().__init__(from_email=from_email, bcc=recipients)
+        self.data = data
+
+    def message(self):
+        """
+        Get the spooled message.
+
+        Returns:
+            EncodedMessage: The serialised message.
+        """
+        return EncodedMessage(self.data)
+
+
+def get_spool_dir(run_pk):
+    """
+    Get the spool directory of a mailing run.
+
+    Args:
+        run_pk (int): The primary key of the run.
+
+    Returns:
+        str: The path of the maildir of the run.
+    """
+    return os.path.join(settings.MAILING_SPOOL_DIR, str(run_pk))
+
+
+def write_spool_files(directory, compiled, recipients):
+    """
+    Render the messages of a mailing into the maildir of its run.
+
+    Every message of the chunk is written into `tmp` and synced to disk,
+    then the chunk is moved into `new` with atomic renames,
+    so the shipper never reads a partially written file. A file is named
+    after the primary key of its first recipient, so a chunk rendered
+    again after a crash replaces its files instead of duplicating them.
+
+    Args:
+        directory (str): The maildir of the run.
+        compiled (CompiledMailing): The compiled mailing to render.
+        recipients (list): Recipients with `pk`, `email` and `telephone`
+            attributes.
+
+    Returns:
+        int: The number of written files.
+    """
+    names = []
+    for batch, message in build_envelopes(compiled, recipients):
+        envelope = json.dumps({
+            'from': message.from_email,
+            'to': message.recipients(),
+            'contacts': [recipient.pk for recipient in batch],
+        }).encode()
+        name = f'{batch[0].pk:012d}.eml'
+        with open(os.path.join(directory, 'tmp', name), 'wb') as spool_file:
+            spool_file.write(
+                ENVELOPE_HEADER + envelope + b'\r\n'
+                + message.message().as_bytes(linesep='\r\n')
+            )
+            spool_file.flush()
+            # Only the spool file is synced, not every filesystem
+            os.fsync(spool_file.fileno())
+        names.append(name)
+
+    for name in names:
+        os.replace(
+            os.path.join(directory, 'tmp', name),
+            os.path.join(directory, 'new', name),
+        )
+    sync_dir(os.path.join(directory, 'new'))
+    return len(names)
+
+
+def sync_dir(directory):
+    """
+    Sync the entries of a directory to disk.
+
+    Args:
+        directory (str): The directory to sync.
+
+    Returns:
+        None
+    """
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def get_spool_file_pk(name):
+    """
+    Get the primary key of the first recipient of a spool file.
+
+    Args:
+        name (str): The name of the spool file.
+
+    Returns:
+        int: The primary key the file is named after.
+    """
+    return int(name.split('.', 1)[0])
+
+
+def read_spool_file(path):
+    """
+    Read a message from the spool.
+
+    Args:
+        path (str): The path of the spool file.
+
+    Returns:
+        tuple: The envelope dict with `from`, `to` and `contacts` keys
+            and the message bytes with CRLF line separators.
+    """
+    with open(path, 'rb') as spool_file:
+        header, data = spool_file.read().split(b'\r\n', 1)
+    return json.loads(header[len(ENVELOPE_HEADER):]), data
+
+
+def spool_run(run, chunk_size=None, fence=None):
+    """
+    Render a run of a mailing into its spool directory.
+
+    Recipients are streamed from the database and their messages are
+    rendered chunk by chunk at the speed of the CPU, independently of
+    the relay. Duplicate addresses and recipients on the suppression
+    list of the author of the mailing are skipped. After every chunk the
+    primary key of its last contact is stored on the run as a
+    checkpoint, so an interrupted run resumes rendering where it
+    stopped. Rendering stops after the chunk during which the run was
+    paused or cancelled. Once every message is spooled the run is marked
+    as spooled and left to `manage.py ship_spool`, unless it was paused,
+    cancelled or taken over in the meantime.
+
+    Args:
+        run (MailingRun): The run to render.
+        chunk_size (int, optional): The number of messages written per
+            chunk. Defaults to `settings.MAILING_CHUNK_SIZE`.
+        fence (int, optional): The fencing token of the mailing lock the
+            run is rendered under, rendering stops once the run is taken
+            over by a newer one.
+
+    Returns:
+        int: The number of spooled messages.
+    """
+    if chunk_size is None:
+        chunk_size = settings.MAILING_CHUNK_SIZE
+    fenced = {} if fence is None else {'lock_token': fence}
+
+    directory = get_spool_dir(run.pk)
+    for name in ('tmp', 'new'):
+        os.makedirs(os.path.join(directory, name), exist_ok=True)
+
+    compiled = CompiledMailing(run.mailing)
+    deduplicator = RecipientDeduplicator(run.mailing)
+    suppression = get_suppression_set(run.mailing)
+    recipients = suppression.filter(deduplicator.filter(
+        iter_recipients(run.mailing, after=run.last_contact_id)
+    ))
+    spooled = 0
+    for number, chunk in enumerate(chunked(recipients, chunk_size), 1):
+        files = write_spool_files(directory, compiled, chunk)
+        spooled += files
+        updated = MailingRun.objects.filter(pk=run.pk, **fenced).update(
+            total=F('total') + len(chunk),
+            last_contact_id=chunk[-1].pk,
+        )
+        print(f'Chunk {number}: {files} messages spooled')
+        if not updated:
+            print(f'Run {run.pk} is rendered by another process')
+            return spooled
+        if is_stopped(run.pk):
+            print(f'Run {run.pk} stopped')
+            return spooled
+    print(f'Run {run.pk}: {deduplicator.dropped} duplicate recipients')
+    print(f'Run {run.pk}: {suppression.skipped} suppressed recipients')
+
+    MailingRun.objects.filter(
+        pk=run.pk,
+        status=MailingRun.RUN_SENDING,
+        paused=False,
+        **fenced,
+    ).update(status=MailingRun.RUN_SPOOLED)
+    return spooled
+
+
+def is_relay_error(result):
+    """
+    Check whether a delivery failed because the relay was unreachable.
+
+    Args:
+        result (DeliveryResult): The result of the delivery.
+
+    Returns:
+        bool: True if the message was not sent and the server gave no
+            reply code.
+    """
+    return not result.sent and result.smtp_code is None
+
+
+def ship_run(connection, delivery_log, run, batch_size=None, lock=None):
+    """
+    Send the spooled messages of a run and delete the accepted ones.
+
+    Files are sent in the order they were rendered. Only files up to the
+    checkpoint of the run are sent, as the files of a chunk rendered
+    after it may be rendered again. Every file is deleted once the
+    relay has answered for it, transient failures are
+    enqueued into the outbox for a retry. If the relay cannot be
+    reached, shipping stops and the remaining files are kept, so the
+    spool is replayed once the relay is back. Shipping also stops after
+    the batch during which the run was paused or cancelled, and before
+    the next file once the shipper lost the lock of the run.
+
+    Args:
+        connection: The email backend to send the messages with.
+        delivery_log (DeliveryLogBuffer): The buffer the result of every
+            delivery is added to.
+        run (MailingRun): The run whose spool is shipped.
+        batch_size (int, optional): The number of files after which the
+            run counters are updated. Defaults to
+            `settings.MAILING_CHUNK_SIZE`.
+        lock (LeaseLock, optional): The lock of the run held by the
+            shipper.
+
+    Returns:
+        tuple: The number of shipped files and whether the relay was
+            unreachable.
+    """
+    if batch_size is None:
+        batch_size = settings.MAILING_CHUNK_SIZE
+
+    new = os.path.join(get_spool_dir(run.pk), 'new')
+    if run.last_contact_id is None:
+        return 0, False
+    spooled = sorted(
+        name for name in os.listdir(new)
+        if get_spool_file_pk(name) <= run.last_contact_id
+    )
+    shipped = 0
+    for names in chunked(spooled, batch_size):
+        sent = 0
+        failures = []
+        unreachable = False
+        lost = False
+        for name in names:
+            if lock is not None and lock.lost:
+                lost = True
+                break
+            path = os.path.join(new, name)
+            try:
+                envelope, data = read_spool_file(path)
+            except FileNotFoundError:
+                # Shipped by a shipper whose lease expired meanwhile
+                continue
+            message = SpooledMessage(envelope['from'], envelope['to'], data)
+            if len(envelope['to']) == 1:
+                results = [deliver(connection, message)]
+            else:
+                results = deliver_batch(connection, message)
+            if all(is_relay_error(result) for result in results):
+                unreachable = True
+                break
+
+            for pk, email, result in zip(
+                envelope['contacts'], envelope['to'], results
+            ):
+                delivery_log.add(run.pk, pk, email, result)
+                if result.sent:
+                    sent += 1
+                else:
+                    failures.append((Recipient(pk, email, ''), result))
+            os.remove(path)
+            shipped += 1
+
+        enqueue_retries(run, failures)
+        MailingRun.objects.filter(pk=run.pk).update(sent=F('sent') + sent)
+        delivery_log.flush()
+        if unreachable:
+            return shipped, True
+        if lost or is_stopped(run.pk):
+            break
+    return shipped, False
+
+
+def finish_spooled_run(run):
+    """
+    Finish a fully rendered run whose spool has been shipped.
+
+    The run is queued like an enqueued run, so it is marked as done
+    once its retries are processed.
+
+    Args:
+        run (MailingRun): The run whose spool is empty.
+
+    Returns:
+        None
+    """
+    queued = MailingRun.objects.filter(
+        pk=run.pk,
+        status=MailingRun.RUN_SPOOLED,
+    ).update(status=MailingRun.RUN_QUEUED)
+    if queued:
+        shutil.rmtree(get_spool_dir(run.pk), ignore_errors=True)
+        finish_runs([run.pk])
+
+
+def ship_spool(connection, delivery_log, batch_size=None):
+    """
+    Ship the spool of every run in the spool directory once.
+
+    Runs still being rendered are shipped up to their checkpoint.
+    Paused runs are skipped and the spool of cancelled runs is removed.
+    A run is shipped under its lock, so runs shipped by another shipper
+    are skipped and no file is sent twice.
+
+    Args:
+        connection: The email backend to send the messages with.
+        delivery_log (DeliveryLogBuffer): The buffer the result of every
+            delivery is added to.
+        batch_size (int, optional): The number of files after which the
+            run counters are updated.
+
+    Returns:
+        tuple: The number of shipped files and whether the relay was
+            unreachable.
+    """
+    if not os.path.isdir(settings.MAILING_SPOOL_DIR):
+        return 0, False
+
+    run_pks = sorted(
+        int(name) for name in os.listdir(settings.MAILING_SPOOL_DIR)
+        if name.isdigit()
+    )
+    runs = MailingRun.objects.in_bulk(run_pks)
+    shipped = 0
+    for run_pk in run_pks:
+        run = runs.get(run_pk)
+        if run is None or run.status == MailingRun.RUN_CANCELLED:
+            # The messages of deleted and cancelled runs must not be sent
+            shutil.rmtree(get_spool_dir(run_pk), ignore_errors=True)
+            continue
+        if run.paused:
+            continue
+
+        lock = LeaseLock(f'spool:{run_pk}')
+        if not lock.acquire():
+            continue
+        try:
+            run_shipped, unreachable = ship_run(
+                connection, delivery_log, run, batch_size, lock
+            )
+            shipped += run_shipped
+            if unreachable:
+                return shipped, True
+            if lock.lost or is_stopped(run.pk):
+                continue
+            if run.status == MailingRun.RUN_SPOOLED:
+                finish_spooled_run(run)
+        finally:
+            lock.release()
+    return shipped, False
+
+
+def run_shipper(batch_size=None, idle_sleep=None, once=False):
+    """
+    Ship the spool until it is empty or forever.
+
+    When the spool is empty or the relay cannot be reached, the shipper
+    waits before it scans the spool again.
+
+    Args:
+        batch_size (int, optional): The number of files after which the
+            run counters are updated.
+        idle_sleep (float, optional): Seconds to wait when there is
+            nothing to ship. Defaults to `settings.MAILING_OUTBOX_IDLE_SLEEP`.
+        once (bool, optional): Whether to stop as soon as there is
+            nothing to ship.
+
+    Returns:
+        int: The number of shipped files.
+    """
+    if idle_sleep is None:
+        idle_sleep = settings.MAILING_OUTBOX_IDLE_SLEEP
+
+    shipped = 0
+    connection = get_connection()
+    delivery_log = DeliveryLogBuffer()
+    try:
+        while True:
+            close_old_connections()
+            count, unreachable = ship_spool(
+                connection, delivery_log, batch_size
+            )
+            shipped += count
+            if count and not unreachable:
+                continue
+            if once:
+                return shipped
+            connection.close()
+            time.sleep(idle_sleep)
+    finally:
+        connection.close()
@@ -0,0 +1,223 @@
+import hashlib
+import math
+import threading
+
+from django.conf import settings
+
+from contacts.models import Suppression
+from mailing.sender import chunked
+
+
+def normalize_email(email):
+    """
+    Normalise an email address for suppression lookups.
+
+    Args:
+        email (str): The email address.
+
+    Returns:
+        str: The stripped and lowercased address.
+    """
+    return email.strip().lower()
+
+
+def hash_email(email):
+    """
+    Hash a normalised email address into a 128-bit integer.
+
+    Args:
+        email (str): The normalised email address.
+
+    Returns:
+        int: The hash of the address.
+    """
+    digest = hashlib.blake2b(email.encode(), digest_size=16).digest()
+    return int.from_bytes(digest, 'big')
+
+
+class BloomFilter:
+    """
+    Bloom filter of hashed email addresses.
+
+    Uses `hashes` bit positions per address derived from its 128-bit hash
+    with double hashing. An address that was added is always found,
+    other addresses are found with the configured false positive rate.
+
+    Attributes:
+        size (int): The number of bits.
+        hashes (int): The number of bits set per address.
+
+    Methods:
+        add: Add a hashed address.
+    """
+
+    def __init__(self, capacity, error_rate):
+        capacity = max(capacity, 1)
+        self.size = math.ceil(
+            -capacity * math.log(error_rate) / math.log(2) ** 2
+        )
+        self.hashes = max(round(self.size / capacity * math.log(2)), 1)
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value):
+        first, second = value >> 64, value & 0xFFFFFFFFFFFFFFFF
+        for number in range(self.hashes):
+            yield (first + number * second) % self.size
+
+    def add(self, value):
+        """
+        Add a hashed address.
+
+        Args:
+            value (int): The hash of the address.
+
+        Returns:
+            None
+        """
+        for position in self._positions(value):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value):
+        return all(
+            self._bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(value)
+        )
+
+
+class SuppressionSet:
+    """
+    In-memory suppression list of a user, loaded once per run.
+
+    The suppressed addresses are kept as hashes of their normalised form
+    in a set, or in a Bloom filter when the user has more than
+    `settings.MAILING_SUPPRESSION_BLOOM_THRESHOLD` of them, so every
+    streamed recipient is checked in constant time without a query.
+    The set is read-only once loaded, so it can filter the streams of
+    several threads.
+
+    Attributes:
+        size (int): The number of suppressed addresses.
+        skipped (int): The number of recipients skipped so far.
+
+    Methods:
+        is_suppressed: Check whether an address is suppressed.
+        filter: Skip the suppressed recipients of a stream.
+    """
+
+    def __init__(self, emails, size):
+        self.size = size
+        self.skipped = 0
+        self._lock = threading.Lock()
+        if size > settings.MAILING_SUPPRESSION_BLOOM_THRESHOLD:
+            self._hashes = BloomFilter(
+                size, settings.MAILING_SUPPRESSION_ERROR_RATE
+            )
+            for email in emails:
+                self._hashes.add(hash_email(normalize_email(email)))
+        else:
+            self._hashes = {
+                hash_email(normalize_email(email)) for email in emails
+            }
+
+    def is_suppressed(self, email):
+        """
+        Check whether an address is suppressed.
+
+        Args:
+            email (str): The email address.
+
+        Returns:
+            bool: True if the address is suppressed.
+        """
+        return hash_email(normalize_email(email)) in self._hashes
+
+    def filter(self, recipients):
+        """
+        Skip the suppressed recipients of a stream.
+
+        Args:
+            recipients (iterable): Recipients with an `email` attribute.
+
+        Yields:
+            The recipients whose address is not suppressed.
+        """
+        if not self.size:
+            yield from recipients
+            return
+        for recipient in recipients:
+            if self.is_suppressed(recipient.email):
+                with self._lock:
+                    self.skipped += 1
+                continue
+            yield recipient
+
+
+def get_suppression_set(mailing, chunk_size=None):
+    """
+    Load the suppression list of the author of a mailing.
+
+    Args:
+        mailing (Mailing): The mailing being sent.
+        chunk_size (int, optional): The number of rows fetched from the
+            database at a time. Defaults to
+            `settings.MAILING_ITERATOR_CHUNK_SIZE`.
+
+    Returns:
+        SuppressionSet: The suppressed addresses of the user, empty if
+            the mailing has no author.
+    """
+    if chunk_size is None:
+        chunk_size = settings.MAILING_ITERATOR_CHUNK_SIZE
+    if mailing.user_id is None:
+        return SuppressionSet((), 0)
+
+    queryset = Suppression.objects.filter(user_id=mailing.user_id)
+    return SuppressionSet(
+        queryset.values_list('email', flat=True).iterator(
+            chunk_size=chunk_size
+        ),
+        queryset.count(),
+    )
+
+
+def import_suppressions(user, lines, reason=Suppression.REASON_UNSUBSCRIBED,
+                        chunk_size=None):
+    """
+    Import suppressed addresses of a user from the lines of a file.
+
+    Every line holds an address, optionally followed by other
+    comma-separated columns which are ignored. Blank lines and lines
+    without an `@` (e.g. a CSV header) are skipped. Addresses are
+    inserted with `bulk_create` in chunks and addresses that are already
+    suppressed are left unchanged.
+
+    Args:
+        user (User): The user the addresses are suppressed for.
+        lines (iterable): The lines of the suppression file.
+        reason (str, optional): The reason of the suppressions.
+        chunk_size (int, optional): The number of rows inserted at a
+            time. Defaults to `settings.MAILING_ITERATOR_CHUNK_SIZE`.
+
+    Returns:
+        int: The number of read addresses.
+    """
+    if chunk_size is None:
+        chunk_size = settings.MAILING_ITERATOR_CHUNK_SIZE
+
+    emails = (
+        normalize_email(line.split(',', 1)[0]).strip('"\'')
+        for line in lines
+    )
+    imported = 0
+    for chunk in chunked(
+            (email for email in emails if '@' in email), chunk_size
+    ):
+        Suppression.objects.bulk_create(
+            (
+                Suppression(user=user, email=email, reason=reason)
+                for email in chunk
+            ),
+            ignore_conflicts=True,
+        )
+        imported += len(chunk)
+    return imported
@@ -0,0 +1,361 @@
+import importlib
+import time
+import traceback
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from mailing.models import (
+    PRIORITIES, PRIORITY_NOTIFICATION, PRIORITY_TRANSACTIONAL, BackgroundTask,
+)
+from mailing.retry import get_retry_delay
+from mailing.sender import deliver
+
+# Task functions by their dotted path, filled by the `@task` decorator
+registry = {}
+
+
+class Task:
+    """
+    Function that can be called in the background by `manage.py run_tasks`.
+
+    Calling the task runs the function in the current process, `delay()`
+    enqueues a call once the current transaction is committed, so a
+    worker never picks up a task whose data was rolled back. The
+    arguments must be JSON serialisable.
+
+    Attributes:
+        func (callable): The task function.
+        name (str): The dotted path of the function.
+        max_attempts (int): The maximum number of attempts of a call.
+        priority (str): The priority class of the calls.
+
+    Methods:
+        delay: Enqueue a call of the task.
+    """
+
+    def __init__(self, func, max_attempts=None,
+                 priority=PRIORITY_NOTIFICATION):
+        self.func = func
+        self.name = f'{func.__module__}.{func.__qualname__}'
+        self.max_attempts = max_attempts
+        self.priority = priority
+        self.__doc__ = func.__doc__
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def delay(self, *args, **kwargs):
+        """
+        Enqueue a call of the task.
+
+        With `settings.TASKS_EAGER` the task is called in the current
+        process once the transaction is committed instead.
+
+        Args:
+            *args: The positional arguments of the call.
+            **kwargs: The keyword arguments of the call.
+
+        Returns:
+            None
+        """
+        if settings.TASKS_EAGER:
+            transaction.on_commit(partial(self.func, *args, **kwargs))
+            return
+        transaction.on_commit(partial(enqueue, self, args, kwargs))
+
+
+def task(func=None, *, max_attempts=None, priority=PRIORITY_NOTIFICATION):
+    """
+    Register a function as a background task.
+
+    Can be used as `@task` or `@task(priority=PRIORITY_TRANSACTIONAL)`.
+
+    Args:
+        func (callable, optional): The task function.
+        max_attempts (int, optional): The maximum number of attempts of
+            a call. Defaults to `settings.TASKS_MAX_ATTEMPTS`.
+        priority (str, optional): The priority class of the calls.
+
+    Returns:
+        Task: The registered task, or a decorator if `func` is not given.
+    """
+    if func is None:
+        return partial(task, max_attempts=max_attempts, priority=priority)
+
+    registered = Task(func, max_attempts, priority)
+    registry[registered.name] = registered
+    return registered
+
+
+def enqueue(registered, args=(), kwargs=None):
+    """
+    Store a call of a task for the workers.
+
+    Args:
+        registered (Task): The task to call.
+        args (iterable, optional): The positional arguments of the call.
+        kwargs (dict, optional): The keyword arguments of the call.
+
+    Returns:
+        BackgroundTask: The enqueued task.
+    """
+    return BackgroundTask.objects.create(
+        name=registered.name,
+        args=list(args),
+        kwargs=kwargs or {},
+        priority=registered.priority,
+        max_attempts=registered.max_attempts or settings.TASKS_MAX_ATTEMPTS,
+    )
+
+
+def get_task(name):
+    """
+    Get a registered task by its dotted path.
+
+    The module of the task is imported if it is not registered yet, so
+    workers do not have to import every module defining tasks.
+
+    Args:
+        name (str): The dotted path of the task function.
+
+    Returns:
+        Task: The registered task.
+
+    Raises:
+        LookupError: If the path does not name a registered task.
+    """
+    if name not in registry:
+        module = name.rsplit('.', 1)[0]
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            pass
+    if name not in registry:
+        raise LookupError(f'Unknown task {name}')
+    return registry[name]
+
+
+def claim_tasks(batch_size=None, lease=None, priorities=PRIORITIES):
+    """
+    Claim a batch of pending background tasks for the current worker.
+
+    The lanes are checked from the highest priority to the lowest and
+    the batch is claimed from the first lane with claimable tasks, so a
+    lower lane is only served once the higher ones are drained. The rows
+    are selected with `SELECT ... FOR UPDATE SKIP LOCKED` and leased
+    until `now + lease`, so concurrent workers never claim the same task
+    and tasks of a crashed worker are claimed again.
+
+    Args:
+        batch_size (int, optional): The maximum number of tasks to
+            claim. Defaults to `settings.TASKS_BATCH_SIZE`.
+        lease (int, optional): The lease duration in seconds. Defaults
+            to `settings.MAILING_OUTBOX_LEASE`.
+        priorities (iterable, optional): The lanes to claim from. Defaults
+            to every lane.
+
+    Returns:
+        list: The claimed BackgroundTask instances.
+    """
+    if batch_size is None:
+        batch_size = settings.TASKS_BATCH_SIZE
+    if lease is None:
+        lease = settings.MAILING_OUTBOX_LEASE
+
+    now = timezone.now()
+    for priority in PRIORITIES:
+        if priority not in priorities:
+            continue
+        with transaction.atomic():
+            tasks = list(
+                BackgroundTask.objects.select_for_update(
+                    skip_locked=True
+                ).filter(
+                    Q(retry_at__isnull=True) | Q(retry_at__lte=now),
+                    Q(locked_until__isnull=True) | Q(locked_until__lt=now),
+                    status=BackgroundTask.STATUS_PENDING,
+                    priority=priority,
+                ).order_by('pk')[:batch_size]
+            )
+            BackgroundTask.objects.filter(
+                pk__in=[background_task.pk for background_task in tasks]
+            ).update(locked_until=now + timedelta(seconds=lease))
+        if tasks:
+            return tasks
+    return []
+
+
+def execute_task(background_task, now=None):
+    """
+    Call a claimed background task and record its outcome on it.
+
+    A failed call is retried with the exponential backoff of failed
+    deliveries until its attempts are exhausted. The task is not saved.
+
+    Args:
+        background_task (BackgroundTask): The claimed task.
+        now (datetime, optional): The current time. Defaults to now.
+
+    Returns:
+        bool: True if the call succeeded.
+    """
+    background_task.attempts += 1
+    background_task.locked_until = None
+    try:
+        get_task(background_task.name).func(
+            *background_task.args, **background_task.kwargs
+        )
+    except Exception:
+        if now is None:
+            now = timezone.now()
+        background_task.error = traceback.format_exc()
+        if background_task.attempts < background_task.max_attempts:
+            background_task.retry_at = now + get_retry_delay(
+                background_task.attempts
+            )
+        else:
+            background_task.status = BackgroundTask.STATUS_FAILED
+            background_task.retry_at = None
+        return False
+
+    background_task.status = BackgroundTask.STATUS_DONE
+    background_task.date_done = now or timezone.now()
+    background_task.retry_at = None
+    return True
+
+
+def process_tasks(batch_size=None, priorities=PRIORITIES):
+    """
+    Claim a batch of background tasks, call them and store the outcomes.
+
+    Args:
+        batch_size (int, optional): The maximum number of tasks to claim.
+        priorities (iterable, optional): The lanes to claim from.
+
+    Returns:
+        int: The number of processed tasks.
+    """
+    tasks = claim_tasks(batch_size, priorities=priorities)
+    for background_task in tasks:
+        execute_task(background_task)
+    BackgroundTask.objects.bulk_update(
+        tasks,
+        ('status', 'attempts', 'locked_until', 'retry_at', 'date_done',
+         'error'),
+    )
+    return len(tasks)
+
+
+def purge_tasks(days=None, now=None):
+    """
+    Delete the background tasks finished before the retention period.
+
+    Done tasks are deleted by the time they were done, failed tasks by
+    the time they were enqueued.
+
+    Args:
+        days (int, optional): The number of days finished tasks are
+            kept. Defaults to `settings.TASKS_RETENTION_DAYS`.
+        now (datetime, optional): The current time. Defaults to now.
+
+    Returns:
+        int: The number of deleted tasks.
+    """
+    if days is None:
+        days = settings.TASKS_RETENTION_DAYS
+    if now is None:
+        now = timezone.now()
+
+    cutoff = now - timedelta(days=days)
+    deleted, _ = BackgroundTask.objects.filter(
+        Q(status=BackgroundTask.STATUS_DONE, date_done__lt=cutoff)
+        | Q(status=BackgroundTask.STATUS_FAILED, date_created__lt=cutoff)
+    ).delete()
+    return deleted
+
+
+def run_task_worker(batch_size=None, idle_sleep=None, once=False,
+                    priorities=PRIORITIES):
+    """
+    Process background tasks until none is left or forever.
+
+    After every batch the worker starts again from the highest lane, so
+    a transactional task waits for one batch of lower tasks at most.
+    Workers dedicated to some lanes keep those lanes served while the
+    other workers are busy with long tasks.
+
+    Args:
+        batch_size (int, optional): The maximum number of tasks claimed
+            at a time.
+        idle_sleep (float, optional): Seconds to wait when there is no
+            claimable task. Defaults to `settings.MAILING_OUTBOX_IDLE_SLEEP`.
+        once (bool, optional): Whether to stop as soon as there is no
+            claimable task.
+        priorities (iterable, optional): The lanes to claim from.
+            Defaults to every lane.
+
+    Returns:
+        int: The number of processed tasks.
+    """
+    if idle_sleep is None:
+        idle_sleep = settings.MAILING_OUTBOX_IDLE_SLEEP
+
+    processed = 0
+    while True:
+        close_old_connections()
+        count = process_tasks(batch_size, priorities)
+        processed += count
+        if count:
+            continue
+        if once:
+            return processed
+        time.sleep(idle_sleep)
+
+
+@task(priority=PRIORITY_TRANSACTIONAL)
+def send_email(subject, message, recipient_list, from_email=None,
+               html_message=None, priority=PRIORITY_TRANSACTIONAL):
+    """
+    Send a single email in the background.
+
+    The email takes its token from the budget of its priority class, so
+    it is never delayed by a running campaign. A failed delivery raises
+    an error, so the task is retried.
+
+    Args:
+        subject (str): The subject of the email.
+        message (str): The plain text body of the email.
+        recipient_list (list): The recipient addresses.
+        from_email (str, optional): The sender address. Defaults to
+            `settings.DEFAULT_FROM_EMAIL`.
+        html_message (str, optional): The HTML body of the email.
+        priority (str, optional): The priority class of the email.
+
+    Returns:
+        None
+
+    Raises:
+        RuntimeError: If the email was not sent.
+    """
+    email = EmailMultiAlternatives(
+        subject=subject,
+        body=message,
+        from_email=from_email,
+        to=recipient_list,
+    )
+    if html_message is not None:
+        email.attach_alternative(html_message, 'text/html')
+
+    connection = get_connection()
+    try:
+        result = deliver(connection, email, priority)
+    finally:
+        connection.close()
+    if not result.sent:
+        raise RuntimeError(result.error)
@@ -1,3 +1,1606 @@
-from django.test import TestCase
+import email
+import email.policy
+import io
+import base64
+import os
+import smtplib
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from datetime import date, datetime, time, timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.core import mail
+from django.core.exceptions import ImproperlyConfigured
+from django.core.mail import EmailMessage
+from django.db import DatabaseError
+from django.db.models import F
+from django.template import TemplateSyntaxError
+from django.test import (
+    SimpleTestCase, TestCase, TransactionTestCase, override_settings,
+)
+from django.utils import timezone
+
+from contacts.models import Contacts, ContactsList
+from logs.models import DeliveryLog, Logging
+from logs.service import DeliveryLogBuffer
+from mailing.benchmarks import (
+    get_private_key, make_mailing, make_recipients, seed_mailing,
+)
+from mailing.control import cancel_run, is_stopped, pause_run, resume_run
+from mailing.cron import run_mailing
+from mailing.recipients import (
+    RECIPIENT_FIELDS, Recipient, RecipientDeduplicator, get_domain_backlog,
+    iter_recipients,
+)
+from mailing.rendering import CompiledMailing
+from mailing.fairshare import (
+    FairScheduler, LocalTenantCounters, RedisTenantCounters,
+)
+from mailing.forms import MailingForm
+from mailing.locks import (
+    LeaseLock, LocalLocks, MailingLock, RedisLocks, get_lock_backend,
+)
+from mailing.mime import MessageTemplate
+from mailing.models import (
+    PRIORITY_CAMPAIGN, PRIORITY_TRANSACTIONAL, BackgroundTask, Mailing,
+    MailingRun, MailingSettings, OutboxMessage, SnapshotRange,
+    SnapshotRecipient,
+)
+from mailing.outbox import (
+    claim_batch, enqueue_mailing, enqueue_retries, finish_runs, send_batch,
+)
+from mailing.ratelimit import (
+    LocalTokenBuckets, RateLimiter, RedisTokenBuckets,
+)
+from mailing.runner import send_by_domain, send_in_order
+from mailing.scheduler import MailingScheduler
+from mailing.sender import (
+    DeliveryResult, build_message, deliver_all, send_in_chunks,
+)
+from mailing.signing import DkimSigner, SignedMessage, dkim, get_signer
+from mailing.service import get_next_run
+from mailing.snapshot import claim_range, send_range, snapshot_mailing
+from mailing.smtp_async import AsyncEngine, send_in_chunks_async
+from mailing.smtp_sink import SMTPSink
+from mailing.spool import (
+    SpooledMessage, get_spool_dir, read_spool_file, ship_run, ship_spool,
+    spool_run, write_spool_files,
+)
+from mailing.suppression import SuppressionSet
+from mailing.tasks import execute_task, get_task, purge_tasks, task
+from users.models import User
+
+# Cache settings selecting the Redis backends, no server is contacted
+REDIS_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://127.0.0.1:6379',
+    },
+}
+LOCAL_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
+
+class RecordingConnection:
+    """
+    Email backend recording how often it is opened and what it sends.
+    """
+
+    def __init__(self, refused=(), code=550):
+        self.refused = set(refused)
+        self.code = code
+        self.opened = 0
+        self.is_open = False
+        self.sent = []
+
+    def open(self):
+        if not self.is_open:
+            self.opened += 1
+            self.is_open = True
+
+    def close(self):
+        self.is_open = False
+
+    def send_messages(self, messages):
+        for message in messages:
+            for email in message.recipients():
+                if email in self.refused:
+                    raise smtplib.SMTPRecipientsRefused(
+                        {email: (self.code, b'Refused')}
+                    )
+            self.sent.append(message)
+        return len(messages)
+
+
+@override_settings(MAILING_RATE_LIMIT_ENABLED=False)
+class SendInChunksTestCase(SimpleTestCase):
+    """
+    Tests for sending a mailing in chunks over one connection.
+    """
+
+    def test_chunks_share_one_connection(self):
+        connection = RecordingConnection()
+        reports = list(send_in_chunks(
+            make_mailing(), make_recipients(25), chunk_size=10,
+            connection=connection,
+        ))
+        self.assertEqual([report.size for report in reports], [10, 10, 5])
+        self.assertEqual([report.sent for report in reports], [10, 10, 5])
+        self.assertEqual(reports[-1].last_recipient.pk, 24)
+        self.assertEqual(connection.opened, 1)
+        self.assertFalse(connection.is_open)
+        self.assertEqual(len(connection.sent), 25)
+        self.assertEqual(
+            connection.sent[3].to, ['contact3@example.com']
+        )
+        self.assertIn('contact3@example.com', connection.sent[3].subject)
+
+    def test_failure_does_not_abort_the_run(self):
+        connection = RecordingConnection(refused=['contact3@example.com'])
+        reports = list(send_in_chunks(
+            make_mailing(), make_recipients(10), chunk_size=5,
+            connection=connection,
+        ))
+        self.assertEqual([report.sent for report in reports], [4, 5])
+        recipient, result = reports[0].results[3]
+        self.assertEqual(recipient.pk, 3)
+        self.assertFalse(result.sent)
+        self.assertEqual(result.smtp_code, 550)
+        self.assertEqual(connection.opened, 2)
+        self.assertEqual(len(connection.sent), 9)
+
+
+class IterRecipientsTestCase(TestCase):
+    """
+    Tests for streaming the recipients of a mailing.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(email='owner@example.com')
+        self.mailing = seed_mailing(self.user, 7)
+
+    def test_streams_rows_in_pk_order_with_one_query(self):
+        with self.assertNumQueries(1):
+            rows = list(iter_recipients(self.mailing, chunk_size=2))
+        self.assertEqual(len(rows), 7)
+        self.assertEqual(rows[0]._fields, RECIPIENT_FIELDS)
+        self.assertEqual(
+            [row.pk for row in rows], sorted(row.pk for row in rows)
+        )
+
+    def test_after_and_domain(self):
+        rows = list(iter_recipients(self.mailing))
+        after = list(iter_recipients(self.mailing, after=rows[2].pk))
+        self.assertEqual(after, rows[3:])
+        domain = list(iter_recipients(self.mailing, domain='example.org'))
+        self.assertEqual(
+            [row.email for row in domain],
+            ['contact1@example.org', 'contact4@example.org'],
+        )
+
+    def test_mailing_without_list(self):
+        self.mailing.contact_list = None
+        self.assertEqual(list(iter_recipients(self.mailing)), [])
+
+
+class GetNextRunTestCase(SimpleTestCase):
+    """
+    Tests for computing the next run of a mailing schedule.
+    """
+
+    def make_settings(self, **kwargs):
+        defaults = {
+            'mailing_periods': MailingSettings.MAILING_DAILY,
+            'mailing_time': time(10, 0),
+            'start_date': date(2023, 9, 1),
+            'end_date': date(2023, 12, 31),
+        }
+        defaults.update(kwargs)
+        return MailingSettings(**defaults)
+
+    def aware(self, *args):
+        return timezone.make_aware(datetime(*args))
+
+    def test_daily_same_day(self):
+        mailing_settings = self.make_settings()
+        self.assertEqual(
+            get_next_run(mailing_settings, self.aware(2023, 9, 16, 9, 0)),
+            self.aware(2023, 9, 16, 10, 0)
+        )
+
+    def test_daily_next_day(self):
+        mailing_settings = self.make_settings()
+        self.assertEqual(
+            get_next_run(mailing_settings, self.aware(2023, 9, 16, 10, 0)),
+            self.aware(2023, 9, 17, 10, 0)
+        )
+
+    def test_not_before_start_date(self):
+        mailing_settings = self.make_settings(start_date=date(2023, 10, 1))
+        self.assertEqual(
+            get_next_run(mailing_settings, self.aware(2023, 9, 16, 9, 0)),
+            self.aware(2023, 10, 1, 10, 0)
+        )
+
+    def test_weekly(self):
+        # 2023-09-16 is a Saturday, 1 is Monday in crontab numbering
+        mailing_settings = self.make_settings(
+            mailing_periods=MailingSettings.MAILING_WEEKLY,
+            mailing_week_day_num=1,
+        )
+        self.assertEqual(
+            get_next_run(mailing_settings, self.aware(2023, 9, 16, 12, 0)),
+            self.aware(2023, 9, 18, 10, 0)
+        )
+
+    def test_weekly_sunday(self):
+        mailing_settings = self.make_settings(
+            mailing_periods=MailingSettings.MAILING_WEEKLY,
+            mailing_week_day_num=0,
+        )
+        self.assertEqual(
+            get_next_run(mailing_settings, self.aware(2023, 9, 17, 11, 0)),
+            self.aware(2023, 9, 24, 10, 0)
+        )
+
+    def test_monthly_clamped_to_month_end(self):
+        mailing_settings = self.make_settings(
+            mailing_periods=MailingSettings.MAILING_MONTHLY,
+            start_date=date(2023, 8, 31),
+        )
+        self.assertEqual(
+            get_next_run(mailing_settings, self.aware(2023, 9, 16, 12, 0)),
+            self.aware(2023, 9, 30, 10, 0)
+        )
+        self.assertEqual(
+            get_next_run(mailing_settings, self.aware(2023, 9, 30, 10, 0)),
+            self.aware(2023, 10, 31, 10, 0)
+        )
+
+    def test_after_end_date(self):
+        mailing_settings = self.make_settings()
+        self.assertIsNone(
+            get_next_run(mailing_settings, self.aware(2023, 12, 31, 10, 0))
+        )
+
+    def test_incomplete_schedule(self):
+        mailing_settings = self.make_settings(mailing_time=None)
+        self.assertIsNone(
+            get_next_run(mailing_settings, self.aware(2023, 9, 16, 9, 0))
+        )
+
+
+class CompiledMailingTestCase(SimpleTestCase):
+    """
+    Tests for rendering the merge fields of a mailing.
+    """
+
+    def render(self, content):
+        compiled = CompiledMailing(make_mailing('Тема', content))
+        return compiled.render(Recipient(1, 'a@example.com', '+7900'))[1]
+
+    def test_merge_fields_and_filters(self):
+        self.assertEqual(
+            self.render('{{ email }}, {{ telephone }}'),
+            'a@example.com, +7900',
+        )
+        self.assertEqual(
+            self.render('{% if telephone %}{{ email|upper }}{% endif %}'),
+            'A@EXAMPLE.COM',
+        )
+
+    def test_tags_outside_merge_fields_are_rejected(self):
+        for content in (
+            '{% debug %}',
+            '{% load static %}',
+            '{% include "base.html" %}',
+            '{% url "mailing:mailing_list" %}',
+        ):
+            with self.subTest(content=content):
+                with self.assertRaises(TemplateSyntaxError):
+                    CompiledMailing.check(content)
+
+        form = MailingForm(data={
+            'title': 'debug',
+            'message_title': 'Тема',
+            'message_content': '{% debug %}',
+        })
+        self.assertFalse(form.is_valid())
+        self.assertIn('message_content', form.errors)
+
+
+class MessageTemplateTestCase(SimpleTestCase):
+    """
+    Tests for splicing recipients into a MIME message encoded once.
+    """
+
+    def parse(self, message):
+        return email.message_from_bytes(
+            message.message().as_bytes(linesep='\r\n'),
+            policy=email.policy.default,
+        )
+
+    def test_recipient_headers_are_spliced_in(self):
+        template = MessageTemplate('Новости', 'Текст рассылки.')
+        first = self.parse(template.build('a@example.com'))
+        second = self.parse(template.build('b@example.com'))
+        self.assertEqual(first['To'], 'a@example.com')
+        self.assertEqual(second['To'], 'b@example.com')
+        self.assertEqual(first['Subject'], 'Новости')
+        self.assertEqual(first.get_content().strip(), 'Текст рассылки.')
+        self.assertNotEqual(first['Message-ID'], second['Message-ID'])
+        self.assertEqual(
+            [name for name in first.keys() if name == 'To'], ['To']
+        )
+
+    def test_body_is_encoded_once(self):
+        with mock.patch(
+            'mailing.mime.EmailMessage.message', autospec=True,
+            side_effect=EmailMessage.message,
+        ) as encode:
+            template = MessageTemplate('Новости', 'Текст рассылки.')
+            for number in range(3):
+                template.build(f'contact{number}@example.com').message()
+        self.assertEqual(encode.call_count, 1)
+
+    @override_settings(
+        MAILING_UNSUBSCRIBE_URL='https://example.com/unsubscribe/{token}/'
+    )
+    @mock.patch(
+        'mailing.mime.signing.dumps',
+        side_effect=lambda email, salt: email.upper(),
+    )
+    def test_unsubscribe_link_per_recipient(self, dumps):
+        template = MessageTemplate('Новости', 'Текст рассылки.')
+        message = self.parse(template.build('a@example.com'))
+        self.assertEqual(
+            message['List-Unsubscribe'],
+            '<https://example.com/unsubscribe/A@EXAMPLE.COM/>',
+        )
+
+    def test_batch_recipients_are_undisclosed(self):
+        template = MessageTemplate('Новости', 'Текст рассылки.')
+        batch = template.build_batch(['a@example.com', 'b@example.com'])
+        self.assertEqual(
+            batch.recipients(), ['a@example.com', 'b@example.com']
+        )
+        message = self.parse(batch)
+        self.assertEqual(message['To'], 'undisclosed-recipients:;')
+        self.assertNotIn('a@example.com', str(message))
+
+
+class DkimSigningTestCase(SimpleTestCase):
+    """
+    Tests for signing outgoing mail with DKIM.
+    """
+
+    def get_dns_record(self, private_key):
+        public_key = subprocess.run(
+            ('openssl', 'rsa', '-pubout', '-outform', 'DER'),
+            input=private_key,
+            check=True,
+            capture_output=True,
+        ).stdout
+        return b'v=DKIM1; k=rsa; p=' + base64.b64encode(public_key)
+
+    @override_settings(DKIM_PRIVATE_KEY_PATH=None)
+    def test_signing_is_disabled_without_a_key(self):
+        self.assertIsNone(get_signer())
+
+    @override_settings(DKIM_PRIVATE_KEY_PATH='/nonexistent.pem')
+    @mock.patch('mailing.signing.dkim', None)
+    def test_key_without_dkimpy_is_an_error(self):
+        with self.assertRaises(ImportError):
+            get_signer()
+
+    @mock.patch('mailing.signing._signer', None)
+    @mock.patch('mailing.signing.dkim', mock.Mock())
+    def test_concurrent_threads_share_one_signer(self):
+        def create_signer(*args):
+            # A slow start of the pool lets the threads race
+            threading.Event().wait(0.05)
+            return mock.Mock()
+
+        with tempfile.NamedTemporaryFile() as key_file, self.settings(
+            DKIM_PRIVATE_KEY_PATH=key_file.name
+        ), mock.patch(
+            'mailing.signing.DkimSigner', side_effect=create_signer
+        ) as signer_class, ThreadPoolExecutor(4) as executor:
+            signers = list(executor.map(
+                lambda number: get_signer(), range(4)
+            ))
+        self.assertEqual(signer_class.call_count, 1)
+        self.assertEqual(len(set(map(id, signers))), 1)
+
+    def test_signed_message_is_not_encoded_again(self):
+        original = build_message(
+            CompiledMailing(make_mailing()),
+            Recipient(1, 'a@example.com', ''),
+        )
+        message = SignedMessage(original, b'DKIM-Signature: x\r\n')
+        self.assertEqual(message.recipients(), ['a@example.com'])
+        self.assertEqual(
+            message.message().as_bytes(linesep='\r\n'),
+            b'DKIM-Signature: x\r\n',
+        )
+
+    @skipUnless(dkim, 'dkimpy is not installed')
+    @override_settings(DKIM_PRIVATE_KEY_PATH=None)
+    def test_signatures_verify_in_order(self):
+        private_key = get_private_key()
+        record = self.get_dns_record(private_key)
+        compiled = CompiledMailing(make_mailing())
+        messages = [
+            build_message(compiled, recipient)
+            for recipient in make_recipients(5)
+        ]
+        signer = DkimSigner(private_key, 'test', 'example.com', workers=2)
+        try:
+            signed = list(signer.sign_messages(messages))
+        finally:
+            signer.close()
+
+        for original, message in zip(messages, signed):
+            self.assertEqual(message.to, original.to)
+            data = message.message().as_bytes(linesep='\r\n')
+            self.assertIn(original.to[0].encode(), data)
+            self.assertTrue(dkim.verify(
+                data, dnsfunc=lambda name, timeout=5: record
+            ))
+
+
+class MailingSchedulerTestCase(TestCase):
+    """
+    Tests for dispatching due mailings in-process.
+    """
+
+    def make_mailing(self, next_run_at):
+        mailing = Mailing.objects.create(title='scheduled')
+        mailing_settings = MailingSettings.objects.create(
+            mailing=mailing,
+            mailing_periods=MailingSettings.MAILING_DAILY,
+            status=MailingSettings.MAILING_RUNNING,
+            mailing_time=time(10, 0),
+            start_date=date(2023, 1, 1),
+            end_date=date(2099, 12, 31),
+        )
+        MailingSettings.objects.filter(pk=mailing_settings.pk).update(
+            next_run_at=next_run_at
+        )
+        return mailing
+
+    @mock.patch('mailing.scheduler.run_mailing')
+    def test_due_mailing_is_dispatched_once(self, run_mailing):
+        now = timezone.now()
+        fire_time = now - timedelta(minutes=1)
+        due = self.make_mailing(fire_time)
+        self.make_mailing(now + timedelta(hours=1))
+
+        scheduler = MailingScheduler(reload_interval=60)
+        other = MailingScheduler(reload_interval=60)
+        scheduler.reload(now)
+        other.reload(now)
+        self.assertEqual(len(scheduler._heap), 1)
+
+        self.assertEqual(scheduler.run_pending(now), 1)
+        self.assertEqual(other.run_pending(now), 0)
+        run_mailing.assert_called_once_with(due.pk, slot=fire_time)
+        next_run_at = MailingSettings.objects.get(mailing=due).next_run_at
+        self.assertGreater(next_run_at, now)
+
+    @mock.patch('mailing.scheduler.run_mailing')
+    def test_unpaused_runs_are_resumed(self, run_mailing):
+        now = timezone.now()
+        resumed = self.make_mailing(now + timedelta(hours=1))
+        paused = self.make_mailing(now + timedelta(hours=1))
+        MailingRun.objects.create(
+            mailing=resumed, status=MailingRun.RUN_SENDING
+        )
+        MailingRun.objects.create(
+            mailing=paused, status=MailingRun.RUN_SENDING, paused=True
+        )
+        MailingRun.objects.create(mailing=paused, status=MailingRun.RUN_DONE)
+
+        scheduler = MailingScheduler(reload_interval=60)
+        self.assertEqual(scheduler.resume_runs(now), 1)
+        run_mailing.assert_called_once_with(resumed.pk, slot=now, resume=True)
+
+    def test_seconds_until_next(self):
+        now = timezone.now()
+        scheduler = MailingScheduler(reload_interval=60, max_sleep=30)
+        self.assertEqual(scheduler.seconds_until_next(now), 30)
+        self.make_mailing(now + timedelta(seconds=10))
+        scheduler.reload(now)
+        self.assertEqual(scheduler.seconds_until_next(now), 10)
+
+
+class OutboxTestCase(TestCase):
+    """
+    Tests for claiming and finishing outbox messages.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(email='owner@example.com')
+        self.run = enqueue_mailing(seed_mailing(self.user, 5))
+
+    def test_claimed_messages_are_leased(self):
+        first = claim_batch(3, lease=60)
+        second = claim_batch(10, lease=60)
+        self.assertEqual(len(first), 3)
+        self.assertEqual(len(second), 2)
+        self.assertFalse(
+            {message.pk for message in first}
+            & {message.pk for message in second}
+        )
+        self.assertEqual(claim_batch(10, lease=60), [])
+
+    def test_failed_enqueue_leaves_no_run(self):
+        mailing = seed_mailing(self.user, 5)
+        with mock.patch.object(
+            OutboxMessage.objects, 'bulk_create',
+            side_effect=[[], DatabaseError('Connection lost')],
+        ), self.assertRaises(DatabaseError):
+            enqueue_mailing(mailing, chunk_size=3)
+        self.assertFalse(mailing.runs.exists())
+
+    def test_expired_lease_is_claimed_again(self):
+        claimed = claim_batch(10, lease=60)
+        OutboxMessage.objects.filter(pk=claimed[0].pk).update(
+            locked_until=timezone.now() - timedelta(seconds=1)
+        )
+        self.assertEqual(
+            [message.pk for message in claim_batch(10, lease=60)],
+            [claimed[0].pk],
+        )
+
+    @override_settings(
+        MAILING_OUTBOX_LEASE_BATCH=2, MAILING_RATE_LIMIT_ENABLED=False
+    )
+    def test_reclaimed_messages_are_not_sent_twice(self):
+        claimed = claim_batch(10, lease=60)
+        reclaimed = []
+
+        def deliver_and_expire(*args):
+            if not reclaimed:
+                # The rest of the batch is reclaimed by another worker
+                # while the first slice is sent
+                OutboxMessage.objects.filter(
+                    pk__in=[message.pk for message in claimed[2:]]
+                ).update(locked_until=timezone.now() - timedelta(seconds=1))
+                reclaimed.extend(claim_batch(10, lease=60))
+            return deliver_all(*args)
+
+        connection = RecordingConnection()
+        with mock.patch(
+            'mailing.outbox.deliver_all', side_effect=deliver_and_expire
+        ), DeliveryLogBuffer() as delivery_log:
+            send_batch(connection, delivery_log, claimed)
+
+        self.assertEqual(len(connection.sent), 2)
+        self.assertEqual(len(reclaimed), 3)
+        self.assertEqual(
+            self.run.messages.filter(
+                status=OutboxMessage.STATUS_SENT
+            ).count(),
+            2,
+        )
+        self.assertEqual(
+            set(self.run.messages.filter(
+                status=OutboxMessage.STATUS_PENDING
+            ).values_list('locked_until', flat=True)),
+            {reclaimed[0].locked_until},
+        )
+        self.run.refresh_from_db()
+        self.assertEqual(self.run.sent, 2)
+
+    def test_run_is_finished_once_nothing_is_pending(self):
+        messages = self.run.messages.order_by('pk')
+        OutboxMessage.objects.filter(
+            pk__in=list(messages.values_list('pk', flat=True)[:4])
+        ).update(status=OutboxMessage.STATUS_SENT)
+        finish_runs([self.run.pk])
+        self.run.refresh_from_db()
+        self.assertEqual(self.run.status, MailingRun.RUN_QUEUED)
+
+        messages.filter(status=OutboxMessage.STATUS_PENDING).update(
+            status=OutboxMessage.STATUS_FAILED
+        )
+        MailingRun.objects.filter(pk=self.run.pk).update(sent=4)
+        finish_runs([self.run.pk])
+        self.run.refresh_from_db()
+        self.assertEqual(self.run.status, MailingRun.RUN_DONE)
+        self.assertEqual(
+            Logging.objects.get(mailing=self.run.mailing).attempt_status,
+            Logging.ATTEMPT_ERROR,
+        )
+
+
+class ControlRunTestCase(TestCase):
+    """
+    Tests for pausing, resuming and cancelling runs.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(email='owner@example.com')
+        self.run = enqueue_mailing(seed_mailing(self.user, 3))
+
+    def test_paused_run_is_not_claimed(self):
+        self.assertTrue(pause_run(self.run.pk))
+        self.assertTrue(is_stopped(self.run.pk))
+        self.assertEqual(claim_batch(10, lease=60), [])
+
+        self.assertTrue(resume_run(self.run.pk))
+        self.assertFalse(is_stopped(self.run.pk))
+        self.assertEqual(len(claim_batch(10, lease=60)), 3)
+
+    def test_cancelled_run_drops_its_messages(self):
+        pause_run(self.run.pk)
+        self.assertEqual(cancel_run(self.run.pk), (True, 3, 0))
+        self.assertTrue(is_stopped(self.run.pk))
+        self.assertFalse(resume_run(self.run.pk))
+        self.assertFalse(pause_run(self.run.pk))
+        self.assertEqual(cancel_run(self.run.pk), (False, 0, 0))
+        self.assertEqual(claim_batch(10, lease=60), [])
+        self.run.refresh_from_db()
+        self.assertEqual(self.run.status, MailingRun.RUN_CANCELLED)
+        self.assertFalse(self.run.paused)
+
+
+@override_settings(
+    MAILING_RATE_LIMIT_ENABLED=False,
+    MAILING_USE_OUTBOX=False,
+    MAILING_USE_SNAPSHOT=False,
+    MAILING_USE_SPOOL=False,
+    MAILING_GROUP_BY_DOMAIN=False,
+    MAILING_ENGINE='smtp',
+)
+class CheckpointTestCase(TestCase):
+    """
+    Tests for checkpointing in-process runs and resuming them.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(email='owner@example.com')
+        self.mailing = seed_mailing(self.user, 6)
+        self.contacts = list(
+            self.mailing.contact_list.contacts.order_by('pk')
+        )
+
+    def make_run(self, **kwargs):
+        return MailingRun.objects.create(
+            mailing=self.mailing, status=MailingRun.RUN_SENDING, **kwargs
+        )
+
+    def sent_to(self):
+        return [email for message in mail.outbox for email in message.to]
+
+    @mock.patch('mailing.runner.is_stopped', return_value=True)
+    def test_checkpoint_after_every_chunk(self, is_stopped):
+        run = self.make_run()
+        with redirect_stdout(io.StringIO()):
+            send_in_order(run, chunk_size=4)
+        run.refresh_from_db()
+        self.assertEqual(run.last_contact_id, self.contacts[3].pk)
+        self.assertEqual((run.total, run.sent), (4, 4))
+
+        is_stopped.return_value = False
+        with redirect_stdout(io.StringIO()):
+            send_in_order(run, chunk_size=4)
+        run.refresh_from_db()
+        self.assertEqual(run.last_contact_id, self.contacts[-1].pk)
+        self.assertEqual((run.total, run.sent), (6, 6))
+        self.assertEqual(
+            self.sent_to(), [contact.email for contact in self.contacts]
+        )
+
+    def test_interrupted_run_is_resumed(self):
+        run = self.make_run(
+            last_contact_id=self.contacts[2].pk, total=3, sent=3
+        )
+        with redirect_stdout(io.StringIO()):
+            run_mailing(self.mailing.pk, slot=timezone.now())
+        self.assertEqual(
+            self.sent_to(), [contact.email for contact in self.contacts[3:]]
+        )
+        self.assertEqual(self.mailing.runs.count(), 1)
+        run.refresh_from_db()
+        self.assertEqual(run.status, MailingRun.RUN_DONE)
+        self.assertEqual((run.total, run.sent), (6, 6))
+
+    def test_async_run_paused_mid_stream_is_not_sent_twice(self):
+        run = self.make_run()
+        with SMTPSink(latency=0.05) as sink, self.settings(
+            MAILING_ENGINE='async',
+            EMAIL_HOST='127.0.0.1',
+            EMAIL_PORT=sink.port,
+            EMAIL_HOST_USER='',
+            EMAIL_HOST_PASSWORD='',
+            EMAIL_USE_TLS=False,
+            EMAIL_USE_SSL=False,
+            MAILING_ASYNC_SESSIONS=2,
+            MAILING_ASYNC_QUEUE_SIZE=8,
+        ), mock.patch(
+            'mailing.runner.is_stopped', side_effect=[False, True]
+        ) as is_stopped, redirect_stdout(io.StringIO()):
+            send_in_order(run, chunk_size=2)
+            run.refresh_from_db()
+            self.assertEqual(run.last_contact_id, self.contacts[3].pk)
+            stopped_at = sink.messages
+
+            is_stopped.side_effect = None
+            is_stopped.return_value = False
+            send_in_order(run, chunk_size=2)
+        self.assertEqual(stopped_at, 4)
+        self.assertEqual(sink.messages, 6)
+
+    def test_resume_never_starts_a_run(self):
+        with redirect_stdout(io.StringIO()):
+            run_mailing(self.mailing.pk, slot=timezone.now(), resume=True)
+        self.assertFalse(self.mailing.runs.exists())
+        self.assertEqual(mail.outbox, [])
+
+    def test_resumed_run_is_sent_by_scheduler(self):
+        run = self.make_run(
+            last_contact_id=self.contacts[2].pk, total=3, sent=3, paused=True
+        )
+        scheduler = MailingScheduler(reload_interval=60)
+        with redirect_stdout(io.StringIO()):
+            scheduler.resume_runs()
+        self.assertEqual(mail.outbox, [])
+
+        self.assertTrue(resume_run(run.pk))
+        with redirect_stdout(io.StringIO()):
+            self.assertEqual(scheduler.resume_runs(), 1)
+        self.assertEqual(
+            self.sent_to(), [contact.email for contact in self.contacts[3:]]
+        )
+        run.refresh_from_db()
+        self.assertEqual(run.status, MailingRun.RUN_DONE)
+
+    def test_retries_drained_while_sending_finish_the_run(self):
+        def drain(run, failures):
+            # A worker sends the retries before the run stops sending
+            retries = enqueue_retries(run, failures)
+            sent = run.messages.filter(
+                status=OutboxMessage.STATUS_PENDING
+            ).update(status=OutboxMessage.STATUS_SENT)
+            MailingRun.objects.filter(pk=run.pk).update(
+                sent=F('sent') + sent
+            )
+            finish_runs([run.pk])
+            return retries
+
+        connection = RecordingConnection(
+            refused=[self.contacts[1].email], code=451
+        )
+        with mock.patch(
+            'mailing.sender.get_connection', return_value=connection
+        ), mock.patch('mailing.runner.enqueue_retries', side_effect=drain):
+            with redirect_stdout(io.StringIO()):
+                run_mailing(self.mailing.pk, slot=timezone.now())
+
+        run = self.mailing.runs.get()
+        self.assertEqual(run.status, MailingRun.RUN_DONE)
+        self.assertEqual((run.total, run.sent), (6, 6))
+        self.assertEqual(
+            Logging.objects.get(mailing=self.mailing).attempt_status,
+            Logging.ATTEMPT_OK,
+        )
+
+
+@override_settings(MAILING_RATE_LIMIT_ENABLED=False, MAILING_ENGINE='smtp')
+class SnapshotTestCase(TestCase):
+    """
+    Tests for snapshotting runs and sending them in ranges.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(email='owner@example.com')
+        self.mailing = seed_mailing(self.user, 5)
+        contact = Contacts.objects.create(
+            email=' Contact0@Example.com',
+            telephone='+70000000000',
+            user=self.user,
+            list=self.mailing.contact_list,
+        )
+        ContactsList.objects.create(
+            contact=contact, list=self.mailing.contact_list
+        )
+
+    def snapshot(self):
+        with redirect_stdout(io.StringIO()):
+            return snapshot_mailing(self.mailing, range_size=2)
+
+    def test_snapshot_is_split_into_ranges(self):
+        run, size, ranges = self.snapshot()
+        self.assertEqual((size, ranges), (5, 3))
+        self.assertEqual(
+            list(run.ranges.order_by('pk').values_list(
+                'first_seq', 'last_seq', 'next_seq'
+            )),
+            [(1, 2, 1), (3, 4, 3), (5, 5, 5)],
+        )
+        seqs = SnapshotRecipient.objects.filter(run=run).order_by('seq')
+        self.assertEqual(
+            list(seqs.values_list('seq', flat=True)), [1, 2, 3, 4, 5]
+        )
+
+    @override_settings(MAILING_DEDUPLICATE_IN_DB=False)
+    def test_snapshot_is_deduplicated(self):
+        run, size, ranges = self.snapshot()
+        self.assertEqual(size, 5)
+        emails = SnapshotRecipient.objects.filter(
+            run=run
+        ).values_list('email', flat=True)
+        self.assertEqual(
+            len({email.strip().lower() for email in emails}), 5
+        )
+
+    def test_claim_range_skips_leased_and_paused_runs(self):
+        run, size, ranges = self.snapshot()
+        first = claim_range()
+        second = claim_range()
+        self.assertNotEqual(first.pk, second.pk)
+        self.assertIsNotNone(first.locked_until)
+
+        SnapshotRange.objects.filter(pk=first.pk).update(
+            locked_until=timezone.now() - timedelta(seconds=1)
+        )
+        self.assertEqual(claim_range().pk, first.pk)
+
+        MailingRun.objects.filter(pk=run.pk).update(paused=True)
+        self.assertIsNone(claim_range())
+
+    def test_send_range(self):
+        run, size, ranges = self.snapshot()
+        snapshot_range = claim_range()
+        with redirect_stdout(io.StringIO()):
+            send_range(snapshot_range, SuppressionSet([], 0), chunk_size=1)
+        snapshot_range.refresh_from_db()
+        self.assertEqual(snapshot_range.status, SnapshotRange.STATUS_DONE)
+        self.assertEqual(snapshot_range.next_seq, 3)
+        self.assertIsNone(snapshot_range.locked_until)
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_range_taken_over_stops(self):
+        run, size, ranges = self.snapshot()
+        snapshot_range = claim_range()
+        # Another worker claimed the range once the lease expired
+        SnapshotRange.objects.filter(pk=snapshot_range.pk).update(
+            locked_until=timezone.now() + timedelta(hours=1)
+        )
+        with redirect_stdout(io.StringIO()):
+            send_range(snapshot_range, SuppressionSet([], 0), chunk_size=1)
+        snapshot_range.refresh_from_db()
+        self.assertEqual(snapshot_range.status, SnapshotRange.STATUS_PENDING)
+        self.assertEqual(snapshot_range.next_seq, 1)
+        self.assertEqual(len(mail.outbox), 1)
+        run.refresh_from_db()
+        self.assertEqual((run.total, run.sent), (0, 0))
+
+
+class DomainPartitionTestCase(TransactionTestCase):
+    """
+    Tests for sending recipients partitioned by email domain.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(email='owner@example.com')
+        self.mailing = seed_mailing(self.user, 7)
+        self.contacts = list(
+            self.mailing.contact_list.contacts.order_by('pk')
+        )
+
+    def test_backlog_largest_domain_first(self):
+        backlog = get_domain_backlog(self.mailing)
+        self.assertEqual(
+            backlog, {'example.com': 3, 'example.org': 2, 'example.net': 2}
+        )
+        self.assertEqual(next(iter(backlog)), 'example.com')
+        self.assertEqual(
+            get_domain_backlog(
+                self.mailing, {'example.com': self.contacts[3].pk}
+            )['example.com'],
+            1,
+        )
+
+    def test_every_domain_keeps_its_checkpoint(self):
+        run = MailingRun.objects.create(
+            mailing=self.mailing,
+            status=MailingRun.RUN_SENDING,
+            domain_checkpoints={'example.com': self.contacts[3].pk},
+        )
+        with redirect_stdout(io.StringIO()):
+            send_by_domain(run, chunk_size=1, workers=3, engine='smtp')
+
+        self.assertEqual(
+            sorted(email for message in mail.outbox for email in message.to),
+            sorted(
+                contact.email for number, contact in enumerate(self.contacts)
+                if number not in (0, 3)
+            ),
+        )
+        run.refresh_from_db()
+        self.assertEqual(run.domain_checkpoints, {
+            'example.com': self.contacts[6].pk,
+            'example.org': self.contacts[4].pk,
+            'example.net': self.contacts[5].pk,
+        })
+        self.assertEqual((run.total, run.sent), (5, 5))
+
+
+class DeliveryLogBufferTestCase(TestCase):
+    """
+    Tests for writing delivery logs in buffered bulk inserts.
+    """
+
+    def test_rows_are_written_in_batches(self):
+        run = MailingRun.objects.create(mailing=Mailing.objects.create())
+        results = [
+            DeliveryResult(True, None, 250, 1.5),
+            DeliveryResult(False, 'Mailbox full', 452, 2.5),
+        ]
+        with DeliveryLogBuffer(size=3) as delivery_log:
+            with self.assertNumQueries(2):
+                for number in range(7):
+                    delivery_log.add(
+                        run.pk, None, f'contact{number}@example.com',
+                        results[number % 2],
+                    )
+            self.assertEqual(DeliveryLog.objects.count(), 6)
+        self.assertEqual(run.deliveries.count(), 7)
+
+        failed = run.deliveries.get(email='contact1@example.com')
+        self.assertEqual(
+            (failed.smtp_code, failed.latency, failed.error),
+            (452, 2.5, 'Mailbox full'),
+        )
+
+
+@override_settings(MAILING_RATE_LIMIT_ENABLED=False)
+class AsyncEngineTestCase(SimpleTestCase):
+    """
+    Tests for delivering mailings with the asyncio engine.
+    """
+
+    def make_engine(self, port):
+        return AsyncEngine(
+            sessions=4,
+            queue_size=8,
+            host='127.0.0.1',
+            port=port,
+            username='',
+            password='',
+            use_tls=False,
+            use_ssl=False,
+        )
+
+    def test_delivers_chunks_in_order(self):
+        with SMTPSink() as sink, self.make_engine(sink.port) as engine:
+            reports = list(send_in_chunks_async(
+                make_mailing(), make_recipients(25), chunk_size=10,
+                engine=engine,
+            ))
+        self.assertEqual([report.number for report in reports], [1, 2, 3])
+        self.assertEqual([report.sent for report in reports], [10, 10, 5])
+        self.assertEqual(reports[-1].last_recipient.pk, 24)
+        self.assertEqual(sink.messages, 25)
+        self.assertEqual(sink.recipients, 25)
+
+    def test_connection_failure_is_reported(self):
+        sink = SMTPSink()
+        host, port = sink.start()
+        sink.stop()
+        with self.make_engine(port) as engine:
+            reports = list(send_in_chunks_async(
+                make_mailing(), make_recipients(5), engine=engine
+            ))
+        self.assertEqual(reports[0].sent, 0)
+        self.assertTrue(all(
+            not result.sent and result.error
+            for recipient, result in reports[0].results
+        ))
+
+    def test_unexpected_error_fails_message(self):
+        rate_limiter = mock.Mock()
+        rate_limiter.wait.side_effect = [RuntimeError('Redis is down'), None]
+        with mock.patch('mailing.smtp_async.get_rate_limiter',
+                        return_value=rate_limiter), \
+                SMTPSink() as sink, self.make_engine(sink.port) as engine:
+            reports = list(send_in_chunks_async(
+                make_mailing(), make_recipients(2), chunk_size=1,
+                engine=engine,
+            ))
+        results = [report.results[0][1] for report in reports]
+        self.assertFalse(results[0].sent)
+        self.assertEqual(results[0].error, 'Redis is down')
+        self.assertTrue(results[1].sent)
+
+    def test_cancel_drops_queued_messages(self):
+        message = EmailMessage(
+            'Subject', 'Body', 'from@example.com', ['to@example.com']
+        )
+        with SMTPSink(latency=0.1) as sink:
+            engine = self.make_engine(sink.port)
+            engine.sessions = 1
+            engine.start()
+            futures = [engine.submit(message) for number in range(6)]
+            engine.cancel()
+            engine.stop()
+        results = [future.result()[0] for future in futures]
+        self.assertLess(sink.messages, 6)
+        self.assertEqual(
+            sum(result.error == 'Cancelled' for result in results),
+            6 - sink.messages,
+        )
+
+    def test_closed_stream_is_not_sent(self):
+        with SMTPSink(latency=0.05) as sink, self.settings(
+            EMAIL_HOST='127.0.0.1',
+            EMAIL_PORT=sink.port,
+            EMAIL_HOST_USER='',
+            EMAIL_HOST_PASSWORD='',
+            EMAIL_USE_TLS=False,
+            EMAIL_USE_SSL=False,
+            MAILING_ASYNC_SESSIONS=1,
+            MAILING_ASYNC_QUEUE_SIZE=8,
+        ):
+            reports = send_in_chunks_async(
+                make_mailing(), make_recipients(20), chunk_size=2
+            )
+            self.assertEqual(next(reports).sent, 2)
+            reports.close()
+        self.assertLess(sink.messages, 20)
+
+    def test_malformed_reply_fails_message(self):
+        with mock.patch('mailing.smtp_async.AsyncSMTPSession.send',
+                        side_effect=ValueError('Malformed reply')), \
+                SMTPSink() as sink, self.make_engine(sink.port) as engine:
+            reports = list(send_in_chunks_async(
+                make_mailing(), make_recipients(3), engine=engine
+            ))
+        self.assertEqual(reports[0].sent, 0)
+        self.assertTrue(all(
+            result.error == 'Malformed reply'
+            for recipient, result in reports[0].results
+        ))
+
+
+class SpoolTestCase(SimpleTestCase):
+    """
+    Tests for rendering messages into the spool.
+    """
+
+    def test_round_trip(self):
+        compiled = CompiledMailing(make_mailing())
+        recipients = list(make_recipients(3))
+        with tempfile.TemporaryDirectory() as directory:
+            for name in ('tmp', 'new'):
+                os.mkdir(os.path.join(directory, name))
+            self.assertEqual(
+                write_spool_files(directory, compiled, recipients), 3
+            )
+            self.assertEqual(os.listdir(os.path.join(directory, 'tmp')), [])
+            names = sorted(os.listdir(os.path.join(directory, 'new')))
+            envelope, data = read_spool_file(
+                os.path.join(directory, 'new', names[1])
+            )
+
+        self.assertEqual(envelope['to'], ['contact1@example.com'])
+        self.assertEqual(envelope['contacts'], [1])
+        self.assertIn(b'contact1@example.com', data)
+        self.assertNotIn(b'X-Mailcraft-Envelope', data)
+        message = SpooledMessage(envelope['from'], envelope['to'], data)
+        self.assertEqual(message.recipients(), ['contact1@example.com'])
+        self.assertEqual(message.message().as_bytes(linesep='\r\n'), data)
+
+
+class SpoolRunTestCase(TestCase):
+    """
+    Tests for rendering runs into the spool and shipping them.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(email='owner@example.com')
+        self.mailing = seed_mailing(self.user, 6)
+        self.contacts = list(
+            self.mailing.contact_list.contacts.order_by('pk')
+        )
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(MAILING_SPOOL_DIR=directory.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def make_run(self, status=MailingRun.RUN_SENDING, **kwargs):
+        return MailingRun.objects.create(
+            mailing=self.mailing, status=status, lock_token=1, **kwargs
+        )
+
+    def spool(self, run, fence=1):
+        with redirect_stdout(io.StringIO()):
+            return spool_run(run, chunk_size=4, fence=fence)
+
+    def test_run_is_spooled(self):
+        run = self.make_run()
+        self.assertEqual(self.spool(run), 6)
+        run.refresh_from_db()
+        self.assertEqual(run.status, MailingRun.RUN_SPOOLED)
+        self.assertEqual(run.last_contact_id, self.contacts[-1].pk)
+
+    def test_stale_process_does_not_mark_run_spooled(self):
+        run = self.make_run()
+        self.spool(run, fence=2)
+        run.refresh_from_db()
+        self.assertEqual(run.status, MailingRun.RUN_SENDING)
+        self.assertIsNone(run.last_contact_id)
+
+    @mock.patch('mailing.spool.is_stopped', return_value=False)
+    def test_stopped_run_is_not_marked_spooled(self, is_stopped):
+        paused = self.make_run(paused=True)
+        self.spool(paused)
+        cancelled = self.make_run(status=MailingRun.RUN_CANCELLED)
+        self.spool(cancelled)
+        paused.refresh_from_db()
+        cancelled.refresh_from_db()
+        self.assertEqual(paused.status, MailingRun.RUN_SENDING)
+        self.assertEqual(cancelled.status, MailingRun.RUN_CANCELLED)
+
+    def write_spool(self, run):
+        directory = get_spool_dir(run.pk)
+        for name in ('tmp', 'new'):
+            os.makedirs(os.path.join(directory, name))
+        write_spool_files(directory, CompiledMailing(self.mailing), [
+            Recipient(contact.pk, contact.email, contact.telephone)
+            for contact in self.contacts
+        ])
+        return directory
+
+    def test_files_after_checkpoint_are_not_shipped(self):
+        run = self.make_run(last_contact_id=self.contacts[2].pk)
+        directory = self.write_spool(run)
+        connection = RecordingConnection()
+        with mock.patch('mailing.spool.enqueue_retries'):
+            shipped, unreachable = ship_run(
+                connection, DeliveryLogBuffer(), run
+            )
+        self.assertEqual((shipped, unreachable), (3, False))
+        self.assertEqual(
+            [message.to[0] for message in connection.sent],
+            [contact.email for contact in self.contacts[:3]],
+        )
+        self.assertEqual(len(os.listdir(os.path.join(directory, 'new'))), 3)
+
+    @mock.patch('mailing.spool.enqueue_retries')
+    def test_run_shipped_by_another_shipper_is_skipped(self, enqueue_retries):
+        run = self.make_run(last_contact_id=self.contacts[-1].pk)
+        self.write_spool(run)
+        other = LeaseLock(f'spool:{run.pk}')
+        self.assertTrue(other.acquire())
+        connection = RecordingConnection()
+        try:
+            shipped = ship_spool(connection, DeliveryLogBuffer())
+        finally:
+            other.release()
+        self.assertEqual(shipped, (0, False))
+        self.assertEqual(connection.sent, [])
+
+        self.assertEqual(
+            ship_spool(connection, DeliveryLogBuffer()), (6, False)
+        )
+
+    @mock.patch('mailing.spool.enqueue_retries')
+    def test_shipper_stops_once_its_lock_is_lost(self, enqueue_retries):
+        run = self.make_run(last_contact_id=self.contacts[-1].pk)
+        directory = self.write_spool(run)
+        connection = RecordingConnection()
+        lock = mock.Mock(lost=True)
+        self.assertEqual(
+            ship_run(connection, DeliveryLogBuffer(), run, lock=lock),
+            (0, False),
+        )
+        self.assertEqual(len(os.listdir(os.path.join(directory, 'new'))), 6)
+
+
+class SuppressionSetTestCase(SimpleTestCase):
+    """
+    Tests for skipping suppressed recipients.
+    """
+
+    def test_filter(self):
+        suppression = SuppressionSet(
+            ['Contact1@Example.com ', 'contact3@example.com'], 2
+        )
+        recipients = suppression.filter(make_recipients(5))
+        self.assertEqual([recipient.pk for recipient in recipients], [0, 2, 4])
+        self.assertEqual(suppression.skipped, 2)
+
+    @override_settings(MAILING_SUPPRESSION_BLOOM_THRESHOLD=10)
+    def test_bloom_filter(self):
+        emails = [f'contact{number}@example.com' for number in range(100)]
+        suppression = SuppressionSet(emails, len(emails))
+        self.assertNotIsInstance(suppression._hashes, set)
+        self.assertTrue(all(
+            suppression.is_suppressed(email.upper()) for email in emails
+        ))
+        self.assertFalse(suppression.is_suppressed('other@example.com'))
+
+
+class RecipientDeduplicatorTestCase(SimpleTestCase):
+    """
+    Tests for dropping duplicate recipients in the sending process.
+    """
+
+    @override_settings(MAILING_DEDUPLICATE_IN_DB=False)
+    def test_filter(self):
+        deduplicator = RecipientDeduplicator(make_mailing())
+        recipients = deduplicator.filter([
+            Recipient(1, 'contact@example.com', ''),
+            Recipient(2, 'other@example.com', ''),
+            Recipient(3, ' Contact@Example.com', ''),
+            Recipient(1, 'contact@example.com', ''),
+        ])
+        self.assertEqual([recipient.pk for recipient in recipients], [1, 2])
+        self.assertEqual(deduplicator.dropped, 2)
+
+
+@task(max_attempts=2)
+def flaky_task(fail):
+    if fail:
+        raise ValueError('failed')
+    return fail
+
+
+class BackgroundTaskTestCase(SimpleTestCase):
+    """
+    Tests for calling background tasks.
+    """
+
+    def test_task_is_registered_by_path(self):
+        self.assertIs(get_task('mailing.tests.flaky_task'), flaky_task)
+        self.assertEqual(
+            get_task('mailing.tasks.send_email').func.__name__, 'send_email'
+        )
+        with self.assertRaises(LookupError):
+            get_task('mailing.tests.missing_task')
+
+    def test_successful_call(self):
+        background_task = BackgroundTask(
+            name=flaky_task.name, args=[False], max_attempts=2
+        )
+        self.assertTrue(execute_task(background_task))
+        self.assertEqual(background_task.status, BackgroundTask.STATUS_DONE)
+        self.assertEqual(background_task.attempts, 1)
+
+    def test_failed_call_is_retried_until_exhausted(self):
+        now = timezone.now()
+        background_task = BackgroundTask(
+            name=flaky_task.name, args=[True], max_attempts=2
+        )
+        self.assertFalse(execute_task(background_task, now))
+        self.assertEqual(
+            background_task.status, BackgroundTask.STATUS_PENDING
+        )
+        self.assertGreater(background_task.retry_at, now)
+        self.assertIn('ValueError', background_task.error)
+
+        self.assertFalse(execute_task(background_task, now))
+        self.assertEqual(background_task.status, BackgroundTask.STATUS_FAILED)
+        self.assertIsNone(background_task.retry_at)
+
+
+class PurgeTasksTestCase(TestCase):
+    """
+    Tests for deleting finished background tasks.
+    """
+
+    def test_purge_finished_tasks(self):
+        now = timezone.now()
+        old, recent = now - timedelta(days=8), now - timedelta(days=6)
+        BackgroundTask.objects.bulk_create([
+            BackgroundTask(name='done', status=BackgroundTask.STATUS_DONE,
+                           date_done=old),
+            BackgroundTask(name='recent', status=BackgroundTask.STATUS_DONE,
+                           date_done=recent),
+            BackgroundTask(name='failed',
+                           status=BackgroundTask.STATUS_FAILED),
+            BackgroundTask(name='pending'),
+        ])
+        BackgroundTask.objects.filter(name='failed').update(date_created=old)
+
+        self.assertEqual(purge_tasks(days=7, now=now), 2)
+        self.assertEqual(
+            sorted(BackgroundTask.objects.values_list('name', flat=True)),
+            ['pending', 'recent'],
+        )
+
+
+class TokenBucketsTestCase(SimpleTestCase):
+    """
+    Tests for the token buckets outgoing mail is rate limited with.
+    """
+
+    @mock.patch('mailing.ratelimit.time.monotonic', return_value=100.0)
+    def test_tokens_refill_at_rate(self, monotonic):
+        buckets = LocalTokenBuckets()
+        bucket = [('account', 2, 2, 1, 0)]
+        self.assertEqual(buckets.take(bucket), 0)
+        self.assertEqual(buckets.take(bucket), 0)
+        self.assertAlmostEqual(buckets.take(bucket), 0.5)
+        monotonic.return_value = 100.5
+        self.assertEqual(buckets.take(bucket), 0)
+
+    @mock.patch('mailing.ratelimit.time.monotonic', return_value=100.0)
+    def test_tokens_are_taken_from_all_buckets_or_none(self, monotonic):
+        buckets = LocalTokenBuckets()
+        self.assertEqual(buckets.take([('domain', 1, 1, 1, 0)]), 0)
+        self.assertGreater(
+            buckets.take([('account', 1, 1, 1, 0), ('domain', 1, 1, 1, 0)]),
+            0,
+        )
+        self.assertEqual(buckets.take([('account', 1, 1, 1, 0)]), 0)
+
+    @mock.patch('mailing.ratelimit.time.monotonic', return_value=100.0)
+    def test_batch_takes_a_token_per_recipient(self, monotonic):
+        buckets = LocalTokenBuckets()
+        self.assertEqual(buckets.take([('domain', 2, 4, 3, 0)]), 0)
+        self.assertAlmostEqual(buckets.take([('domain', 2, 4, 3, 0)]), 1)
+        # A batch above the burst waits for a full bucket and owes the rest
+        monotonic.return_value = 102.0
+        self.assertEqual(buckets.take([('domain', 2, 4, 6, 0)]), 0)
+        self.assertAlmostEqual(buckets.take([('domain', 2, 4, 1, 0)]), 1.5)
+
+    @mock.patch('mailing.ratelimit.time.monotonic', return_value=100.0)
+    def test_reserve_is_left_in_bucket(self, monotonic):
+        buckets = LocalTokenBuckets()
+        self.assertEqual(buckets.take([('domain', 1, 4, 3, 1)]), 0)
+        self.assertAlmostEqual(buckets.take([('domain', 1, 4, 1, 1)]), 1)
+        self.assertEqual(buckets.take([('domain', 1, 4, 1, 0)]), 0)
+
+    def test_message_takes_account_and_domain_buckets(self):
+        limiter = RateLimiter(
+            limits={
+                'account': (10, 20),
+                'domain': (5, 5),
+                'domains': {'gmail.com': (1, 2)},
+            },
+            backend=LocalTokenBuckets(),
+        )
+        buckets = limiter.get_buckets(
+            'sender', ['a@Gmail.com', 'b@gmail.com', 'c@example.com'],
+            PRIORITY_TRANSACTIONAL,
+        )
+        self.assertEqual(
+            [bucket[1:] for bucket in buckets],
+            [(10, 20, 1, 0), (5, 5, 1, 0), (1, 2, 2, 0)],
+        )
+        self.assertIn('sender', buckets[0][0])
+        self.assertIn('example.com', buckets[1][0])
+        self.assertIn('gmail.com', buckets[2][0])
+
+    def test_backend_of_default_cache(self):
+        with self.settings(CACHES=REDIS_CACHES):
+            self.assertIsInstance(RateLimiter().backend, RedisTokenBuckets)
+        with self.settings(CACHES=LOCAL_CACHES):
+            self.assertIsInstance(RateLimiter().backend, LocalTokenBuckets)
+
+
+@mock.patch('mailing.ratelimit.time.monotonic', return_value=100.0)
+class PriorityRateLimitTestCase(SimpleTestCase):
+    """
+    Tests for the reserved budget shares of the priority classes.
+    """
+
+    shares = {'transactional': 0.2, 'notification': 0.1, 'campaign': 0.7}
+
+    def setUp(self):
+        self.limiter = RateLimiter(
+            limits={'account': (10, 10), 'domain': (10, 10), 'domains': {}},
+            backend=LocalTokenBuckets(),
+            shares=self.shares,
+        )
+
+    def take(self, priority, account='account'):
+        return self.limiter.backend.take(
+            self.limiter.get_buckets(account, ['a@b.c'], priority)
+        )
+
+    def test_buckets_keep_reserve_of_higher_classes(self, monotonic):
+        for priority, reserve in (
+            (PRIORITY_TRANSACTIONAL, 0),
+            (PRIORITY_CAMPAIGN, 3),
+        ):
+            buckets = self.limiter.get_buckets('account', ['a@b.c'], priority)
+            self.assertEqual(
+                [bucket[4] for bucket in buckets], [reserve, reserve]
+            )
+
+    def test_campaign_does_not_use_transactional_reserve(self, monotonic):
+        for _ in range(7):
+            self.assertEqual(self.take(PRIORITY_CAMPAIGN), 0)
+        self.assertGreater(self.take(PRIORITY_CAMPAIGN), 0)
+        self.assertEqual(self.take(PRIORITY_TRANSACTIONAL), 0)
+
+    def test_campaign_does_not_drain_domain(self, monotonic):
+        for number in range(7):
+            self.assertEqual(self.take(PRIORITY_CAMPAIGN, f'a{number}'), 0)
+        self.assertGreater(self.take(PRIORITY_CAMPAIGN, 'other'), 0)
+        self.assertEqual(self.take(PRIORITY_TRANSACTIONAL, 'other'), 0)
+
+    def test_campaign_uses_idle_budget(self, monotonic):
+        for _ in range(7):
+            self.take(PRIORITY_CAMPAIGN)
+        # Nothing else is sent, so the campaign gets the full rate
+        for step in range(1, 5):
+            monotonic.return_value = 100 + step / 2
+            for _ in range(5):
+                self.assertEqual(self.take(PRIORITY_CAMPAIGN), 0)
+            self.assertGreater(self.take(PRIORITY_CAMPAIGN), 0)
+
+    def test_invalid_shares(self, monotonic):
+        for shares in (
+            {**self.shares, 'notification': 0},
+            {'transactional': 0.2, 'campaign': 0.8},
+            {**self.shares, 'campaign': 0.8},
+        ):
+            with self.assertRaises(ImproperlyConfigured):
+                RateLimiter(backend=LocalTokenBuckets(), shares=shares)
+
+
+class FairSchedulerTestCase(SimpleTestCase):
+    """
+    Tests for sharing send workers between users.
+    """
+
+    def make_scheduler(self, limits):
+        scheduler = FairScheduler(
+            quantum=10, lease=60, counters=LocalTenantCounters()
+        )
+        scheduler.get_limits = lambda user_ids: {
+            user_id: limits[user_id] for user_id in user_ids
+        }
+        return scheduler
+
+    def make_queues(self, **sizes):
+        queues = {
+            user_id: list(range(size)) for user_id, size in sizes.items()
+        }
+
+        def claim_for_user(user_id, size):
+            batch = queues[user_id][:size]
+            del queues[user_id][:size]
+            return batch
+
+        return queues, claim_for_user
+
+    def run_turns(self, scheduler, queues, claim_for_user, count):
+        turns = []
+        for _ in range(count):
+            users = [user_id for user_id, queue in queues.items() if queue]
+            turn = scheduler.claim(users, claim_for_user, 100)
+            if turn is None:
+                break
+            scheduler.release(turn)
+            turns.append((turn.user_id, len(turn.items)))
+        return turns
+
+    def test_counters_of_default_cache(self):
+        with self.settings(CACHES=REDIS_CACHES):
+            counters = FairScheduler().counters
+        self.assertIsInstance(counters, RedisTenantCounters)
+        with self.settings(CACHES=LOCAL_CACHES):
+            counters = FairScheduler().counters
+        self.assertIsInstance(counters, LocalTenantCounters)
+
+    def test_round_robin_by_weight(self):
+        scheduler = self.make_scheduler({'a': (1, 4, 0), 'b': (2, 4, 0)})
+        queues, claim_for_user = self.make_queues(a=1000, b=30)
+        self.assertEqual(
+            self.run_turns(scheduler, queues, claim_for_user, 5),
+            [('a', 10), ('b', 20), ('a', 10), ('b', 10), ('a', 10)],
+        )
+
+    def test_weights_apply_when_quantum_fills_a_batch(self):
+        scheduler = self.make_scheduler({'a': (1, 4, 0), 'b': (3, 4, 0)})
+        scheduler.quantum = 100
+        queues, claim_for_user = self.make_queues(a=1000, b=1000)
+        turns = self.run_turns(scheduler, queues, claim_for_user, 8)
+        self.assertEqual(
+            [user_id for user_id, size in turns],
+            ['a', 'b', 'b', 'b', 'a', 'b', 'b', 'b'],
+        )
+        self.assertTrue(all(size == 100 for user_id, size in turns))
+
+    def test_user_ids_are_cached(self):
+        scheduler = self.make_scheduler({})
+        load = mock.Mock(return_value=['a'])
+        with mock.patch('mailing.fairshare.time.monotonic',
+                        return_value=100.0) as monotonic:
+            self.assertEqual(scheduler.get_user_ids(load), ['a'])
+            self.assertEqual(scheduler.get_user_ids(load), ['a'])
+            self.assertEqual(load.call_count, 1)
+            monotonic.return_value = 100.0 + scheduler.users_ttl
+            scheduler.get_user_ids(load)
+            self.assertEqual(load.call_count, 2)
+            # Nobody could be claimed for, so the users are loaded again
+            self.assertIsNone(scheduler.claim([], None, 100))
+            scheduler.get_user_ids(load)
+            self.assertEqual(load.call_count, 3)
+
+    def test_concurrency_cap(self):
+        scheduler = self.make_scheduler({'a': (1, 1, 0), 'b': (1, 1, 0)})
+        queues, claim_for_user = self.make_queues(a=100, b=100)
+        first = scheduler.claim(['a', 'b'], claim_for_user, 100)
+        second = scheduler.claim(['a', 'b'], claim_for_user, 100)
+        self.assertEqual((first.user_id, second.user_id), ('a', 'b'))
+        self.assertIsNone(scheduler.claim(['a', 'b'], claim_for_user, 100))
+        scheduler.release(first)
+        self.assertEqual(
+            scheduler.claim(['a', 'b'], claim_for_user, 100).user_id, 'a'
+        )
+
+    def test_daily_quota(self):
+        scheduler = self.make_scheduler({'a': (1, 4, 25)})
+        queues, claim_for_user = self.make_queues(a=100)
+        self.assertEqual(
+            self.run_turns(scheduler, queues, claim_for_user, 5),
+            [('a', 10), ('a', 10), ('a', 5)],
+        )
+
+
+class MailingLockTestCase(SimpleTestCase):
+    """
+    Tests for the lock a mailing is run under.
+    """
+
+    def setUp(self):
+        self.backend = LocalLocks()
+
+    def make_lock(self, slot, mailing_pk=1):
+        return MailingLock(mailing_pk, slot, lease=60, backend=self.backend)
+
+    def test_mailing_runs_once_at_a_time(self):
+        first = self.make_lock('10:00')
+        self.assertTrue(first.acquire())
+        second = self.make_lock('11:00')
+        self.assertFalse(second.acquire())
+        self.assertEqual(second.reason, 'already running')
+        self.assertTrue(self.make_lock('11:00', mailing_pk=2).acquire())
+        first.release()
+
+        self.assertTrue(second.acquire())
+        self.assertGreater(second.token, 1)
+        second.release()
+
+    def test_slot_runs_once(self):
+        lock = self.make_lock('10:00')
+        self.assertTrue(lock.acquire())
+        lock.release()
+        again = self.make_lock('10:00')
+        self.assertFalse(again.acquire())
+        self.assertEqual(again.reason, 'slot 10:00 already run')
+
+    def test_stale_token_cannot_renew(self):
+        lock = self.make_lock('10:00')
+        self.assertTrue(lock.acquire())
+        key = lock._key
+        self.assertTrue(self.backend.renew(key, lock.token, 60))
+        self.assertFalse(self.backend.renew(key, lock.token + 1, 60))
+        lock.release()
+        self.assertFalse(self.backend.renew(key, 1, 60))
+
+    @mock.patch('mailing.locks._backend', None)
+    def test_backend_of_default_cache(self):
+        with self.settings(CACHES=REDIS_CACHES):
+            self.assertIsInstance(get_lock_backend(), RedisLocks)
+
+    @mock.patch('mailing.locks._backend', None)
+    def test_local_backend_without_redis(self):
+        with self.settings(CACHES=LOCAL_CACHES):
+            self.assertIsInstance(get_lock_backend(), LocalLocks)
@@ -3,7 +3,8 @@ from django.urls import path
 from mailing.apps import MailingConfig
 from mailing.views import (
     MailingCreateView, MailingDeleteView,
-    MailingListView, MailingUpdateView, MailingDetailView, start_stop_mailing
+    MailingListView, MailingUpdateView, MailingDetailView, start_stop_mailing,
+    control_run
 )
 
 app_name = MailingConfig.name
@@ -35,4 +36,9 @@ urlpatterns = [
         name='delete_mailing'
     ),
     path('start/<int:pk>', start_stop_mailing, name='start_mailing'),
+    path(
+        'run/<int:pk>/<str:action>',
+        control_run,
+        name='control_run'
+    ),
 ]
@@ -1,5 +1,6 @@
 from datetime import date
 
+from django.conf import settings
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.forms import inlineformset_factory
 from django.http import Http404
@@ -10,7 +11,8 @@ from django.views.generic import (
 )
 
 from mailing.forms import MailingForm, MailingSettingsForm
-from mailing.models import Mailing, MailingSettings
+from mailing.control import cancel_run, pause_run, resume_run
+from mailing.models import Mailing, MailingRun, MailingSettings
 from mailing.service import create_cron_jobs, remove_cron_jobs
 
 
@@ -157,6 +159,7 @@ class MailingDetailView(LoginRequiredMixin, DetailView):
 
     Methods:
         get_queryset: Get the queryset for the view.
+        get_context_data: Add the latest runs of the mailing.
     """
     model = Mailing
     template_name = 'mailing/mailing_detail.html'
@@ -183,6 +186,17 @@ class MailingDetailView(LoginRequiredMixin, DetailView):
 
         return queryset
 
+    def get_context_data(self, **kwargs):
+        """
+        Add the latest runs of the mailing to the context.
+
+        Returns:
+            dict: A dictionary containing context data.
+        """
+        context = super().get_context_data(**kwargs)
+        context['runs'] = self.object.runs.order_by('-pk')[:10]
+        return context
+
 
 class MailingUpdateView(LoginRequiredMixin, UpdateView):
     """
@@ -312,12 +326,50 @@ def start_stop_mailing(request, *args, **kwargs):
     if mailing.setting.status == 'completed':
         if mailing.setting.start_date <= date.today() <= mailing.setting.end_date:
             mailing.setting.status = 'running'
-            create_cron_jobs(mailing)
+            if settings.MAILING_USE_CRONTAB:
+                create_cron_jobs(mailing)
         else:
             print('mailing out of date')
     elif mailing.setting.status == 'running':
         mailing.setting.status = 'completed'
-        remove_cron_jobs(mailing)
+        if settings.MAILING_USE_CRONTAB:
+            remove_cron_jobs(mailing)
     mailing.setting.save()
 
     return redirect('mailings:list_mailing')
+
+
+def control_run(request, *args, **kwargs):
+    """
+    View for pausing, resuming or cancelling a run of a mailing.
+
+    Only the author of the mailing and managers may control its runs.
+
+    Args:
+        request (HttpRequest): The HTTP request object.
+        *args: Variable length argument list.
+        **kwargs: Keyword arguments, including 'pk' and 'action'.
+
+    Returns:
+        HttpResponse: A redirect to the details of the mailing.
+    """
+    if request.method != 'POST' or not request.user.is_authenticated:
+        raise Http404
+    runs = MailingRun.objects.select_related('mailing')
+    if not request.user.groups.filter(name='manager').exists():
+        runs = runs.filter(mailing__user=request.user)
+    try:
+        run = runs.get(pk=kwargs['pk'])
+    except MailingRun.DoesNotExist:
+        raise Http404
+
+    actions = {
+        'pause': pause_run,
+        'resume': resume_run,
+        'cancel': cancel_run,
+    }
+    if kwargs['action'] not in actions:
+        raise Http404
+    actions[kwargs['action']](run.pk)
+
+    return redirect('mailings:detail_mailing', pk=run.mailing_id)
@@ -1,6 +1,10 @@
 import re
+import resource
 from datetime import datetime
 
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.redis import RedisCache
 from django.core.mail import send_mail
 
 
@@ -30,27 +34,88 @@ def save_picture(instance, filename):
     return f"{app_name}/{model_name}/{instance.pk}/{instance.pk}_{picture_name}"
 
 
-def view_counter_email_notification(views_count, title):
+def is_redis_cache(alias='default'):
     """
-    Send an email notification when a post reaches a specific view count.
+    Check whether a cache is stored in Redis.
+
+    `django.core.cache.cache` is a proxy, so the backend is looked up in
+    `caches` instead.
+
+    Args:
+        alias (str, optional): The alias of the cache.
+
+    Returns:
+        bool: True if the cache uses the Redis backend.
+    """
+    return isinstance(caches[alias], RedisCache)
+
+
+_redis_clients = {}
+
+
+def get_redis_client(alias='default'):
+    """
+    Get a Redis client for the server of a Redis cache.
+
+    The client is built from the `LOCATION` of the cache in
+    `settings.CACHES`, the first server of which takes the writes, and
+    is shared by the current process.
+
+    Args:
+        alias (str, optional): The alias of the cache.
+
+    Returns:
+        redis.Redis: The client of the write server of the cache.
+    """
+    if alias not in _redis_clients:
+        import redis
+
+        location = settings.CACHES[alias]['LOCATION']
+        if isinstance(location, str):
+            location = location.split(',')
+        _redis_clients[alias] = redis.Redis.from_url(location[0])
+    return _redis_clients[alias]
+
+
+def get_view_counter_notification(views_count, title):
+    """
+    Build the email notification of a post reaching a specific view count.
 
     Args:
         views_count (int): The current view count of the post.
         title (str): The title of the post.
 
     Returns:
-        None
+        tuple | None: The subject, the message and the recipient list, or
+            None if no notification is due.
     """
     if views_count == 100:
         subject = f'Congratulations!'
         message = f'<p>The post "{title}" has reached ' \
                   f'100 views.</p>'
         email = 'mr.saatchyan@yandex.com'
+        return subject, message, [email]
+    return None
+
+
+def view_counter_email_notification(views_count, title):
+    """
+    Send an email notification when a post reaches a specific view count.
+
+    Args:
+        views_count (int): The current view count of the post.
+        title (str): The title of the post.
 
+    Returns:
+        None
+    """
+    notification = get_view_counter_notification(views_count, title)
+    if notification is not None:
+        subject, message, recipient_list = notification
         send_mail(
             subject=subject,
             from_email=None,
-            recipient_list=[email],
+            recipient_list=recipient_list,
             message=message
         )
 
@@ -77,3 +142,27 @@ def validate_email_address(email_address):
         print(f"The email address {email_address} is not valid")
         return False
     return True
+
+
+def get_memory_usage():
+    """
+    Get the current and peak resident set size of the current process.
+
+    The current RSS is read from `/proc/self/status` where available;
+    on other platforms only the peak value reported by `getrusage` is
+    known and is returned for both.
+
+    Returns:
+        tuple: The current and the peak RSS in kilobytes.
+    """
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    current_rss = peak_rss
+    try:
+        with open('/proc/self/status') as status_file:
+            for line in status_file:
+                if line.startswith('VmRSS:'):
+                    current_rss = int(line.split()[1])
+                    break
+    except OSError:
+        pass
+    return current_rss, max(current_rss, peak_rss)
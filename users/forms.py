@@ -9,6 +9,7 @@ from django.forms import HiddenInput
 
 from frontend.forms import StyleFormMixin
 from users.models import User
+from users.tasks import USER_CONTEXT, send_password_reset_email
 
 class RegisterForm(StyleFormMixin, UserCreationForm):
     """
@@ -91,6 +92,40 @@ class PasswordResetForm(StyleFormMixin, BasePasswordResetForm):
 
     email_template_name = 'users/registration/password_reset_email.html'
 
+    def send_mail(self, subject_template_name, email_template_name,
+                  context, from_email, to_email,
+                  html_email_template_name=None):
+        """
+        Send the password reset email in the background.
+
+        Only the primary key of the user and the template names are
+        enqueued, the email and its reset token are made by the worker.
+
+        Args:
+            subject_template_name (str): The template of the subject.
+            email_template_name (str): The template of the body.
+            context (dict): The template context.
+            from_email (str): The sender address.
+            to_email (str): The recipient address.
+            html_email_template_name (str, optional): The template of
+                the HTML body.
+
+        Returns:
+            None
+        """
+        send_password_reset_email.delay(
+            user_pk=context['user'].pk,
+            subject_template_name=subject_template_name,
+            email_template_name=email_template_name,
+            context={
+                key: value for key, value in context.items()
+                if key not in USER_CONTEXT
+            },
+            from_email=from_email,
+            to_email=to_email,
+            html_email_template_name=html_email_template_name
+        )
+
 
 class SetPasswordForm(StyleFormMixin, BaseSetPasswordForm):
     """
@@ -0,0 +1,100 @@
+from django.contrib.auth.tokens import default_token_generator
+from django.template import loader
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+
+from mailing.models import PRIORITY_TRANSACTIONAL
+from mailing.tasks import send_email, task
+from users.models import User
+from users.tokens import generate_token
+
+# Entries of a password reset context holding the user or its token, they
+# are never enqueued and are made by the worker instead
+USER_CONTEXT = ('user', 'uid', 'token')
+
+
+@task(priority=PRIORITY_TRANSACTIONAL)
+def send_password_reset_email(user_pk, subject_template_name,
+                              email_template_name, context, from_email,
+                              to_email, html_email_template_name=None):
+    """
+    Render a password reset email and send it.
+
+    The reset token is made when the email is rendered, so it is never
+    stored with the task. Nothing is sent if the user was deleted.
+
+    Args:
+        user_pk (int): The primary key of the user.
+        subject_template_name (str): The template of the subject.
+        email_template_name (str): The template of the body.
+        context (dict): The template context without the user and its
+            token.
+        from_email (str): The sender address.
+        to_email (str): The recipient address.
+        html_email_template_name (str, optional): The template of the
+            HTML body.
+
+    Returns:
+        None
+    """
+    user = User.objects.filter(pk=user_pk).first()
+    if user is None:
+        return
+
+    context = {
+        **context,
+        'user': user,
+        'uid': urlsafe_base64_encode(force_bytes(user.pk)),
+        'token': default_token_generator.make_token(user),
+    }
+    subject = loader.render_to_string(subject_template_name, context)
+    subject = ''.join(subject.splitlines())
+    body = loader.render_to_string(email_template_name, context)
+    html_message = None
+    if html_email_template_name is not None:
+        html_message = loader.render_to_string(
+            html_email_template_name, context
+        )
+    send_email(
+        subject=subject,
+        message=body,
+        recipient_list=[to_email],
+        from_email=from_email,
+        html_message=html_message
+    )
+
+
+@task(priority=PRIORITY_TRANSACTIONAL)
+def send_verification_email(user_pk, domain):
+    """
+    Render an email verification email and send it.
+
+    The verification token is made when the email is rendered, so it is
+    never stored with the task. Nothing is sent if the user was deleted.
+
+    Args:
+        user_pk (int): The primary key of the user.
+        domain (str): The domain of the site the link points to.
+
+    Returns:
+        None
+    """
+    user = User.objects.filter(pk=user_pk).first()
+    if user is None:
+        return
+
+    message = loader.render_to_string(
+        'users/registration/verification_email.html',
+        {
+            'user': user,
+            'uid': urlsafe_base64_encode(force_bytes(user.pk)),
+            'domain': domain,
+            'token': generate_token.make_token(user)
+        }
+    )
+    send_email(
+        subject='Подтверждение электронной почты',
+        message=message,
+        recipient_list=[user.email],
+        html_message=message
+    )
@@ -1,3 +1,69 @@
-from django.test import TestCase
+import re
 
-# Create your tests here.
+from django.contrib.auth.tokens import default_token_generator
+from django.core import mail
+from django.test import TestCase, override_settings
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+
+from mailing.models import BackgroundTask
+from mailing.tasks import execute_task
+from users.forms import PasswordResetForm
+from users.models import User
+from users.tasks import send_verification_email
+from users.tokens import generate_token
+
+
+@override_settings(TASKS_EAGER=False, MAILING_RATE_LIMIT_ENABLED=False)
+class AccountEmailTestCase(TestCase):
+    """
+    Tests for sending account emails in the background.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(
+            email='user@example.com', is_active=True
+        )
+        self.user.set_password('secret-password')
+        self.user.save()
+        self.uid = urlsafe_base64_encode(force_bytes(self.user.pk))
+
+    def get_token(self, body, path):
+        match = re.search(rf'/{path}/{self.uid}/([\w-]+)/', body)
+        self.assertIsNotNone(match)
+        return match.group(1)
+
+    def test_password_reset_token_is_not_enqueued(self):
+        form = PasswordResetForm(data={'email': self.user.email})
+        self.assertTrue(form.is_valid())
+        with self.captureOnCommitCallbacks(execute=True):
+            form.save(
+                domain_override='example.com',
+                email_template_name=PasswordResetForm.email_template_name,
+            )
+
+        background_task = BackgroundTask.objects.get()
+        self.assertEqual(background_task.kwargs['user_pk'], self.user.pk)
+        self.assertFalse(
+            {'user', 'uid', 'token'} & set(background_task.kwargs['context'])
+        )
+
+        self.assertTrue(execute_task(background_task))
+        self.assertEqual(mail.outbox[0].to, [self.user.email])
+        token = self.get_token(mail.outbox[0].body, 'reset')
+        self.assertTrue(default_token_generator.check_token(self.user, token))
+
+    def test_verification_token_is_not_enqueued(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            send_verification_email.delay(self.user.pk, 'example.com')
+
+        background_task = BackgroundTask.objects.get()
+        self.assertEqual(background_task.args, [self.user.pk, 'example.com'])
+
+        self.assertTrue(execute_task(background_task))
+        token = self.get_token(mail.outbox[0].body, 'verify_email')
+        self.assertTrue(generate_token.check_token(self.user, token))
+
+    def test_deleted_user_is_skipped(self):
+        send_verification_email(self.user.pk + 1, 'example.com')
+        self.assertEqual(mail.outbox, [])
@@ -0,0 +1,25 @@
+from django.contrib.auth.tokens import PasswordResetTokenGenerator
+
+
+class TokenGenerator(PasswordResetTokenGenerator):
+    """
+    Token generator for password reset.
+
+    This class generates a unique token for resetting a user's password.
+
+    Methods:
+        _make_hash_value(self, user, timestamp): Generates a hash value for the token.
+
+    Attributes:
+        None
+
+    Returns:
+        None
+    """
+    def _make_hash_value(self, user, timestamp):
+        return (
+                str(user.pk) + str(timestamp) + str(user.is_active)
+        )
+
+
+generate_token = TokenGenerator()
@@ -1,7 +1,6 @@
 from django.contrib.auth import get_user_model
 from django.contrib.auth.mixins import LoginRequiredMixin, \
     PermissionRequiredMixin
-from django.contrib.auth.tokens import PasswordResetTokenGenerator
 from django.contrib.auth.views import LoginView as BaseLoginView
 from django.contrib.auth.views import LogoutView as BaseLogoutView
 from django.contrib.auth.views import (
@@ -23,42 +22,18 @@ from django.contrib.auth.views import (
     PasswordResetView as BasePasswordResetView
 )
 from django.contrib.sites.shortcuts import get_current_site
-from django.core.mail import send_mail
 from django.http import Http404
 from django.shortcuts import render, redirect
-from django.template.loader import render_to_string
 from django.urls import reverse_lazy, reverse
-from django.utils.encoding import force_str, force_bytes
-from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
+from django.utils.encoding import force_str
+from django.utils.http import urlsafe_base64_decode
 from django.views.generic import CreateView, UpdateView, DetailView, ListView
 
 from users.forms import RegisterForm, LoginForm, UserChangeForm, \
     PasswordResetForm, PasswordChangeForm, SetPasswordForm
 from users.models import User
-
-
-class TokenGenerator(PasswordResetTokenGenerator):
-    """
-    Token generator for password reset.
-
-    This class generates a unique token for resetting a user's password.
-
-    Methods:
-        _make_hash_value(self, user, timestamp): Generates a hash value for the token.
-
-    Attributes:
-        None
-
-    Returns:
-        None
-    """
-    def _make_hash_value(self, user, timestamp):
-        return (
-                str(user.pk) + str(timestamp) + str(user.is_active)
-        )
-
-
-generate_token = TokenGenerator()
+from users.tasks import send_verification_email
+from users.tokens import generate_token
 
 
 class RegisterView(CreateView):
@@ -85,32 +60,18 @@ class RegisterView(CreateView):
         """
         Sends a verification email to the user.
 
+        The email is rendered and sent in the background once the user
+        is committed. Only the primary key of the user is enqueued, the
+        token is made by the worker.
+
         Args:
             user: The user to send the email to.
 
         Returns:
             None
         """
-        token = generate_token.make_token(user)
-        uid = urlsafe_base64_encode(force_bytes(user.pk))
-        current_site = get_current_site(self.request)
-        mail_subject = 'Подтверждение электронной почты'
-        message = render_to_string(
-            'users/registration/verification_email.html',
-            {
-                'user': user,
-                'uid': uid,
-                'domain': current_site.domain,
-                'token': token
-            }
-        )
-
-        send_mail(
-            subject=mail_subject,
-            message=message,
-            from_email=None,
-            recipient_list=[user.email],
-            html_message=message
+        send_verification_email.delay(
+            user.pk, get_current_site(self.request).domain
         )
 
     def form_valid(self, form):